@@ -24,7 +24,61 @@ class Settings(BaseSettings):
     MAX_LENGTH: int = int(os.getenv("MAX_LENGTH", "2048"))
     TEMPERATURE: float = float(os.getenv("TEMPERATURE", "0.7"))
     TOP_P: float = float(os.getenv("TOP_P", "0.9"))
-    
+
+    # CPU quantization: "none" (fp32), "int8" (dynamic) or "int4" (weight-only)
+    QUANTIZATION_MODE: str = os.getenv("QUANTIZATION_MODE", "none").lower()
+    QUANTIZED_CHECKPOINT_DIR: str = os.getenv("QUANTIZED_CHECKPOINT_DIR", "./models/quantized")
+
+    # Weight loading on CPU: "default" (private copy) or "mmap" (page-cache backed, shared by uvicorn workers)
+    MODEL_LOAD_MODE: str = os.getenv("MODEL_LOAD_MODE", "default").lower()
+
+    # Speculative decoding for debug/refactor: "off", "ngram" (prompt lookup) or "draft" (small draft model)
+    SPECULATIVE_MODE: str = os.getenv("SPECULATIVE_MODE", "off").lower()
+    SPECULATIVE_NUM_TOKENS: int = int(os.getenv("SPECULATIVE_NUM_TOKENS", "10"))
+    DRAFT_MODEL_PATH: str = os.getenv("DRAFT_MODEL_PATH", "")
+
+    # Batching (requests arriving within the wait window share one generate call)
+    BATCH_MAX_SIZE: int = int(os.getenv("BATCH_MAX_SIZE", "4"))
+    BATCH_MAX_WAIT_MS: int = int(os.getenv("BATCH_MAX_WAIT_MS", "20"))
+
+    # Reuse the KV cache of the fixed Alpaca preamble instead of re-encoding it
+    PREFIX_CACHE_ENABLED: bool = os.getenv("PREFIX_CACHE_ENABLED", "true").lower() == "true"
+
+    # Exact-match cache for greedy/seeded requests
+    RESPONSE_CACHE_MAX_ENTRIES: int = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+    RESPONSE_CACHE_MAX_BYTES: int = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+    RESPONSE_CACHE_TTL_SECONDS: float = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+
+    # Explain inputs above EXPLAIN_CHUNK_TOKENS chunk by chunk (function/class boundaries), then summarise
+    EXPLAIN_CHUNKING_ENABLED: bool = os.getenv("EXPLAIN_CHUNKING_ENABLED", "true").lower() == "true"
+    EXPLAIN_CHUNK_TOKENS: int = int(os.getenv("EXPLAIN_CHUNK_TOKENS", "512"))
+    EXPLAIN_CHUNK_CACHE_ENTRIES: int = int(os.getenv("EXPLAIN_CHUNK_CACHE_ENTRIES", "4096"))
+
+    # Serve stored passing solutions for near-identical prompts (Jaccard similarity 0-1)
+    SOLUTION_INDEX_ENABLED: bool = os.getenv("SOLUTION_INDEX_ENABLED", "true").lower() == "true"
+    SOLUTION_SIMILARITY_THRESHOLD: float = float(os.getenv("SOLUTION_SIMILARITY_THRESHOLD", "0.8"))
+    SOLUTIONS_DIR: str = os.getenv("SOLUTIONS_DIR", "solutions")
+
+    # Inference executor (keeps blocking generation off the event loop)
+    INFERENCE_MAX_WORKERS: int = int(os.getenv("INFERENCE_MAX_WORKERS", os.getenv("BATCH_MAX_SIZE", "4")))
+    INFERENCE_QUEUE_SIZE: int = int(os.getenv("INFERENCE_QUEUE_SIZE", "16"))
+    INFERENCE_TIMEOUT_SECONDS: float = float(os.getenv("INFERENCE_TIMEOUT_SECONDS", "120"))
+
+    # Generate-and-test: sample several candidates and check them against test_runner.py in one request
+    TEST_RUNNER_URL: str = os.getenv("TEST_RUNNER_URL", "http://localhost:9000")
+    TEST_RUNNER_TIMEOUT_SECONDS: float = float(os.getenv("TEST_RUNNER_TIMEOUT_SECONDS", "30"))
+    GENERATE_AND_TEST_MAX_CANDIDATES: int = int(os.getenv("GENERATE_AND_TEST_MAX_CANDIDATES", "8"))
+
+    # Chat conversations: LRU of recently used conversations (stored in MongoDB chat_history)
+    CONVERSATION_CACHE_SIZE: int = int(os.getenv("CONVERSATION_CACHE_SIZE", "256"))
+    CONVERSATION_CACHE_TTL_SECONDS: float = float(os.getenv("CONVERSATION_CACHE_TTL_SECONDS", "30"))
+
+    # Multi-turn chat: prompt budget for recent turns (older ones are summarised) and per-conversation KV caches
+    CHAT_HISTORY_TOKENS: int = int(os.getenv("CHAT_HISTORY_TOKENS", "1024"))
+    CHAT_HISTORY_MAX_MESSAGES: int = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "40"))
+    CHAT_SUMMARY_TOKENS: int = int(os.getenv("CHAT_SUMMARY_TOKENS", "128"))
+    CHAT_KV_CACHE_CONVERSATIONS: int = int(os.getenv("CHAT_KV_CACHE_CONVERSATIONS", "8"))
+
     # ✅ MongoDB Configuration (ADD THESE LINES!)
     MONGODB_URL: str = os.getenv("MONGODB_URL", "")
     DATABASE_NAME: str = os.getenv("DATABASE_NAME", "codegen_ai")
@@ -1,9 +1,14 @@
 # app/main.py
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from app.config import settings
 from app.routes import auth, chat, code_generation
 from app.services.database import connect_to_database, close_database_connection
+from app.services.inference import shutdown_inference_executor
+from app.services.solution_index import get_solution_index
+from app.utils.memory import process_memory
+import asyncio
 import logging
 from dotenv import load_dotenv
 
@@ -36,25 +41,15 @@ app.add_middleware(
 async def startup_event():
     logger.info("🚀 Starting CodeGen AI backend...")
     
-    # Connect to MongoDB
-    logger.info("📊 Connecting to MongoDB...")
-    await connect_to_database()
-    
-    # Initialize Gemma/Luffy model
+    # Initialize Gemma/Luffy model in the background so the app accepts requests right away;
+    # model routes answer 503 "warming_up" until it is ready (see /health/ready)
     logger.info(f"🤖 Model path: {settings.MODEL_PATH}")
     logger.info(f"🤖 Model name: {settings.MODEL_NAME}")
     
     try:
         from app.services.gemma_service import GemmaService
-        logger.info("Initializing Gemma/Luffy model...")
-        gemma_service = GemmaService()
-        app.state.gemma_service = gemma_service
-        
-        if gemma_service.is_loaded():
-            logger.info("✅ Model loaded successfully!")
-        else:
-            logger.warning("⚠️ Model not loaded - using mock responses")
-            app.state.gemma_service = None
+        logger.info("Initializing Gemma/Luffy model in the background...")
+        app.state.gemma_service = GemmaService(background=True)
     except Exception as e:
         logger.error(f"❌ Failed to initialize model: {e}")
         import traceback
@@ -62,13 +57,36 @@ async def startup_event():
         logger.warning("Starting without model - will return mock responses")
         app.state.gemma_service = None
     
+    # Connect to MongoDB
+    logger.info("📊 Connecting to MongoDB...")
+    await connect_to_database()
+    
+    if settings.SOLUTION_INDEX_ENABLED:
+        asyncio.create_task(load_solution_index())
+    
     logger.info("✅ CodeGen AI backend started successfully!")
 
+async def load_solution_index():
+    """Index stored passing solutions so generate_code can reuse them"""
+    from app.services.database import get_solutions_collection
+    
+    index = get_solution_index()
+    try:
+        solutions = get_solutions_collection()
+        if solutions is not None:
+            count = await index.load_from_database(solutions)
+        else:
+            count = index.load_from_directory(settings.SOLUTIONS_DIR)
+        logger.info(f"📚 Solution index ready: {count} passing solutions")
+    except Exception as e:
+        logger.error(f"❌ Failed to build solution index: {e}")
+
 # Shutdown event
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("👋 Shutting down CodeGen AI backend...")
     await close_database_connection()
+    shutdown_inference_executor()
     logger.info("✅ Shutdown complete")
 
 # Include routers
@@ -87,6 +105,39 @@ async def root():
         "database": "MongoDB Atlas"
     }
 
+def _model_state() -> str:
+    gemma_service = getattr(app.state, "gemma_service", None)
+    return gemma_service.status if gemma_service is not None else "unavailable"
+
+@app.get("/health/live")
+async def liveness_check():
+    """The process is up and serving requests (model may still be loading)"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Ready for model traffic once the model finished loading"""
+    from app.services.database import db
+    
+    model_state = _model_state()
+    body = {
+        "status": "ready" if model_state == "ready" else "warming_up" if model_state == "loading" else "not_ready",
+        "model_status": model_state,
+        "database_connected": db.client is not None,
+    }
+    if model_state != "ready":
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+@app.get("/health/memory")
+async def memory_check():
+    """Resident memory of the worker that answered (RSS/PSS, shared vs private)"""
+    return {
+        "model_load_mode": settings.MODEL_LOAD_MODE,
+        "quantization_mode": settings.QUANTIZATION_MODE,
+        **process_memory(),
+    }
+
 @app.get("/health")
 async def health_check():
     from app.services.database import db
@@ -96,8 +147,12 @@ async def health_check():
     
     return {
         "status": "healthy",
+        "model_status": _model_state(),
         "model_loaded": model_status,
         "model_name": settings.MODEL_NAME if model_status else "mock",
         "database_connected": db_status,
-        "model_path": settings.MODEL_PATH
+        "model_path": settings.MODEL_PATH,
+        "generation_stats": app.state.gemma_service.get_stats() if model_status else None,
+        "response_cache": app.state.gemma_service.response_cache.stats() if model_status else None,
+        "solution_index": get_solution_index().stats() if settings.SOLUTION_INDEX_ENABLED else None
     }
\ No newline at end of file
@@ -1,17 +1,19 @@
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 import logging
+from app.config import settings
+from app.services.chat_context import ChatTurn, pair_turns
+from app.services.conversation_store import decode_cursor, encode_cursor, get_conversation_store
+from app.services.inference import run_inference, stream_inference, get_model_service
+from app.utils.sse import SSE_HEADERS, stream_generation_events
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# In-memory storage
-conversations_db = {}
-messages_db = {}
-
 class ChatMessage(BaseModel):
     message: str
     conversation_id: Optional[int] = None
@@ -21,6 +23,30 @@ class ChatResponse(BaseModel):
     conversation_id: int
     timestamp: str
 
+async def _get_or_create_conversation(chat_message: ChatMessage) -> int:
+    """Return the conversation id for a chat message, creating the conversation if needed"""
+    store = get_conversation_store()
+    if chat_message.conversation_id is None:
+        conversation = await store.create(chat_message.message)
+        return conversation["_id"]
+    
+    conv_id = chat_message.conversation_id
+    if not await store.exists(conv_id):
+        logger.warning(f"⚠️ Conversation {conv_id} not found, creating new one")
+        await store.create(chat_message.message, conv_id=conv_id)
+    logger.info(f"📝 Using conversation: {conv_id}")
+    return conv_id
+
+async def _load_history(conv_id: Optional[int]) -> List[ChatTurn]:
+    """Recent completed turns of a conversation (empty for a new one)"""
+    if conv_id is None:
+        return []
+    result = await get_conversation_store().get_messages(conv_id, limit=settings.CHAT_HISTORY_MAX_MESSAGES)
+    if result is None:
+        return []
+    _, messages = result
+    return pair_turns(messages)
+
 @router.post("/generate", response_model=ChatResponse)
 async def generate_code_chat(request: Request, chat_message: ChatMessage):
     """Generate code based on chat message - NO AUTH FOR TESTING"""
@@ -30,68 +56,28 @@ async def generate_code_chat(request: Request, chat_message: ChatMessage):
         logger.info(f"📋 Conversation ID: {chat_message.conversation_id}")
         logger.info("="*80)
         
-        # Get service from app.state
-        gemma_service = request.app.state.gemma_service
-        
-        if not gemma_service:
-            logger.error("❌ Service not initialized!")
-            raise HTTPException(
-                status_code=503,
-                detail="Model service not available"
-            )
+        # Get service from app.state (503 while warming up or unavailable)
+        gemma_service = get_model_service(request, "Model service not available")
         
         logger.info(f"📊 Model loaded: {gemma_service.is_loaded()}")
         
-        # Create or get conversation
-        if chat_message.conversation_id is None:
-            conv_id = len(conversations_db) + 1
-            conversations_db[conv_id] = {
-                'id': conv_id,
-                'user_id': 1,
-                'title': chat_message.message[:50] + ('...' if len(chat_message.message) > 50 else ''),
-                'created_at': datetime.utcnow().isoformat(),
-                'updated_at': datetime.utcnow().isoformat(),
-                'messages': []
-            }
-            logger.info(f"📝 Created new conversation: {conv_id}")
-        else:
-            conv_id = chat_message.conversation_id
-            if conv_id not in conversations_db:
-                logger.warning(f"⚠️ Conversation {conv_id} not found, creating new one")
-                conversations_db[conv_id] = {
-                    'id': conv_id,
-                    'user_id': 1,
-                    'title': chat_message.message[:50] + ('...' if len(chat_message.message) > 50 else ''),
-                    'created_at': datetime.utcnow().isoformat(),
-                    'updated_at': datetime.utcnow().isoformat(),
-                    'messages': []
-                }
-            logger.info(f"📝 Using conversation: {conv_id}")
-        
-        # Store user message
-        user_msg_id = len(messages_db) + 1
-        messages_db[user_msg_id] = {
-            'id': user_msg_id,
-            'conversation_id': conv_id,
-            'role': 'user',
-            'content': chat_message.message,
-            'timestamp': datetime.utcnow().isoformat(),
-        }
-        
-        # Add to conversation
-        if 'messages' not in conversations_db[conv_id]:
-            conversations_db[conv_id]['messages'] = []
-        conversations_db[conv_id]['messages'].append(user_msg_id)
+        store = get_conversation_store()
+        conv_id = await _get_or_create_conversation(chat_message)
+        history = await _load_history(conv_id)
+        await store.append_message(conv_id, 'user', chat_message.message)
         
         # GENERATE WITH MODEL
         logger.info("🤖 Generating response with Luffy model...")
         
         if gemma_service.is_loaded():
             try:
-                # ✅ CORRECT: Using exact parameters from gemma_service.generate_code()
-                response_text = gemma_service.generate_code(
-                    prompt=chat_message.message,
-                    max_length=512,        # ✅ Correct parameter name
+                # Recent turns go into the prompt; the previous turn's KV cache is reused
+                response_text = await run_inference(
+                    gemma_service.chat,
+                    conversation_id=conv_id,
+                    message=chat_message.message,
+                    history=history,
+                    max_length=512,
                     temperature=0.7,
                     top_p=0.9,
                     top_k=50
@@ -99,6 +85,8 @@ async def generate_code_chat(request: Request, chat_message: ChatMessage):
                 logger.info(f"✅ Generated {len(response_text)} characters")
                 logger.info(f"📝 Preview: {response_text[:100]}...")
                 
+            except HTTPException:
+                raise
             except Exception as gen_error:
                 logger.error(f"❌ Generation error: {gen_error}")
                 import traceback
@@ -114,17 +102,7 @@ The Luffy AI model is not initialized. Please:
 3. Check logs for errors"""
         
         # Store AI message
-        ai_msg_id = len(messages_db) + 1
-        messages_db[ai_msg_id] = {
-            'id': ai_msg_id,
-            'conversation_id': conv_id,
-            'role': 'assistant',
-            'content': response_text,
-            'timestamp': datetime.utcnow().isoformat(),
-        }
-        
-        conversations_db[conv_id]['messages'].append(ai_msg_id)
-        conversations_db[conv_id]['updated_at'] = datetime.utcnow().isoformat()
+        await store.append_message(conv_id, 'assistant', response_text)
         
         logger.info("="*80)
         logger.info("✅ CHAT REQUEST COMPLETE")
@@ -146,77 +124,118 @@ The Luffy AI model is not initialized. Please:
         logger.error("="*80)
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
+@router.post("/generate/stream")
+async def generate_code_chat_stream(request: Request, chat_message: ChatMessage):
+    """Stream the chat response as Server-Sent Events - NO AUTH FOR TESTING"""
+    logger.info(f"📡 NEW STREAMING CHAT REQUEST: {chat_message.message[:100]}")
+    
+    gemma_service = get_model_service(request, "Model service not available")
+    
+    history = await _load_history(chat_message.conversation_id)
+    stream = gemma_service.stream_chat(
+        conversation_id=chat_message.conversation_id,
+        message=chat_message.message,
+        history=history,
+        max_length=512,
+        temperature=0.7,
+        top_p=0.9,
+        top_k=50
+    )
+    # Reserve the inference slot before touching the conversation so a 503 leaves no trace
+    chunks = stream_inference(stream)
+    
+    store = get_conversation_store()
+    try:
+        conv_id = await _get_or_create_conversation(chat_message)
+        stream.bind_conversation(conv_id)
+        await store.append_message(conv_id, 'user', chat_message.message)
+    except BaseException:
+        # The stream was never handed to the response, so free its slot here
+        await chunks.aclose()
+        raise
+    
+    async def store_response(response_text: str):
+        await store.append_message(conv_id, 'assistant', response_text)
+        logger.info(f"✅ Streamed {len(response_text)} characters to conversation {conv_id}")
+    
+    return StreamingResponse(
+        stream_generation_events(
+            chunks,
+            stream,
+            done_payload={"conversation_id": conv_id},
+            on_complete=store_response
+        ),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
 @router.get("/conversations")
-async def get_conversations():
-    """Get all conversations"""
+async def get_conversations(
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = None
+):
+    """
+    Get conversations, most recently updated first.
+    Pass the returned next_cursor as `before` to fetch the next page.
+    """
     try:
-        conversations = [
-            {
-                'id': conv['id'],
-                'title': conv['title'],
-                'created_at': conv['created_at'],
-                'updated_at': conv['updated_at'],
-                'message_count': len(conv.get('messages', []))
-            }
-            for conv in conversations_db.values()
-        ]
-        conversations.sort(key=lambda x: x['updated_at'], reverse=True)
+        cursor = decode_cursor(before) if before else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    try:
+        conversations = await get_conversation_store().list(limit=limit, before=cursor)
+        next_cursor = encode_cursor(conversations[-1]) if len(conversations) == limit else None
         logger.info(f"📚 Returning {len(conversations)} conversations")
-        return {"conversations": conversations}
+        return {"conversations": conversations, "next_cursor": next_cursor}
     except Exception as e:
         logger.error(f"Error getting conversations: {e}")
-        return {"conversations": []}
+        return {"conversations": [], "next_cursor": None}
 
 @router.get("/conversations/{conversation_id}")
-async def get_conversation(conversation_id: int):
-    """Get specific conversation with messages"""
-    if conversation_id not in conversations_db:
-        raise HTTPException(status_code=404, detail="Conversation not found")
-    
+async def get_conversation(
+    conversation_id: int,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    before: Optional[int] = Query(None, ge=1)
+):
+    """
+    Get specific conversation with messages.
+    With `limit`, returns the latest messages older than message id `before`;
+    pass the returned next_before to load earlier ones.
+    """
+    store = get_conversation_store()
     try:
-        conversation = conversations_db[conversation_id]
-        conv_messages = []
-        
-        for msg_id in conversation.get('messages', []):
-            if msg_id in messages_db:
-                msg = messages_db[msg_id]
-                conv_messages.append({
-                    'id': msg['id'],
-                    'role': msg['role'],
-                    'content': msg['content'],
-                    'timestamp': msg['timestamp']
-                })
-        
-        return {
-            'id': conversation['id'],
-            'title': conversation['title'],
-            'created_at': conversation['created_at'],
-            'updated_at': conversation['updated_at'],
-            'messages': conv_messages
-        }
+        result = await store.get_messages(conversation_id, limit=limit, before=before)
     except Exception as e:
         logger.error(f"Error getting conversation {conversation_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    
+    if result is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    
+    conversation, messages = result
+    has_more = bool(messages) and messages[0]["id"] > 1
+    return dict(
+        store.summary(conversation),
+        messages=messages,
+        has_more=has_more,
+        next_before=messages[0]["id"] if has_more else None
+    )
 
 @router.delete("/conversations/{conversation_id}")
-async def delete_conversation(conversation_id: int):
+async def delete_conversation(request: Request, conversation_id: int):
     """Delete a conversation"""
-    if conversation_id not in conversations_db:
-        raise HTTPException(status_code=404, detail="Conversation not found")
-    
     try:
-        conversation = conversations_db[conversation_id]
-        
-        # Delete all messages
-        for msg_id in conversation.get('messages', []):
-            if msg_id in messages_db:
-                del messages_db[msg_id]
-        
-        # Delete conversation
-        del conversations_db[conversation_id]
-        
-        logger.info(f"🗑️ Deleted conversation {conversation_id}")
-        return {"message": "Conversation deleted successfully"}
+        deleted = await get_conversation_store().delete(conversation_id)
+        gemma_service = getattr(request.app.state, "gemma_service", None)
+        if gemma_service is not None:
+            gemma_service.forget_conversation(conversation_id)
     except Exception as e:
         logger.error(f"Error deleting conversation {conversation_id}: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    
+    logger.info(f"🗑️ Deleted conversation {conversation_id}")
+    return {"message": "Conversation deleted successfully"}
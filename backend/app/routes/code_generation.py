@@ -1,10 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from app.routes.auth import get_current_user
-from typing import Optional
+from typing import Dict, List, Optional
 import logging
 from datetime import datetime
 from app.services.database import get_solutions_collection, get_failures_collection
+from app.services.inference import run_inference, stream_inference, get_model_service, ensure_not_warming_up
+from app.services.solution_index import get_solution_index
+from app.services.test_runner_client import UnknownProblemError, pass_at_k, test_candidates
+from app.config import settings
+from app.utils.sse import SSE_HEADERS, stream_generation_events
 from bson import ObjectId
 
 logger = logging.getLogger(__name__)
@@ -16,19 +22,27 @@ router = APIRouter()
 class CodeGenerationRequest(BaseModel):
     prompt: str
     language: str = "python"
+    seed: Optional[int] = None
+    greedy: bool = False
 
 class CodeRefactorRequest(BaseModel):
     code: str
     instructions: str
+    seed: Optional[int] = None
+    greedy: bool = False
 
 class CodeExplainRequest(BaseModel):
     code: str
     language: str = "python"
+    seed: Optional[int] = None
+    greedy: bool = False
 
 class CodeFixRequest(BaseModel):
     code: str
     error_message: Optional[str] = None
     language: str = "python"
+    seed: Optional[int] = None
+    greedy: bool = False
 
 class CodeResponse(BaseModel):
     code: str
@@ -41,6 +55,9 @@ class N8nFixCodeRequest(BaseModel):
     prompt: str
     code: str
     error: str
+    # Greedy or seeded requests are answered from the response cache on retries
+    seed: Optional[int] = None
+    greedy: bool = False
 
 class N8nFixCodeResponse(BaseModel):
     """Response to n8n with fixed code"""
@@ -75,6 +92,33 @@ class N8nLogFailureResponse(BaseModel):
     message: str
     failure_id: Optional[str] = None
 
+class N8nGenerateAndTestRequest(BaseModel):
+    """Request from n8n to sample several solutions and test them in one round trip"""
+    problem_id: str
+    prompt: str
+    num_candidates: int = 4
+    # pass@k is reported for k=1 and this k
+    k: int = 1
+    seed: Optional[int] = None
+
+class CandidateResult(BaseModel):
+    index: int
+    code: str
+    tests_passed: bool
+    error: Optional[str] = None
+    fix_method: Optional[str] = None
+
+class N8nGenerateAndTestResponse(BaseModel):
+    """First passing candidate (if any) plus the pass@k of this request's samples"""
+    success: bool
+    code: Optional[str] = None
+    num_candidates: int
+    # Samples (out of num_candidates) whose code passed; duplicates count once per sample
+    num_passed: int
+    pass_at_k: Dict[str, float]
+    candidates: List[CandidateResult]
+    message: str
+
 # ==================== TEST ENDPOINT (NO AUTH) ====================
 
 @router.post("/test-generate")
@@ -82,6 +126,7 @@ async def test_generate_code(request: Request, code_request: CodeGenerationReque
     """TEST ENDPOINT - No authentication required"""
     try:
         gemma_service = request.app.state.gemma_service
+        ensure_not_warming_up(gemma_service)
         
         if not gemma_service:
             raise HTTPException(status_code=503, detail="Model service not initialized")
@@ -94,13 +139,20 @@ async def test_generate_code(request: Request, code_request: CodeGenerationReque
             }
         
         logger.info(f"🧪 TEST: Generating code for: {code_request.prompt[:50]}...")
-        generated_code = gemma_service.generate_code(code_request.prompt)
+        generated_code = await run_inference(
+            gemma_service.generate_code,
+            code_request.prompt,
+            seed=code_request.seed,
+            greedy=code_request.greedy
+        )
         
         return {
             "code": generated_code,
             "language": code_request.language,
             "status": "success"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Test generation error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -121,6 +173,7 @@ async def fix_code_with_ai(request: Request, fix_request: N8nFixCodeRequest):
         logger.info("="*80)
         
         gemma_service = request.app.state.gemma_service
+        ensure_not_warming_up(gemma_service)
         
         if not gemma_service or not gemma_service.is_loaded():
             logger.warning("⚠️ Model not loaded - returning original code")
@@ -131,9 +184,12 @@ async def fix_code_with_ai(request: Request, fix_request: N8nFixCodeRequest):
             )
         
         logger.info("🔧 Using Luffy AI to fix code...")
-        fixed_code = gemma_service.debug_code(
+        fixed_code = await run_inference(
+            gemma_service.debug_code,
             code=fix_request.code,
-            error_message=fix_request.error
+            error_message=fix_request.error,
+            seed=fix_request.seed,
+            greedy=fix_request.greedy
         )
         
         # Check if Luffy returned mock/unclear output
@@ -153,6 +209,9 @@ async def fix_code_with_ai(request: Request, fix_request: N8nFixCodeRequest):
             message="Fixed by Luffy AI"
         )
         
+    except HTTPException:
+        # Busy/timeout - let n8n see the status code and retry later
+        raise
     except Exception as e:
         logger.error(f"❌ Error in AI fix: {e}")
         import traceback
@@ -163,6 +222,81 @@ async def fix_code_with_ai(request: Request, fix_request: N8nFixCodeRequest):
             message=f"Error: {str(e)}"
         )
 
+@router.post("/generate_and_test", response_model=N8nGenerateAndTestResponse)
+async def generate_and_test(request: Request, gt_request: N8nGenerateAndTestRequest):
+    """
+    n8n Endpoint: Sample N candidates in one batched generate and run them all
+    against the test runner concurrently (NO AUTH).
+    Replaces the serial generate -> run_tests -> fix_code round trips.
+    """
+    try:
+        num_candidates = max(1, min(gt_request.num_candidates, settings.GENERATE_AND_TEST_MAX_CANDIDATES))
+        logger.info("="*80)
+        logger.info("🎲 GENERATE AND TEST from n8n")
+        logger.info(f"   Problem ID: {gt_request.problem_id}")
+        logger.info(f"   Candidates: {num_candidates}")
+        logger.info("="*80)
+        
+        gemma_service = get_model_service(request)
+        candidates, samples = await run_inference(
+            gemma_service.generate_candidates,
+            gt_request.prompt,
+            num_candidates=num_candidates,
+            seed=gt_request.seed
+        )
+        if not candidates:
+            return N8nGenerateAndTestResponse(
+                success=False,
+                num_candidates=num_candidates,
+                num_passed=0,
+                pass_at_k={},
+                candidates=[],
+                message="No usable candidates generated"
+            )
+        
+        try:
+            results = await test_candidates(gt_request.problem_id, candidates)
+        except UnknownProblemError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        if all(result["runner_error"] for result in results):
+            raise HTTPException(status_code=502, detail="Test runner unavailable")
+        
+        # pass@k counts samples, not distinct candidates: a repeated sample shares its
+        # candidate's result and unusable samples count as failures
+        passed = sum(1 for index in samples if index is not None and results[index]["tests_passed"])
+        ks = sorted({1, max(1, min(gt_request.k, num_candidates))})
+        winner = next((result for result in results if result["tests_passed"]), None)
+        if winner:
+            logger.info(f"✅ Candidate {winner['index']} passed ({passed}/{num_candidates} samples)")
+        else:
+            logger.warning(f"⚠️ No candidate passed for {gt_request.problem_id}")
+        
+        return N8nGenerateAndTestResponse(
+            success=winner is not None,
+            code=winner["code"] if winner else None,
+            num_candidates=num_candidates,
+            num_passed=passed,
+            pass_at_k={f"pass@{k}": round(pass_at_k(num_candidates, passed, k), 4) for k in ks},
+            candidates=[CandidateResult(**result) for result in results],
+            message=f"{passed}/{num_candidates} samples passed"
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Error in generate and test: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _index_solution(solution_id: str, solution_request: N8nStoreSolutionRequest):
+    """Make a newly stored passing solution available to generate_code right away"""
+    if settings.SOLUTION_INDEX_ENABLED and solution_request.status == "passed":
+        get_solution_index().add(
+            solution_id,
+            solution_request.prompt,
+            solution_request.code,
+            solution_request.problem_id
+        )
+
 @router.post("/store_solution", response_model=N8nStoreSolutionResponse)
 async def store_solution(request: Request, solution_request: N8nStoreSolutionRequest):
     """
@@ -186,7 +320,7 @@ async def store_solution(request: Request, solution_request: N8nStoreSolutionReq
             try:
                 import json
                 import os
-                solutions_dir = "solutions"
+                solutions_dir = settings.SOLUTIONS_DIR
                 os.makedirs(solutions_dir, exist_ok=True)
                 solution_id = f"{solution_request.problem_id}_{int(datetime.utcnow().timestamp())}"
                 filename = f"{solutions_dir}/{solution_id}.json"
@@ -205,6 +339,7 @@ async def store_solution(request: Request, solution_request: N8nStoreSolutionReq
                     json.dump(solution_data, f, indent=2)
                 
                 logger.warning(f"⚠️ Stored to file instead: {filename}")
+                _index_solution(solution_id, solution_request)
                 return N8nStoreSolutionResponse(
                     success=True,
                     message="Solution stored to file (DB unavailable)",
@@ -234,6 +369,8 @@ async def store_solution(request: Request, solution_request: N8nStoreSolutionReq
         result = await solutions.insert_one(solution_data)
         solution_id = str(result.inserted_id)
         
+        _index_solution(solution_id, solution_request)
+        
         logger.info(f"✅ Solution stored in MongoDB successfully!")
         logger.info(f"   MongoDB ID: {solution_id}")
         logger.info(f"   Code length: {len(solution_request.code)} chars")
@@ -353,18 +490,17 @@ async def generate_code(
 ):
     """Generate code based on prompt (requires authentication)"""
     try:
-        gemma_service = request.app.state.gemma_service
-        
-        if not gemma_service:
-            raise HTTPException(
-                status_code=503,
-                detail="Model not loaded. Please try again later."
-            )
+        gemma_service = get_model_service(request)
         
         logger.info(f"📝 Code generation request from user {current_user['id']}")
         logger.info(f"   Prompt: {code_request.prompt[:100]}...")
         
-        generated_code = gemma_service.generate_code(code_request.prompt)
+        generated_code = await run_inference(
+            gemma_service.generate_code,
+            code_request.prompt,
+            seed=code_request.seed,
+            greedy=code_request.greedy
+        )
         
         return {
             "code": generated_code,
@@ -377,6 +513,27 @@ async def generate_code(
         logger.error(f"Error generating code: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/generate/stream")
+async def generate_code_stream(
+    request: Request,
+    code_request: CodeGenerationRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """Stream generated code as Server-Sent Events (requires authentication)"""
+    gemma_service = get_model_service(request)
+    
+    logger.info(f"📡 Streaming code generation request from user {current_user['id']}")
+    logger.info(f"   Prompt: {code_request.prompt[:100]}...")
+    
+    stream = gemma_service.stream_code(code_request.prompt)
+    chunks = stream_inference(stream)
+    
+    return StreamingResponse(
+        stream_generation_events(chunks, stream, done_payload={"language": code_request.language}),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
 @router.post("/refactor")
 async def refactor_code(
     request: Request,
@@ -385,19 +542,16 @@ async def refactor_code(
 ):
     """Refactor existing code (requires authentication)"""
     try:
-        gemma_service = request.app.state.gemma_service
-        
-        if not gemma_service:
-            raise HTTPException(
-                status_code=503,
-                detail="Model not loaded. Please try again later."
-            )
+        gemma_service = get_model_service(request)
         
         logger.info(f"🔧 Code refactor request from user {current_user['id']}")
         
-        refactored_code = gemma_service.refactor_code(
+        refactored_code = await run_inference(
+            gemma_service.refactor_code,
             refactor_request.code,
-            refactor_request.instructions
+            refactor_request.instructions,
+            seed=refactor_request.seed,
+            greedy=refactor_request.greedy
         )
         
         return {"refactored_code": refactored_code}
@@ -416,17 +570,16 @@ async def explain_code(
 ):
     """Explain how code works (requires authentication)"""
     try:
-        gemma_service = request.app.state.gemma_service
-        
-        if not gemma_service:
-            raise HTTPException(
-                status_code=503,
-                detail="Model not loaded. Please try again later."
-            )
+        gemma_service = get_model_service(request)
         
         logger.info(f"📖 Code explanation request from user {current_user['id']}")
         
-        explanation = gemma_service.explain_code(explain_request.code)
+        explanation = await run_inference(
+            gemma_service.explain_code,
+            explain_request.code,
+            seed=explain_request.seed,
+            greedy=explain_request.greedy
+        )
         
         return {"explanation": explanation}
         
@@ -444,19 +597,16 @@ async def fix_code(
 ):
     """Fix buggy code (requires authentication)"""
     try:
-        gemma_service = request.app.state.gemma_service
-        
-        if not gemma_service:
-            raise HTTPException(
-                status_code=503,
-                detail="Model not loaded. Please try again later."
-            )
+        gemma_service = get_model_service(request)
         
         logger.info(f"🐛 Code fix request from user {current_user['id']}")
         
-        fixed_code = gemma_service.debug_code(
+        fixed_code = await run_inference(
+            gemma_service.debug_code,
             fix_request.code,
-            fix_request.error_message
+            fix_request.error_message,
+            seed=fix_request.seed,
+            greedy=fix_request.greedy
         )
         
         return {"fixed_code": fixed_code}
@@ -0,0 +1,203 @@
+# app/services/chat_context.py
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import torch
+from transformers import DynamicCache
+
+from app.services.token_budget import TokenBudgetPlanner
+
+logger = logging.getLogger(__name__)
+
+# Stored assistant messages that are errors, not answers - never shown to the model again
+_SKIPPED_ANSWER_PREFIXES = ("Sorry, I encountered an error", "❌ **Model Not Loaded**")
+_SUMMARY_HEADER = "Earlier in this conversation the user asked for:"
+
+
+@dataclass
+class ChatTurn:
+    """One completed exchange; message_id is the id of the user message"""
+    message_id: int
+    user: str
+    assistant: str
+
+
+@dataclass
+class ChatContext:
+    """Recent turns kept verbatim plus a summary of the older ones"""
+    turns: List[ChatTurn] = field(default_factory=list)
+    summary: str = ""
+    prompt_tokens: int = 0
+
+
+def pair_turns(messages: List[Dict[str, Any]]) -> List[ChatTurn]:
+    """Completed user -> assistant exchanges of API message dicts, oldest first"""
+    turns, pending = [], None
+    for message in messages:
+        if message["role"] == "user":
+            pending = message
+        elif message["role"] == "assistant" and pending is not None:
+            if not message["content"].startswith(_SKIPPED_ANSWER_PREFIXES):
+                turns.append(ChatTurn(pending["id"], pending["content"], message["content"]))
+            pending = None
+    return turns
+
+
+class ChatContextBuilder:
+    """
+    Packs the recent turns of a conversation into the prompt within a token budget;
+    turns that no longer fit are folded into a one-line-per-request summary.
+    The window only moves when the budget overflows, and then far enough to free
+    half of the room left next to the instruction, so the prompt prefix - and with it the conversation's
+    KV cache - stays the same for several follow-ups in a row.
+    """
+
+    def __init__(
+        self,
+        planner: TokenBudgetPlanner,
+        format_prompt: Callable[[List[ChatTurn], str, str], str],
+        history_tokens: int,
+        summary_tokens: int,
+        max_conversations: int = 1024,
+    ):
+        self.planner = planner
+        self.format_prompt = format_prompt
+        self.history_tokens = history_tokens
+        self.summary_tokens = summary_tokens
+        self.max_conversations = max_conversations
+        # conversation_id -> (message id of the first verbatim turn, summary lines)
+        self._windows: "OrderedDict[int, Tuple[int, List[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _prompt_tokens(self, turns: List[ChatTurn], lines: List[str], instruction: str) -> int:
+        prompt = self.format_prompt(turns, self._summary(lines), instruction)
+        return len(self.planner.tokenizer(prompt)["input_ids"])
+
+    @staticmethod
+    def _summary(lines: List[str]) -> str:
+        return "\n".join([_SUMMARY_HEADER] + lines) if lines else ""
+
+    def _summarise(self, lines: List[str], turns: List[ChatTurn]) -> List[str]:
+        """Add one line per summarised request; the oldest lines go first when over budget"""
+        lines = lines + [
+            f"- {turn.user.strip().splitlines()[0][:120]}"
+            for turn in turns
+            if turn.user.strip()
+        ]
+        while len(lines) > 1 and self.planner.count(self._summary(lines)) > self.summary_tokens:
+            lines.pop(0)
+        return lines
+
+    def build(self, conversation_id: int, turns: List[ChatTurn], instruction: str, max_new_tokens: int) -> ChatContext:
+        """History for the next prompt; empty when not even the summary fits next to the instruction"""
+        limit = min(self.history_tokens, self.planner.context_window - max_new_tokens)
+        with self._lock:
+            first_id, lines = self._windows.get(conversation_id, (0, []))
+        recent = [turn for turn in turns if turn.message_id >= first_id]
+        total = self._prompt_tokens(recent, lines, instruction)
+
+        if total > limit:
+            # Free half of the history room; per-turn costs get there without re-tokenising each step
+            base = self._prompt_tokens([], [], instruction)
+            target = base + max(0, limit - base) // 2
+            drop = 0
+            while drop < len(recent) and total > target:
+                total -= self.planner.count(recent[drop].user) + self.planner.count(recent[drop].assistant)
+                drop += 1
+            lines = self._summarise(lines, recent[:drop])
+            recent = recent[drop:]
+            total = self._prompt_tokens(recent, lines, instruction)
+            while recent and total > limit:
+                lines = self._summarise(lines, recent[:1])
+                recent = recent[1:]
+                total = self._prompt_tokens(recent, lines, instruction)
+            logger.info(f"🧵 Conversation {conversation_id}: {len(recent)} recent turns kept, older ones summarised")
+            if total > limit:
+                return ChatContext()
+
+        with self._lock:
+            first_id = recent[0].message_id if recent else (turns[-1].message_id + 1 if turns else first_id)
+            self._windows[conversation_id] = (first_id, lines)
+            self._windows.move_to_end(conversation_id)
+            while len(self._windows) > self.max_conversations:
+                self._windows.popitem(last=False)
+        return ChatContext(recent, self._summary(lines), total)
+
+    def forget(self, conversation_id: int):
+        with self._lock:
+            self._windows.pop(conversation_id, None)
+
+
+class ConversationKVCache:
+    """
+    KV cache left by the last generate call of each conversation (prompt + answer).
+    The next turn's prompt starts with that text, so its prefill only covers the new
+    tokens. Entries are taken (not copied) for a generation and put back afterwards;
+    the least recently used conversations are dropped beyond max_conversations.
+    """
+
+    def __init__(self, max_conversations: int = 8, min_reuse_tokens: int = 16):
+        self.max_conversations = max(0, max_conversations)
+        self.min_reuse_tokens = min_reuse_tokens
+        self._entries: "OrderedDict[int, Tuple[torch.Tensor, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+
+    def take(self, conversation_id: int, input_ids: torch.Tensor) -> Optional[Any]:
+        """Cache covering the longest shared prefix of input_ids (1-D), or None"""
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            cached_ids, cache = entry
+            # Keep at least one prompt token uncached so generate has logits to sample from
+            length = min(len(cached_ids), len(input_ids) - 1)
+            mismatch = (cached_ids[:length] != input_ids[:length].to(cached_ids.device)).nonzero()
+            shared = int(mismatch[0]) if len(mismatch) else length
+            if shared < self.min_reuse_tokens:
+                self.misses += 1
+                return None
+            cache.crop(shared)
+            # Only taken once the crop worked; a failed crop leaves the entry in place
+            del self._entries[conversation_id]
+            self.hits += 1
+            self.reused_tokens += shared
+        logger.info(f"♻️ Conversation {conversation_id}: reusing KV cache for {shared}/{len(input_ids)} prompt tokens")
+        return cache
+
+    def put(self, conversation_id: int, sequence: torch.Tensor, cache: Any):
+        """Keep the cache of a finished generation; sequence is prompt + generated ids (1-D)"""
+        if not self.max_conversations or cache is None:
+            return
+        if isinstance(cache, tuple):
+            # generate returns the legacy format when it was not given a Cache object
+            cache = DynamicCache.from_legacy_cache(cache)
+        # The last generated token was never fed back, so the cache is one token short
+        ids = sequence[:cache.get_seq_length()].clone()
+        with self._lock:
+            self._entries[conversation_id] = (ids, cache)
+            self._entries.move_to_end(conversation_id)
+            while len(self._entries) > self.max_conversations:
+                self._entries.popitem(last=False)
+
+    def drop(self, conversation_id: int):
+        with self._lock:
+            self._entries.pop(conversation_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = len(self._entries)
+            tokens = sum(len(ids) for ids, _ in self._entries.values())
+        return {
+            "conversations": entries,
+            "cached_tokens": tokens,
+            "hits": self.hits,
+            "misses": self.misses,
+            "reused_tokens": self.reused_tokens,
+        }
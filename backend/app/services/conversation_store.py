@@ -0,0 +1,369 @@
+# app/services/conversation_store.py
+import bisect
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+from app.config import settings
+from app.services.database import get_database
+
+logger = logging.getLogger(__name__)
+
+# Counter document in the "counters" collection that hands out conversation ids
+_CONVERSATION_COUNTER = "chat_conversation_id"
+# Conversation fields besides the messages, listed explicitly next to a $slice projection
+_META_FIELDS = {"user_id": 1, "title": 1, "created_at": 1, "updated_at": 1, "message_count": 1}
+
+
+def _isoformat(value: Any) -> str:
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+def encode_cursor(summary: Dict[str, Any]) -> str:
+    """Cursor pointing just past a listed conversation: <updated_at>|<id>"""
+    return f"{summary['updated_at']}|{summary['id']}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, Optional[int]]:
+    """(updated_at, id) of a cursor; a bare ISO timestamp is accepted too. Raises ValueError."""
+    timestamp, _, conv_id = cursor.partition("|")
+    return datetime.fromisoformat(timestamp), int(conv_id) if conv_id else None
+
+
+class ConversationStore:
+    """
+    Chat conversations, one document per conversation in the chat_history collection:
+    {_id, user_id, title, created_at, updated_at, message_count, messages: [{role, content, timestamp}]}.
+
+    - Conversation ids come from an atomic $inc on the counters collection, so they are
+      unique across uvicorn workers and never reused after a delete.
+    - Appending a message is a single $push + $inc; the returned message_count is the
+      message's id (ids are 1-based positions, messages are never removed on their own).
+    - Recently used conversations are kept in an LRU (entries expire after a TTL so
+      appends made by other workers show up); an append that sees a message_count other
+      than cached + 1 drops the stale entry right away.
+    - Listing is keyset-paginated on (updated_at, id), newest first: MongoDB uses the
+      (user_id, updated_at, _id) index, the in-memory fallback a sorted list per user,
+      so a page costs O(log n + limit) however many conversations a user has.
+    - Without MongoDB everything lives in process memory, as before.
+
+    All methods run on the event loop; the in-memory paths never await, so they are atomic.
+    """
+
+    def __init__(self, cache_size: int = 256, cache_ttl_seconds: float = 30):
+        self.cache_size = max(0, cache_size)
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self._cache: "OrderedDict[int, tuple]" = OrderedDict()
+        # In-memory fallback when MongoDB is not connected
+        self._memory: Dict[int, Dict[str, Any]] = {}
+        # user_id -> [(updated_at, id)] ascending, for the in-memory fallback
+        self._by_updated: Dict[int, List[Tuple[datetime, int]]] = {}
+        self._next_id = 1
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _collection():
+        database = get_database()
+        return None if database is None else database.chat_history
+
+    # ==================== LRU ====================
+
+    def _cache_get(self, conv_id: int) -> Optional[Dict[str, Any]]:
+        entry = self._cache.get(conv_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        doc, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._cache[conv_id]
+            self.misses += 1
+            return None
+        self._cache.move_to_end(conv_id)
+        self.hits += 1
+        return doc
+
+    def _cache_put(self, doc: Dict[str, Any]):
+        if not self.cache_size:
+            return
+        self._cache[doc["_id"]] = (doc, time.monotonic() + self.cache_ttl_seconds)
+        self._cache.move_to_end(doc["_id"])
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _cache_drop(self, conv_id: int):
+        self._cache.pop(conv_id, None)
+
+    # ==================== SORTED INDEX (IN-MEMORY) ====================
+
+    def _index_add(self, doc: Dict[str, Any]):
+        bisect.insort(self._by_updated.setdefault(doc["user_id"], []), (doc["updated_at"], doc["_id"]))
+
+    def _index_remove(self, doc: Dict[str, Any]):
+        keys = self._by_updated.get(doc["user_id"], [])
+        key = (doc["updated_at"], doc["_id"])
+        position = bisect.bisect_left(keys, key)
+        if position < len(keys) and keys[position] == key:
+            del keys[position]
+
+    # ==================== ID ALLOCATION ====================
+
+    async def _allocate_id(self, collection, requested: Optional[int] = None) -> int:
+        if collection is None:
+            if requested is None:
+                requested = self._next_id
+            self._next_id = max(self._next_id, requested + 1)
+            return requested
+
+        counters = get_database().counters
+        if requested is not None:
+            # Keep the counter ahead of ids chosen by the client
+            await counters.update_one(
+                {"_id": _CONVERSATION_COUNTER},
+                {"$max": {"seq": requested}},
+                upsert=True
+            )
+            return requested
+        counter = await counters.find_one_and_update(
+            {"_id": _CONVERSATION_COUNTER},
+            {"$inc": {"seq": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return counter["seq"]
+
+    # ==================== CONVERSATIONS ====================
+
+    async def create(self, title: str, user_id: int = 1, conv_id: Optional[int] = None) -> Dict[str, Any]:
+        """Create a conversation; conv_id re-creates one the client still refers to"""
+        collection = self._collection()
+        now = datetime.utcnow()
+        doc = {
+            "_id": await self._allocate_id(collection, conv_id),
+            "user_id": user_id,
+            "title": title[:50] + ("..." if len(title) > 50 else ""),
+            "created_at": now,
+            "updated_at": now,
+            "message_count": 0,
+            "messages": [],
+        }
+        if collection is None:
+            previous = self._memory.get(doc["_id"])
+            if previous is not None:
+                self._index_remove(previous)
+            self._memory[doc["_id"]] = doc
+            self._index_add(doc)
+        else:
+            await collection.replace_one({"_id": doc["_id"]}, doc, upsert=True)
+            self._cache_put(doc)
+        logger.info(f"📝 Created new conversation: {doc['_id']}")
+        return doc
+
+    async def get(self, conv_id: int) -> Optional[Dict[str, Any]]:
+        """Conversation document with all messages, or None"""
+        collection = self._collection()
+        if collection is None:
+            return self._memory.get(conv_id)
+        doc = self._cache_get(conv_id)
+        if doc is None:
+            doc = await collection.find_one({"_id": conv_id})
+            if doc is not None:
+                self._cache_put(doc)
+        return doc
+
+    async def exists(self, conv_id: int) -> bool:
+        collection = self._collection()
+        if collection is None:
+            return conv_id in self._memory
+        if self._cache_get(conv_id) is not None:
+            return True
+        return await collection.count_documents({"_id": conv_id}, limit=1) > 0
+
+    async def append_message(self, conv_id: int, role: str, content: str) -> Optional[Dict[str, Any]]:
+        """Append a message in O(1); returns it with its id, or None if the conversation is gone"""
+        now = datetime.utcnow()
+        message = {"role": role, "content": content, "timestamp": now}
+        collection = self._collection()
+
+        if collection is None:
+            doc = self._memory.get(conv_id)
+            if doc is None:
+                return None
+            self._index_remove(doc)
+            doc["messages"].append(message)
+            doc["message_count"] += 1
+            doc["updated_at"] = now
+            self._index_add(doc)
+            return dict(message, id=doc["message_count"])
+
+        updated = await collection.find_one_and_update(
+            {"_id": conv_id},
+            {
+                "$push": {"messages": message},
+                "$inc": {"message_count": 1},
+                "$set": {"updated_at": now},
+            },
+            projection={"message_count": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if updated is None:
+            self._cache_drop(conv_id)
+            return None
+
+        cached = self._cache.get(conv_id)
+        if cached is not None:
+            doc = cached[0]
+            if doc["message_count"] + 1 == updated["message_count"]:
+                doc["messages"].append(message)
+                doc["message_count"] += 1
+                doc["updated_at"] = now
+            else:
+                # Another worker appended in between; reload on the next read
+                self._cache_drop(conv_id)
+        return dict(message, id=updated["message_count"])
+
+    async def list(
+        self,
+        user_id: int = 1,
+        limit: int = 50,
+        before: Optional[Tuple[datetime, Optional[int]]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Up to limit conversation summaries (no messages), most recently updated first,
+        starting after the `before` cursor (see decode_cursor)
+        """
+        collection = self._collection()
+        if collection is None:
+            keys = self._by_updated.get(user_id, [])
+            end = len(keys)
+            if before is not None:
+                updated_at, conv_id = before
+                # A bare timestamp excludes every conversation updated at that instant
+                end = bisect.bisect_left(keys, (updated_at, conv_id if conv_id is not None else float("-inf")))
+            page = keys[max(0, end - limit):end]
+            docs = [self._memory[conv_id] for _, conv_id in reversed(page)]
+        else:
+            query: Dict[str, Any] = {"user_id": user_id}
+            if before is not None:
+                updated_at, conv_id = before
+                if conv_id is None:
+                    query["updated_at"] = {"$lt": updated_at}
+                else:
+                    query["$or"] = [
+                        {"updated_at": {"$lt": updated_at}},
+                        {"updated_at": updated_at, "_id": {"$lt": conv_id}},
+                    ]
+            cursor = (
+                collection.find(query, {"messages": 0})
+                .sort([("updated_at", -1), ("_id", -1)])
+                .limit(limit)
+            )
+            docs = await cursor.to_list(length=limit)
+        return [self.summary(doc) for doc in docs]
+
+    async def get_messages(
+        self,
+        conv_id: int,
+        limit: Optional[int] = None,
+        before: Optional[int] = None,
+    ) -> Optional[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        """
+        (conversation document without its messages, up to limit messages with id < before
+        in chronological order), or None. Only the requested page is read from MongoDB
+        unless the whole conversation is already cached.
+        """
+        collection = self._collection()
+        if collection is None:
+            doc = self._memory.get(conv_id)
+            if doc is None:
+                return None
+        else:
+            doc = self._cache_get(conv_id)
+            if doc is None and limit is None and before is None:
+                doc = await self.get(conv_id)
+
+        if doc is not None:
+            end = len(doc["messages"]) if before is None else max(0, min(before - 1, len(doc["messages"])))
+            start = 0 if limit is None else max(0, end - limit)
+            messages = doc["messages"][start:end]
+        else:
+            # Message ids are 1-based positions, so a page is one positional $slice
+            if before is None:
+                start, projection = None, dict(_META_FIELDS, messages={"$slice": -limit})
+            else:
+                end = max(0, before - 1)
+                start = 0 if limit is None else max(0, end - limit)
+                projection = dict(_META_FIELDS, messages={"$slice": [start, end - start]}) if end > start else _META_FIELDS
+            doc = await collection.find_one({"_id": conv_id}, projection)
+            if doc is None:
+                return None
+            messages = doc.get("messages", [])
+            if start is None:
+                start = doc.get("message_count", 0) - len(messages)
+
+        meta = {key: value for key, value in doc.items() if key != "messages"}
+        return meta, self.messages({"messages": messages}, first_id=start + 1)
+
+    async def delete(self, conv_id: int) -> bool:
+        collection = self._collection()
+        self._cache_drop(conv_id)
+        if collection is None:
+            doc = self._memory.pop(conv_id, None)
+            if doc is None:
+                return False
+            self._index_remove(doc)
+            return True
+        result = await collection.delete_one({"_id": conv_id})
+        return result.deleted_count > 0
+
+    # ==================== API FORMAT ====================
+
+    @staticmethod
+    def summary(doc: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": doc["_id"],
+            "title": doc["title"],
+            "created_at": _isoformat(doc["created_at"]),
+            "updated_at": _isoformat(doc["updated_at"]),
+            "message_count": doc.get("message_count", 0),
+        }
+
+    @staticmethod
+    def messages(doc: Dict[str, Any], first_id: int = 1) -> List[Dict[str, Any]]:
+        """Messages of a document as API dicts; first_id is the id of doc["messages"][0]"""
+        return [
+            {
+                "id": first_id + offset,
+                "role": message["role"],
+                "content": message["content"],
+                "timestamp": _isoformat(message["timestamp"]),
+            }
+            for offset, message in enumerate(doc.get("messages", []))
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "memory" if self._collection() is None else "mongodb",
+            "cached_conversations": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+# Global singleton
+_conversation_store = None
+
+def get_conversation_store() -> ConversationStore:
+    global _conversation_store
+    if _conversation_store is None:
+        _conversation_store = ConversationStore(
+            cache_size=settings.CONVERSATION_CACHE_SIZE,
+            cache_ttl_seconds=settings.CONVERSATION_CACHE_TTL_SECONDS
+        )
+    return _conversation_store
@@ -84,6 +84,8 @@ async def create_indexes():
         await db.db.chat_history.create_index("user_id")
         await db.db.chat_history.create_index("created_at")
         await db.db.chat_history.create_index([("user_id", 1), ("created_at", -1)])
+        # Keyset pagination of a user's conversations, newest first (ConversationStore.list)
+        await db.db.chat_history.create_index([("user_id", 1), ("updated_at", -1), ("_id", -1)])
         
         logger.info("✅ Database indexes created")
     except Exception as e:
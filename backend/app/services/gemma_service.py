@@ -1,27 +1,459 @@
 # app/services/gemma_service.py
 import torch
 import logging
-import re
-from typing import Optional
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Optional, List, Dict, Any, Callable, Iterator, Tuple
+from transformers import DynamicCache, StoppingCriteria, StoppingCriteriaList
 from app.config import settings
+from app.services.response_cache import ResponseCache
+from app.services.generation import GenerationPipeline, GenerationRequest
+from app.services.sanitizer import (
+    NUMERIC_LINE_RE,
+    PARTIAL_GARBAGE_RE,
+    STOP_MARKERS,
+    clean_response,
+    extract_code,
+    find_response_cut,
+    is_garbage,
+    sanitize,
+)
+from app.services.mmap_weights import load_model_mmap
+from app.services.speculative import SpeculativeDecoder, SpeculativeRun, load_draft_model
+from app.services.token_budget import TokenBudgetPlanner, code_blocks
+from app.services.chat_context import ChatContextBuilder, ChatTurn, ConversationKVCache
+from app.services.quantization import (
+    checkpoint_path,
+    load_quantized_checkpoint,
+    quantize_model,
+    save_quantized_checkpoint,
+)
+import copy
+import hashlib
 import os
 
 logger = logging.getLogger(__name__)
 
+# Fixed start of every Alpaca prompt; their KV caches are computed once at load time
+_ALPACA_PREAMBLE = """Below is an instruction that describes a task. Write a response that appropriately completes the request.
+
+### Instruction:
+"""
+_ALPACA_PREAMBLE_WITH_INPUT = """Below is an instruction that describes a task, paired with an input that provides further context. Write a response that appropriately completes the request.
+
+### Instruction:
+"""
+
+_CHUNK_INSTRUCTION = "Explain what this part of a larger program does"
+_SUMMARY_INSTRUCTION = "These are explanations of consecutive parts of one program. Combine them into one explanation of the whole program"
+
+# How far back from the released text a new stop pattern may start
+_RESCAN_WINDOW = 64
+# Generated tokens decoded per step when checking stop patterns during generation
+_STOP_TAIL_TOKENS = 24
+
+
+class _BatchItem:
+    """A single prompt waiting for the batch scheduler"""
+    __slots__ = ("prompt", "params", "key", "future")
+
+    def __init__(self, prompt: str, params: Dict[str, Any]):
+        self.prompt = prompt
+        self.params = params
+        # Only requests with identical generation params can share a generate call;
+        # seeded requests always run alone so the seed alone decides the output,
+        # speculative ones because assisted generation only supports batch size 1,
+        # chat turns because they continue from their conversation's own KV cache
+        if params.get("seed") is not None or params.get("speculative") or params.get("conversation_id") is not None:
+            self.key = ("seed", id(self))
+        else:
+            self.key = tuple(sorted(params.items()))
+        self.future: Future = Future()
+
+
+class BatchScheduler:
+    """
+    Gathers generation requests that arrive within a short window,
+    pads them into one batch and runs a single model.generate for all of them.
+    Each caller blocks on its own future and receives its own decoded output.
+    """
+
+    def __init__(self, service: "GemmaService", max_batch_size: int, max_wait_ms: int):
+        self.service = service
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0, max_wait_ms) / 1000.0
+        self._queue: "queue.Queue[Optional[_BatchItem]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="gemma-batcher", daemon=True)
+                self._thread.start()
+                logger.info(
+                    f"📦 Batch scheduler started (max_batch_size={self.max_batch_size}, "
+                    f"max_wait={self.max_wait * 1000:.0f}ms)"
+                )
+
+    def stop(self):
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join(timeout=5)
+                self._thread = None
+
+    def submit(self, prompt: str, **params) -> str:
+        """Queue a prompt and block until its batch has been generated"""
+        self.start()
+        item = _BatchItem(prompt, params)
+        self._queue.put(item)
+        return item.future.result()
+
+    def submit_many(self, prompts: List[str], **params) -> List[str]:
+        """Queue several prompts at once so they land in the same batch(es); outputs in order"""
+        self.start()
+        items = [_BatchItem(prompt, dict(params)) for prompt in prompts]
+        for item in items:
+            self._queue.put(item)
+        return [item.future.result() for item in items]
+
+    def _collect(self, first: _BatchItem) -> List[_BatchItem]:
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Re-queue the stop signal so the loop exits after this batch
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+
+            groups: Dict[tuple, List[_BatchItem]] = {}
+            for item in self._collect(first):
+                groups.setdefault(item.key, []).append(item)
+
+            for items in groups.values():
+                self._run_group(items)
+
+    def _run_group(self, items: List[_BatchItem]):
+        try:
+            outputs = self.service._generate_batch(
+                [item.prompt for item in items],
+                **items[0].params
+            )
+            for item, output in zip(items, outputs):
+                item.future.set_result(output)
+        except Exception as e:
+            logger.error(f"❌ Batch generation failed ({len(items)} requests): {e}")
+            for item in items:
+                if not item.future.done():
+                    item.future.set_exception(e)
+
+
+class _CancelCriteria(StoppingCriteria):
+    """Stops generation once the consumer of a stream sets the event"""
+
+    def __init__(self, event: threading.Event):
+        self.event = event
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full(
+            (input_ids.shape[0],),
+            self.event.is_set(),
+            dtype=torch.bool,
+            device=input_ids.device
+        )
+
+
+class ResponseStopCriteria(StoppingCriteria):
+    """
+    Watches the decoded tail of every row while generating and ends the row as
+    soon as it contains a pattern clean_response would cut at, so no tokens
+    are spent on text that is thrown away afterwards.
+    """
+
+    def __init__(self, tokenizer, prompt_length: int, tail_tokens: int = _STOP_TAIL_TOKENS,
+                 speculative_run: Optional[SpeculativeRun] = None):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.tail_tokens = tail_tokens
+        self.speculative_run = speculative_run
+        # row -> number of generated tokens when the row was stopped
+        self.stopped_at: Dict[int, int] = {}
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        # Assisted generation also checks unverified draft tokens; those must not
+        # mark the row as stopped (scores is None on every call without output_scores)
+        record = self.speculative_run is None or not self.speculative_run.drafting
+        length = input_ids.shape[1]
+        start = max(self.prompt_length, length - self.tail_tokens)
+        at_response_start = start == self.prompt_length
+        done = []
+        for row in range(input_ids.shape[0]):
+            if row in self.stopped_at:
+                done.append(True)
+                continue
+            tail = self.tokenizer.decode(input_ids[row, start:], skip_special_tokens=True)
+            if at_response_start:
+                tail = tail.lstrip()
+            hit = find_response_cut(tail, first_line_complete=at_response_start) is not None
+            if hit and record:
+                self.stopped_at[row] = length - self.prompt_length
+            done.append(hit)
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+    def tokens_saved(self, row: int, max_new_tokens: int) -> int:
+        """Tokens not generated for a row because it was stopped early"""
+        if row not in self.stopped_at:
+            return 0
+        return max(0, max_new_tokens - self.stopped_at[row])
+
+
+class ResponseStreamFilter:
+    """
+    Incremental version of GemmaService._extract_response for streaming.
+    Text is only released once no stop marker or garbage pattern can still
+    start inside it, so released text is a prefix of the final cleaned response.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.emitted = 0
+        self.stopped = False
+
+    def feed(self, chunk: str) -> str:
+        """Add newly decoded text and return the part that is safe to send"""
+        if self.stopped or not chunk:
+            return ""
+        if not self.text:
+            chunk = chunk.lstrip()
+        self.text += chunk
+
+        cut = self._find_stop()
+        if cut is not None:
+            self.stopped = True
+            # clean_response also drops a numbers-only last line left by the cut
+            self.text = clean_response(self.text[:cut])
+            return self._release(len(self.text))
+        return self._release(self._safe_end())
+
+    def _release(self, end: int) -> str:
+        if end <= self.emitted:
+            return ""
+        released = self.text[self.emitted:end]
+        self.emitted = end
+        return released
+
+    def _find_stop(self) -> Optional[int]:
+        """Earliest position where the response has to be cut, if any"""
+        return find_response_cut(self.text, max(0, self.emitted - _RESCAN_WINDOW))
+
+    def _safe_end(self) -> int:
+        text = self.text
+        end = len(text)
+        # Hold back a partial stop marker at the very end
+        for marker in STOP_MARKERS:
+            for size in range(min(len(marker) - 1, len(text)), 0, -1):
+                if text.endswith(marker[:size]):
+                    end = min(end, len(text) - size)
+                    break
+        # Hold back numbers that may still turn into garbage sequences
+        tail_start = max(0, len(text) - _RESCAN_WINDOW)
+        match = PARTIAL_GARBAGE_RE.search(text, tail_start)
+        if match:
+            end = min(end, match.start())
+        # Hold back the current line while its releasable part only contains numbers:
+        # a later cut behind that part would leave a numbers-only line
+        line_start = text.rfind("\n") + 1
+        if end > line_start and NUMERIC_LINE_RE.match(text[line_start:end]):
+            end = min(end, line_start)
+        # Whitespace is only released once something follows it
+        return len(text[:end].rstrip())
+
+
+class GenerationStream:
+    """
+    Iterates over cleaned response text while the model is still generating.
+    After iteration `text` holds the final response (or the mock fallback).
+    """
+
+    def __init__(self, service: "GemmaService", formatted_prompt: str, params: Dict[str, Any], fallback: Callable[[], str]):
+        self.service = service
+        self.formatted_prompt = formatted_prompt
+        self.params = params
+        self.fallback = fallback
+        self.text = ""
+        self.stopped_early = False
+        self.used_fallback = False
+        self._cancel = threading.Event()
+        self._error: Optional[Exception] = None
+
+    def close(self):
+        """Stop generation, e.g. when the client disconnected"""
+        self._cancel.set()
+
+    def bind_conversation(self, conversation_id: int):
+        """Keep this generation's KV cache for the conversation's next turn (call before iterating)"""
+        self.params["conversation_id"] = conversation_id
+
+    def _run_generate(self, inputs, streamer):
+        try:
+            params = dict(self.params)
+            seed = params.pop("seed", None)
+            if seed is not None:
+                torch.manual_seed(seed)
+            conversation_id = params.pop("conversation_id", None)
+            past = self.service._past_for(inputs["input_ids"], conversation_id)
+            if past is not None:
+                inputs["past_key_values"] = past
+            stop_criteria = ResponseStopCriteria(self.service.tokenizer, inputs["input_ids"].shape[1])
+            with torch.no_grad():
+                outputs = self.service.model.generate(
+                    **inputs,
+                    streamer=streamer,
+                    stopping_criteria=StoppingCriteriaList([stop_criteria, _CancelCriteria(self._cancel)]),
+                    return_dict_in_generate=conversation_id is not None,
+                    **self.service._generate_kwargs(**params)
+                )
+            if conversation_id is not None:
+                self.service.conversation_kv.put(conversation_id, outputs.sequences[0], outputs.past_key_values)
+            self.service._record_tokens_saved([stop_criteria.tokens_saved(0, params["max_new_tokens"])])
+        except Exception as e:
+            self._error = e
+            streamer.end()
+
+    def __iter__(self) -> Iterator[str]:
+        service = self.service
+        if not service.loaded:
+            self.text = self.fallback()
+            self.used_fallback = True
+            yield self.text
+            return
+
+        from transformers import TextIteratorStreamer
+
+        streamer = TextIteratorStreamer(
+            service.tokenizer,
+            skip_prompt=True,
+            skip_special_tokens=True,
+            timeout=settings.INFERENCE_TIMEOUT_SECONDS
+        )
+        inputs = service.tokenizer(
+            self.formatted_prompt,
+            return_tensors="pt",
+            truncation=True,
+            max_length=service.context_window - self.params["max_new_tokens"]
+        ).to(service.model.device)
+
+        thread = threading.Thread(target=self._run_generate, args=(inputs, streamer), daemon=True)
+        thread.start()
+
+        stream_filter = ResponseStreamFilter()
+        try:
+            for piece in streamer:
+                released = stream_filter.feed(piece)
+                if released:
+                    yield released
+                if stream_filter.stopped:
+                    self.stopped_early = True
+                    logger.info("✂️ Stop pattern reached - ending stream early")
+                    break
+        finally:
+            self._cancel.set()
+
+        if self._error is not None:
+            logger.error(f"❌ Streaming error: {self._error}")
+
+        response = service._extract_response(stream_filter.text)
+        if self._error is not None or service._is_garbage_output(response):
+            logger.warning("⚠️ Garbage output detected in stream")
+            self.text = self.fallback()
+            self.used_fallback = True
+            return
+
+        self.text = response
+        emitted = stream_filter.text[:stream_filter.emitted]
+        if response.startswith(emitted) and len(response) > len(emitted):
+            yield response[len(emitted):]
+
+
 class GemmaService:
     """
     Service for fine-tuned Gemma 2B merged model
     Uses Alpaca prompt format (matching training)
     """
     
-    def __init__(self):
+    def __init__(self, background: bool = False):
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.model = None
         self.tokenizer = None
         self.loaded = False
+        # "loading" -> "ready" (model loaded) or "mock" (no model, mock responses)
+        self.status = "loading"
+        self._load_thread: Optional[threading.Thread] = None
+        self.prefix_caches: List[tuple] = []
+        self.model_revision = ""
+        self.speculative: Optional[SpeculativeDecoder] = None
+        self.pipeline = GenerationPipeline()
+        # Per-chunk explanations keyed by chunk content, so an edited file only re-explains changed chunks
+        self.chunk_cache = ResponseCache(
+            max_entries=settings.EXPLAIN_CHUNK_CACHE_ENTRIES,
+            max_bytes=settings.RESPONSE_CACHE_MAX_BYTES,
+            ttl_seconds=settings.RESPONSE_CACHE_TTL_SECONDS
+        )
+        self.context_window = settings.MAX_LENGTH
+        self.budget_planner: Optional[TokenBudgetPlanner] = None
+        self.chat_context: Optional[ChatContextBuilder] = None
+        self.conversation_kv = ConversationKVCache(max_conversations=settings.CHAT_KV_CACHE_CONVERSATIONS)
+        self.response_cache = ResponseCache(
+            max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+            max_bytes=settings.RESPONSE_CACHE_MAX_BYTES,
+            ttl_seconds=settings.RESPONSE_CACHE_TTL_SECONDS
+        )
+        self.stats = {
+            "generations": 0,
+            "early_stops": 0,
+            "tokens_saved": 0,
+            "speculative_generations": 0,
+            "draft_tokens": 0,
+            "accepted_draft_tokens": 0,
+            "speculative_new_tokens": 0,
+            "speculative_seconds": 0.0,
+        }
+        self._stats_lock = threading.Lock()
+        self.batcher = BatchScheduler(
+            self,
+            max_batch_size=settings.BATCH_MAX_SIZE,
+            max_wait_ms=settings.BATCH_MAX_WAIT_MS
+        )
         
         logger.info(f"Initializing Gemma Service on device: {self.device}")
         
+        if background:
+            # Let the app accept requests while the weights load
+            self._load_thread = threading.Thread(target=self._initialize, name="gemma-loader", daemon=True)
+            self._load_thread.start()
+        else:
+            self._initialize()
+    
+    def _initialize(self):
+        started = time.monotonic()
         if os.path.exists(settings.MODEL_PATH):
             logger.info(f"✅ Model path found: {settings.MODEL_PATH}")
             try:
@@ -34,6 +466,18 @@ class GemmaService:
         else:
             logger.warning(f"⚠️ Model path not found: {settings.MODEL_PATH}")
             logger.warning("⚠️ Service will operate in MOCK MODE")
+        
+        self.status = "ready" if self.loaded else "mock"
+        logger.info(f"🤖 Model status: {self.status} ({time.monotonic() - started:.1f}s)")
+    
+    def is_loading(self) -> bool:
+        return self.status == "loading"
+    
+    def wait_until_loaded(self, timeout: Optional[float] = None) -> bool:
+        """Block until background loading finished; returns True if the model is loaded"""
+        if self._load_thread is not None:
+            self._load_thread.join(timeout)
+        return self.loaded
     
     def _load_model(self):
         """Load merged Gemma model directly"""
@@ -52,27 +496,60 @@ class GemmaService:
                 self.tokenizer.pad_token = self.tokenizer.eos_token
                 self.tokenizer.pad_token_id = self.tokenizer.eos_token_id
             
+            # Decoder-only models must be left-padded when prompts are batched;
+            # a last-resort truncation must drop the start, never the "### Response:" marker
+            self.tokenizer.padding_side = "left"
+            self.tokenizer.truncation_side = "left"
+            
             logger.info("✅ Tokenizer loaded")
             
             # Step 2: Load model directly (it's already merged!)
             logger.info(f"📥 Loading merged model from: {settings.MODEL_PATH}")
             logger.info("⏳ This may take 1-2 minutes...")
             
-            self.model = AutoModelForCausalLM.from_pretrained(
-                settings.MODEL_PATH,
-                torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
-                device_map="auto" if self.device == "cuda" else None,
-                low_cpu_mem_usage=True,
-                trust_remote_code=True,
-                local_files_only=True
-            )
+            quantization = settings.QUANTIZATION_MODE
+            if quantization != "none" and self.device != "cpu":
+                logger.warning(f"⚠️ QUANTIZATION_MODE={quantization} is CPU-only - loading float16 on {self.device}")
+                quantization = "none"
             
-            # Move to device if not using device_map
-            if self.device == "cpu":
-                self.model = self.model.to(self.device)
+            if quantization == "none" and settings.MODEL_LOAD_MODE == "mmap" and self.device == "cpu":
+                self.model = self._load_mmap_model()
+            elif quantization == "none":
+                self.model = AutoModelForCausalLM.from_pretrained(
+                    settings.MODEL_PATH,
+                    torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
+                    device_map="auto" if self.device == "cuda" else None,
+                    low_cpu_mem_usage=True,
+                    trust_remote_code=True,
+                    local_files_only=True
+                )
+                
+                # Move to device if not using device_map
+                if self.device == "cpu":
+                    self.model = self.model.to(self.device)
+            else:
+                self.model = self._load_quantized_model(quantization)
             
             self.model.eval()
+            # Prompt + new tokens never exceed what the model was trained on
+            self.context_window = min(
+                settings.MAX_LENGTH,
+                getattr(self.model.config, "max_position_embeddings", None) or settings.MAX_LENGTH
+            )
+            self.budget_planner = TokenBudgetPlanner(self.tokenizer, self.context_window, self._format_prompt)
+            self.chat_context = ChatContextBuilder(
+                self.budget_planner,
+                self._format_chat_prompt,
+                history_tokens=settings.CHAT_HISTORY_TOKENS,
+                summary_tokens=settings.CHAT_SUMMARY_TOKENS
+            )
+            logger.info(f"📏 Context window: {self.context_window} tokens")
+            self.speculative = self._build_speculative_decoder()
+            self.model_revision = self._compute_model_revision()
+            if settings.PREFIX_CACHE_ENABLED:
+                self._build_prefix_caches()
             self.loaded = True
+            self.batcher.start()
             
             # Log info
             num_params = sum(p.numel() for p in self.model.parameters()) / 1e9
@@ -86,15 +563,124 @@ class GemmaService:
             logger.error(traceback.format_exc())
             self.loaded = False
     
+    def _load_mmap_model(self):
+        """Memory-map the safetensors weights so worker processes share them, else load normally"""
+        from transformers import AutoModelForCausalLM
+        
+        try:
+            logger.info("📥 Memory-mapping safetensors weights (MODEL_LOAD_MODE=mmap)")
+            return load_model_mmap(settings.MODEL_PATH)
+        except Exception as e:
+            logger.warning(f"⚠️ mmap loading failed ({e}) - falling back to a regular load")
+            return AutoModelForCausalLM.from_pretrained(
+                settings.MODEL_PATH,
+                torch_dtype=torch.float32,
+                low_cpu_mem_usage=True,
+                trust_remote_code=True,
+                local_files_only=True
+            )
+    
+    def _load_quantized_model(self, mode: str):
+        """Load the saved quantized checkpoint, or quantize the fp32 model once and save it"""
+        from transformers import AutoModelForCausalLM
+        
+        path = checkpoint_path(settings.QUANTIZED_CHECKPOINT_DIR, settings.MODEL_PATH, mode)
+        source_revision = self._compute_model_revision(include_quantization=False)
+        model = load_quantized_checkpoint(path, source_revision, mmap=settings.MODEL_LOAD_MODE == "mmap")
+        if model is not None:
+            return model
+        
+        logger.info(f"⚙️ Quantizing model to {mode} (first start only)...")
+        model = AutoModelForCausalLM.from_pretrained(
+            settings.MODEL_PATH,
+            torch_dtype=torch.float32,
+            low_cpu_mem_usage=True,
+            trust_remote_code=True,
+            local_files_only=True
+        )
+        model.eval()
+        model = quantize_model(model, mode)
+        try:
+            save_quantized_checkpoint(model, path, source_revision)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not save quantized checkpoint: {e}")
+        return model
+    
+    def _build_speculative_decoder(self) -> Optional[SpeculativeDecoder]:
+        """Assisted generation for debug/refactor per SPECULATIVE_MODE, None when off or unusable"""
+        mode = settings.SPECULATIVE_MODE
+        if mode == "off":
+            return None
+        if mode == "draft":
+            draft_model = None
+            if settings.DRAFT_MODEL_PATH and os.path.exists(settings.DRAFT_MODEL_PATH):
+                logger.info(f"📥 Loading draft model from: {settings.DRAFT_MODEL_PATH}")
+                draft_model = load_draft_model(settings.DRAFT_MODEL_PATH, self.device, self.tokenizer)
+            else:
+                logger.warning(f"⚠️ Draft model path not found: {settings.DRAFT_MODEL_PATH!r}")
+            if draft_model is None:
+                logger.warning("⚠️ Falling back to n-gram speculative decoding")
+                mode = "ngram"
+            return SpeculativeDecoder(self.model, mode, settings.SPECULATIVE_NUM_TOKENS, draft_model)
+        if mode == "ngram":
+            return SpeculativeDecoder(self.model, mode, settings.SPECULATIVE_NUM_TOKENS)
+        logger.warning(f"⚠️ Unknown SPECULATIVE_MODE={mode} - speculative decoding disabled")
+        return None
+    
+    def _compute_model_revision(self, include_quantization: bool = True) -> str:
+        """Fingerprint of the model files, so cached responses die with the weights they came from"""
+        digest = hashlib.sha256(os.path.abspath(settings.MODEL_PATH).encode())
+        for root, _, files in sorted(os.walk(settings.MODEL_PATH)):
+            for name in sorted(files):
+                stat = os.stat(os.path.join(root, name))
+                digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        if include_quantization and self.device == "cpu":
+            digest.update(settings.QUANTIZATION_MODE.encode())
+        return digest.hexdigest()[:16]
+    
+    def _build_prefix_caches(self):
+        """Prefill both Alpaca preambles once so generations can start from their KV cache"""
+        self.prefix_caches = []
+        for preamble in (_ALPACA_PREAMBLE, _ALPACA_PREAMBLE_WITH_INPUT):
+            prefix_ids = self.tokenizer(preamble, return_tensors="pt")["input_ids"].to(self.model.device)
+            with torch.no_grad():
+                outputs = self.model(
+                    input_ids=prefix_ids,
+                    past_key_values=DynamicCache(),
+                    use_cache=True
+                )
+            self.prefix_caches.append((prefix_ids[0], outputs.past_key_values))
+        logger.info(f"✅ Prefix KV cache ready ({', '.join(str(len(ids)) for ids, _ in self.prefix_caches)} tokens)")
+    
+    def _prefix_cache_for(self, input_ids: torch.Tensor) -> Optional[DynamicCache]:
+        """
+        Copy of the preamble KV cache matching the start of a single prompt, or None.
+        Only unpadded (batch size 1) inputs can reuse it - left padding shifts positions.
+        """
+        if not self.prefix_caches or input_ids.shape[0] != 1:
+            return None
+        ids = input_ids[0]
+        for prefix_ids, cache in self.prefix_caches:
+            # Keep at least one prompt token uncached so generate has logits to sample from
+            length = min(len(prefix_ids), len(ids) - 1)
+            if length <= 0:
+                continue
+            mismatch = (ids[:length] != prefix_ids[:length]).nonzero()
+            shared = int(mismatch[0]) if len(mismatch) else length
+            # The two preambles share their first sentence; require most of the preamble
+            if shared < len(prefix_ids) - 2:
+                continue
+            cache_copy = copy.deepcopy(cache)
+            cache_copy.crop(shared)
+            return cache_copy
+        return None
+    
     def _format_prompt(self, instruction: str, input_text: str = "") -> str:
         """
         Alpaca format - MUST match your training!
         """
         if input_text:
-            return f"""Below is an instruction that describes a task, paired with an input that provides further context. Write a response that appropriately completes the request.
-
-### Instruction:
-{instruction}
+            return f"""{_ALPACA_PREAMBLE_WITH_INPUT}{instruction}
 
 ### Input:
 {input_text}
@@ -102,71 +688,313 @@ class GemmaService:
 ### Response:
 """
         else:
-            return f"""Below is an instruction that describes a task. Write a response that appropriately completes the request.
-
-### Instruction:
-{instruction}
+            return f"""{_ALPACA_PREAMBLE}{instruction}
 
 ### Response:
 """
     
-    def _extract_response(self, full_output: str) -> str:
+    def _format_chat_prompt(self, turns: List[ChatTurn], summary: str, instruction: str) -> str:
+        """
+        Multi-turn Alpaca prompt: every earlier exchange is an Instruction/Response pair and
+        the summary of older turns is the first Input, so the previous turn's prompt + answer
+        is a prefix of the next prompt. Without history it equals _format_prompt(instruction, summary).
+        """
+        blocks = [(f"Write Python code for: {turn.user}", turn.assistant) for turn in turns]
+        blocks.append((instruction, None))
+        prompt = _ALPACA_PREAMBLE_WITH_INPUT if summary else _ALPACA_PREAMBLE
+        for i, (block_instruction, answer) in enumerate(blocks):
+            if i:
+                prompt += "\n\n### Instruction:\n"
+            prompt += block_instruction
+            if i == 0 and summary:
+                prompt += f"\n\n### Input:\n{summary}"
+            prompt += "\n\n### Response:\n"
+            if answer is not None:
+                prompt += answer
+        return prompt
+    
+    def _format_request(self, request: GenerationRequest) -> str:
+        if request.has_history:
+            return self._format_chat_prompt(request.history, request.history_summary, request.instruction)
+        return self._format_prompt(request.instruction, request.input_text)
+    
+    def _extract_response(self, output: str) -> str:
         """Extract only the response part and clean garbage"""
-        if "### Response:" in full_output:
-            response = full_output.split("### Response:")[-1].strip()
-        else:
-            response = full_output.strip()
+        return clean_response(output)
+    
+    def _is_garbage_output(self, text: str) -> bool:
+        """Check if output is garbage"""
+        return is_garbage(text)
+    
+    def is_loaded(self) -> bool:
+        return self.loaded
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        if stats["draft_tokens"]:
+            stats["draft_acceptance_rate"] = round(stats["accepted_draft_tokens"] / stats["draft_tokens"], 3)
+        if stats["speculative_seconds"]:
+            stats["speculative_tokens_per_second"] = round(stats["speculative_new_tokens"] / stats["speculative_seconds"], 1)
+        stats["speculative_seconds"] = round(stats["speculative_seconds"], 2)
+        stats["operations"] = self.pipeline.metrics()
+        stats["conversation_cache"] = self.conversation_kv.stats()
+        return stats
+    
+    def _record_tokens_saved(self, saved_per_request: List[int]):
+        """Count tokens skipped by ResponseStopCriteria, one entry per request"""
+        for saved in saved_per_request:
+            if saved:
+                logger.info(f"✂️ Stopped early - saved {saved} tokens")
+        with self._stats_lock:
+            self.stats["generations"] += len(saved_per_request)
+            self.stats["early_stops"] += sum(1 for saved in saved_per_request if saved)
+            self.stats["tokens_saved"] += sum(saved_per_request)
+    
+    def _record_speculative_run(self, run, new_tokens: int, elapsed: float):
+        logger.info(
+            f"🎯 Speculative ({self.speculative.mode}): accepted {run.accepted}/{run.proposed} draft tokens "
+            f"({run.acceptance_rate:.0%}), {new_tokens / max(elapsed, 1e-6):.1f} tokens/s"
+        )
+        with self._stats_lock:
+            self.stats["speculative_generations"] += 1
+            self.stats["draft_tokens"] += run.proposed
+            self.stats["accepted_draft_tokens"] += run.accepted
+            self.stats["speculative_new_tokens"] += new_tokens
+            self.stats["speculative_seconds"] += elapsed
+    
+    def _fit_to_context(self, request: GenerationRequest):
+        """Trim the request's input on block boundaries so prompt + new tokens fit the context window"""
+        if request.has_history:
+            # ChatContextBuilder already sized the history to the budget
+            return
+        budget = self.budget_planner.plan(
+            request.instruction,
+            request.input_text,
+            request.params()["max_new_tokens"]
+        )
+        request.instruction = budget.instruction
+        request.input_text = budget.input_text
+        request.max_new_tokens = budget.max_new_tokens
+    
+    def _split_into_chunks(self, code: str, chunk_tokens: int) -> List[tuple]:
+        """Consecutive top-level blocks grouped into (label, text) chunks of about chunk_tokens"""
+        lines = code.split("\n")
+        chunks, current, current_tokens = [], [], 0
+        for first, end, name in code_blocks(code):
+            tokens = self.budget_planner.count("\n".join(lines[first:end]))
+            if current and current_tokens + tokens > chunk_tokens:
+                chunks.append(current)
+                current, current_tokens = [], 0
+            current.append((first, end, name))
+            current_tokens += tokens
+        if current:
+            chunks.append(current)
+        
+        result = []
+        for blocks in chunks:
+            names = [name for _, _, name in blocks if name]
+            first, end = blocks[0][0], blocks[-1][1]
+            label = ", ".join(names) if names else f"lines {first + 1}-{end}"
+            text = "\n".join(lines[first:end]).strip("\n")
+            if text.strip():
+                result.append((label, text))
+        return result
+    
+    def _explain_in_chunks(self, request: GenerationRequest) -> Optional[str]:
+        """
+        Map-reduce explanation of a large input: explain every chunk (one batched
+        generate, cached by chunk content), then summarise the chunk explanations.
+        None when the input is small enough for a single pass.
+        """
+        code = request.input_text
+        if self.budget_planner.count(code) <= settings.EXPLAIN_CHUNK_TOKENS:
+            return None
+        chunks = self._split_into_chunks(code, settings.EXPLAIN_CHUNK_TOKENS)
+        if len(chunks) < 2:
+            return None
+        
+        params = GenerationRequest(
+            operation="explain_chunk",
+            instruction=_CHUNK_INSTRUCTION,
+            fallback=lambda: "",
+            seed=request.seed,
+            greedy=request.greedy
+        ).params()
+        explanations: List[Optional[str]] = [None] * len(chunks)
+        keys, missing = [], []
+        for i, (_, text) in enumerate(chunks):
+            key = ResponseCache.make_key("explain_chunk", _CHUNK_INSTRUCTION, text, params, self.model_revision)
+            keys.append(key)
+            explanations[i] = self.chunk_cache.get(key)
+            if explanations[i] is None:
+                missing.append(i)
+        logger.info(f"🧩 Explaining {len(chunks)} chunks ({len(chunks) - len(missing)} cached)")
         
-        # Clean up trailing patterns
-        for pattern in ["### Instruction:", "Below is an instruction", "###", "/code", "\n\n\n"]:
-            if pattern in response:
-                response = response.split(pattern)[0].strip()
+        if missing:
+            prompts = []
+            for i in missing:
+                budget = self.budget_planner.plan(_CHUNK_INSTRUCTION, chunks[i][1], params["max_new_tokens"])
+                prompts.append(self._format_prompt(budget.instruction, budget.input_text))
+            outputs = self.batcher.submit_many(prompts, **params)
+            for i, output in zip(missing, outputs):
+                response, reason = sanitize(output)
+                if reason is None:
+                    explanations[i] = response
+                    self.chunk_cache.put(keys[i], response)
         
-        # Remove garbage number sequences (like "2.3.4.5.6.7...")
-        garbage_pattern = r'\d+\.\d+\.\d+\.\d+[\d\.]*'
-        if re.search(garbage_pattern, response):
-            match = re.search(garbage_pattern, response)
-            if match:
-                response = response[:match.start()].strip()
+        parts = [
+            f"Part {n} ({label}):\n{explanation}"
+            for n, ((label, _), explanation) in enumerate(zip(chunks, explanations), 1)
+            if explanation
+        ]
+        if not parts:
+            return None
+        combined = "\n\n".join(parts)
+        return self.run(GenerationRequest(
+            operation="explain_summary",
+            instruction=_SUMMARY_INSTRUCTION,
+            input_text=combined,
+            max_new_tokens=request.max_new_tokens,
+            seed=request.seed,
+            greedy=request.greedy,
+            # The per-chunk explanations are a usable answer on their own
+            fallback=lambda: combined
+        ))
+    
+    def _generate_kwargs(self, **params) -> Dict[str, Any]:
+        """Generation settings shared by every call, overridden by params"""
+        kwargs = {
+            "do_sample": True,
+            "pad_token_id": self.tokenizer.pad_token_id,
+            "eos_token_id": self.tokenizer.eos_token_id,
+            "repetition_penalty": 1.2,
+        }
+        kwargs.update(params)
+        return kwargs
+    
+    def _response_cache_key(self, operation: str, instruction: str, input_text: str, params: Dict[str, Any]) -> Optional[str]:
+        """Cache key for deterministic (greedy or seeded) requests, None when sampling is random"""
+        if params.get("do_sample", True) and params.get("seed") is None:
+            return None
+        return ResponseCache.make_key(operation, instruction, input_text, params, self.model_revision)
+    
+    def _cached_response(self, cache_key: Optional[str]) -> Optional[str]:
+        if cache_key is None:
+            return None
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            logger.info("⚡ Response cache hit")
+        return cached
+    
+    def _cache_response(self, cache_key: Optional[str], response: str):
+        if cache_key is not None:
+            self.response_cache.put(cache_key, response)
+    
+    def _past_for(self, input_ids: torch.Tensor, conversation_id: Optional[int]) -> Optional[DynamicCache]:
+        """Longest reusable KV cache for a prompt: the conversation's previous turn, else the preamble"""
+        if conversation_id is not None and input_ids.shape[0] == 1:
+            cache = self.conversation_kv.take(conversation_id, input_ids[0])
+            if cache is not None:
+                return cache
+        return self._prefix_cache_for(input_ids)
+    
+    def forget_conversation(self, conversation_id: int):
+        """Drop the KV cache and history window of a deleted conversation"""
+        self.conversation_kv.drop(conversation_id)
+        if self.chat_context is not None:
+            self.chat_context.forget(conversation_id)
+    
+    def _generate(self, formatted_prompt: str, **params) -> str:
+        """Run one prompt through the batch scheduler and return the decoded completion"""
+        # The flag makes the request run alone (see _BatchItem), so only keep it when assisted generation is on
+        if params.pop("speculative", False) and self.speculative is not None:
+            params["speculative"] = True
+        return self.batcher.submit(formatted_prompt, **params)
+    
+    def _generate_batch(self, prompts: List[str], **params) -> List[Any]:
+        """
+        Tokenize prompts with left padding, run a single generate and decode each row's new tokens.
+        With num_return_sequences > 1 every prompt gets a list of that many completions.
+        """
+        seed = params.pop("seed", None)
+        if seed is not None:
+            # Seeded requests are never batched with others (see _BatchItem)
+            torch.manual_seed(seed)
+        num_sequences = params.get("num_return_sequences", 1)
+        conversation_id = params.pop("conversation_id", None)
+        speculative = (
+            params.pop("speculative", False) and self.speculative is not None
+            and len(prompts) == 1 and num_sequences == 1
+        )
         
-        # Remove garbage like "3D:2.3.4..." or similar
-        garbage_pattern2 = r'[A-Z0-9]{1,3}:\d+\.\d+'
-        if re.search(garbage_pattern2, response):
-            match = re.search(garbage_pattern2, response)
-            if match:
-                response = response[:match.start()].strip()
+        inputs = self.tokenizer(
+            prompts,
+            return_tensors="pt",
+            padding=True,
+            truncation=True,
+            max_length=self.context_window - params["max_new_tokens"]
+        ).to(self.model.device)
         
-        # Remove trailing incomplete lines that are just numbers
-        lines = response.split('\n')
-        clean_lines = []
-        for line in lines:
-            # Skip lines that are just numbers or garbage
-            if re.match(r'^[\d\.\s,]+$', line.strip()) and len(line.strip()) > 10:
-                break
-            # Skip lines with excessive dots/numbers pattern
-            if re.match(r'.*\d+\.\d+\.\d+\.\d+.*', line):
-                break
-            clean_lines.append(line)
+        # generate expands input_ids for num_return_sequences but not a passed-in cache
+        prefix_cache = self._past_for(inputs["input_ids"], conversation_id) if num_sequences == 1 else None
+        if prefix_cache is not None:
+            inputs["past_key_values"] = prefix_cache
         
-        return '\n'.join(clean_lines).strip()
+        kwargs = self._generate_kwargs(**params)
+        run = None
+        if speculative:
+            kwargs.update(self.speculative.generate_kwargs())
+            run = self.speculative.start_run()
+            started = time.perf_counter()
+        stop_criteria = ResponseStopCriteria(self.tokenizer, inputs["input_ids"].shape[1], speculative_run=run)
+        try:
+            with torch.no_grad():
+                outputs = self.model.generate(
+                    **inputs,
+                    stopping_criteria=StoppingCriteriaList([stop_criteria]),
+                    return_dict_in_generate=conversation_id is not None,
+                    **kwargs
+                )
+        finally:
+            if speculative:
+                self.speculative.finish_run()
+        if conversation_id is not None:
+            # Chat turns run alone (see _BatchItem), so the cache holds exactly this conversation
+            self.conversation_kv.put(conversation_id, outputs.sequences[0], outputs.past_key_values)
+            outputs = outputs.sequences
+        
+        if speculative:
+            new_tokens = outputs.shape[1] - inputs["input_ids"].shape[1]
+            self._record_speculative_run(run, new_tokens, time.perf_counter() - started)
+        self._record_tokens_saved([
+            stop_criteria.tokens_saved(row, params["max_new_tokens"])
+            for row in range(outputs.shape[0])
+        ])
+        if len(prompts) > 1:
+            logger.info(f"📦 Generated batch of {len(prompts)} prompts")
+        # Rows are left-padded to the same length, so every completion starts at the same column
+        new_tokens = outputs[:, inputs["input_ids"].shape[1]:]
+        decoded = self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+        if num_sequences == 1:
+            return decoded
+        # generate repeats each prompt num_return_sequences times in a row
+        return [decoded[i * num_sequences:(i + 1) * num_sequences] for i in range(len(prompts))]
     
-    def _is_garbage_output(self, text: str) -> bool:
-        """Check if output is garbage"""
-        if not text or len(text) < 5:
-            return True
-        non_ascii = sum(1 for c in text if ord(c) > 127)
-        if non_ascii > len(text) * 0.3:
-            return True
-        if not any(c.isalpha() for c in text):
-            return True
-        # Check for repetitive patterns
-        words = text.split()
-        if len(words) > 10 and len(set(words)) < len(words) * 0.3:
-            return True
-        return False
+    def run(self, request: GenerationRequest) -> str:
+        """Answer any operation through the shared generation pipeline"""
+        return self.pipeline.run(self, request)
     
-    def is_loaded(self) -> bool:
-        return self.loaded
+    def stream(self, request: GenerationRequest) -> GenerationStream:
+        """Stream any operation piece by piece (model output only - no pre-stages)"""
+        if self.loaded:
+            self._fit_to_context(request)
+        return GenerationStream(
+            self,
+            self._format_request(request),
+            params=request.params(),
+            fallback=request.fallback
+        )
     
     def generate_code(
         self, 
@@ -175,175 +1003,209 @@ class GemmaService:
         temperature: float = 0.7,
         top_p: float = 0.9,
         top_k: int = 50,
+        seed: Optional[int] = None,
+        greedy: bool = False,
     ) -> str:
         """Generate code using Alpaca format"""
+        return self.run(GenerationRequest(
+            operation="generate_code",
+            instruction=f"Write Python code for: {prompt}",
+            prompt=prompt,
+            max_new_tokens=max_length,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            seed=seed,
+            greedy=greedy,
+            fallback=lambda: self._mock_generate_code(prompt)
+        ))
+    
+    def generate_candidates(
+        self,
+        prompt: str,
+        num_candidates: int = 4,
+        max_length: int = 256,
+        seed: Optional[int] = None,
+    ) -> Tuple[List[str], List[Optional[int]]]:
+        """
+        Sample several solutions for one prompt in a single generate call
+        (num_return_sequences). Returns the distinct usable code candidates in
+        sample order, plus for every sample the index of its candidate (None when
+        the sample was unusable); both empty when the model is not loaded.
+        """
         if not self.loaded:
-            return self._mock_generate_code(prompt)
+            return [], []
+        request = GenerationRequest(
+            operation="generate_candidates",
+            instruction=f"Write Python code for: {prompt}",
+            prompt=prompt,
+            max_new_tokens=max_length,
+            seed=seed,
+            fallback=lambda: ""
+        )
+        self._fit_to_context(request)
+        logger.info(f"🎲 Sampling {num_candidates} candidates: {prompt[:50]}...")
+        outputs = self._generate(
+            self._format_prompt(request.instruction),
+            num_return_sequences=num_candidates,
+            **request.params()
+        )
         
-        try:
-            logger.info(f"🚀 Generating: {prompt[:50]}...")
-            
-            instruction = f"Write Python code for: {prompt}"
-            formatted_prompt = self._format_prompt(instruction)
-            
-            inputs = self.tokenizer(
-                formatted_prompt,
-                return_tensors="pt",
-                truncation=True,
-                max_length=512
-            ).to(self.model.device)
-            
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    **inputs,
-                    max_new_tokens=max_length,
-                    temperature=temperature,
-                    top_p=top_p,
-                    top_k=top_k,
-                    do_sample=True,
-                    pad_token_id=self.tokenizer.pad_token_id,
-                    eos_token_id=self.tokenizer.eos_token_id,
-                    repetition_penalty=1.2,
-                )
-            
-            full_output = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-            response = self._extract_response(full_output)
-            
-            if self._is_garbage_output(response):
-                logger.warning("⚠️ Garbage output detected")
-                return self._mock_generate_code(prompt)
-            
-            logger.info("✅ Generation complete")
-            return response
-            
-        except Exception as e:
-            logger.error(f"❌ Error: {e}")
-            return self._mock_generate_code(prompt)
+        candidates: List[str] = []
+        samples: List[Optional[int]] = []
+        for output in outputs:
+            response, reason = sanitize(output)
+            code = extract_code(response) if reason is None else ""
+            if not code.strip():
+                samples.append(None)
+                continue
+            if code not in candidates:
+                candidates.append(code)
+            samples.append(candidates.index(code))
+        logger.info(f"✅ {len(candidates)} distinct usable candidates from {num_candidates} samples")
+        return candidates, samples
     
-    def explain_code(self, code: str, max_length: int = 256) -> str:
+    def stream_code(
+        self,
+        prompt: str,
+        max_length: int = 256,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        top_k: int = 50,
+    ) -> GenerationStream:
+        """Stream generated code piece by piece (same prompt and params as generate_code)"""
+        logger.info(f"🚀 Streaming: {prompt[:50]}...")
+        return self.stream(GenerationRequest(
+            operation="generate_code",
+            instruction=f"Write Python code for: {prompt}",
+            prompt=prompt,
+            max_new_tokens=max_length,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            fallback=lambda: self._mock_generate_code(prompt)
+        ))
+    
+    def _chat_request(
+        self,
+        conversation_id: int,
+        message: str,
+        history: List[ChatTurn],
+        max_length: int,
+        temperature: float,
+        top_p: float,
+        top_k: int,
+    ) -> GenerationRequest:
+        request = GenerationRequest(
+            operation="generate_code",
+            instruction=f"Write Python code for: {message}",
+            prompt=message,
+            max_new_tokens=max_length,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            conversation_id=conversation_id,
+            fallback=lambda: self._mock_generate_code(message)
+        )
+        if self.loaded and history:
+            context = self.chat_context.build(
+                conversation_id, history, request.instruction, request.params()["max_new_tokens"]
+            )
+            request.history = context.turns
+            request.history_summary = context.summary
+            if request.has_history:
+                # A follow-up depends on the conversation, not just on its own text
+                request.prompt = ""
+        return request
+    
+    def chat(
+        self,
+        conversation_id: int,
+        message: str,
+        history: List[ChatTurn],
+        max_length: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        top_k: int = 50,
+    ) -> str:
+        """Answer a chat message with the conversation's recent turns in the prompt"""
+        return self.run(self._chat_request(conversation_id, message, history, max_length, temperature, top_p, top_k))
+    
+    def stream_chat(
+        self,
+        conversation_id: Optional[int],
+        message: str,
+        history: List[ChatTurn],
+        max_length: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        top_k: int = 50,
+    ) -> GenerationStream:
+        """Streaming version of chat; a new conversation can be bound to the stream later"""
+        logger.info(f"🚀 Streaming chat: {message[:50]}...")
+        return self.stream(self._chat_request(conversation_id, message, history, max_length, temperature, top_p, top_k))
+    
+    def explain_code(
+        self,
+        code: str,
+        max_length: int = 256,
+        seed: Optional[int] = None,
+        greedy: bool = False,
+    ) -> str:
         """Explain code"""
-        if not self.loaded:
-            return self._mock_explain_code(code)
-        
-        try:
-            instruction = "Explain what this code does in detail"
-            formatted_prompt = self._format_prompt(instruction, code)
-            
-            inputs = self.tokenizer(
-                formatted_prompt,
-                return_tensors="pt",
-                truncation=True,
-                max_length=512
-            ).to(self.model.device)
-            
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    **inputs,
-                    max_new_tokens=max_length,
-                    temperature=0.5,
-                    top_p=0.9,
-                    do_sample=True,
-                    pad_token_id=self.tokenizer.pad_token_id,
-                    eos_token_id=self.tokenizer.eos_token_id,
-                    repetition_penalty=1.2,
-                )
-            
-            full_output = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-            response = self._extract_response(full_output)
-            
-            if self._is_garbage_output(response):
-                return self._mock_explain_code(code)
-            return response
-            
-        except Exception as e:
-            logger.error(f"❌ Error: {e}")
-            return self._mock_explain_code(code)
+        return self.run(GenerationRequest(
+            operation="explain_code",
+            instruction="Explain what this code does in detail",
+            input_text=code,
+            max_new_tokens=max_length,
+            seed=seed,
+            greedy=greedy,
+            fallback=lambda: self._mock_explain_code(code)
+        ))
     
-    def debug_code(self, code: str, error_message: str = None) -> str:
+    def debug_code(
+        self,
+        code: str,
+        error_message: str = None,
+        seed: Optional[int] = None,
+        greedy: bool = False,
+    ) -> str:
         """Fix buggy code"""
-        if not self.loaded:
-            return self._mock_debug_code(code, error_message)
-        
-        try:
-            if error_message:
-                instruction = f"Fix the bugs in this code. Error: {error_message}"
-            else:
-                instruction = "Fix any bugs in this code"
-            
-            formatted_prompt = self._format_prompt(instruction, code)
-            
-            inputs = self.tokenizer(
-                formatted_prompt,
-                return_tensors="pt",
-                truncation=True,
-                max_length=512
-            ).to(self.model.device)
-            
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    **inputs,
-                    max_new_tokens=256,
-                    temperature=0.5,
-                    top_p=0.9,
-                    do_sample=True,
-                    pad_token_id=self.tokenizer.pad_token_id,
-                    eos_token_id=self.tokenizer.eos_token_id,
-                    repetition_penalty=1.2,
-                )
-            
-            full_output = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-            response = self._extract_response(full_output)
-            
-            if self._is_garbage_output(response):
-                return self._mock_debug_code(code, error_message)
-            return response
-            
-        except Exception as e:
-            logger.error(f"❌ Error: {e}")
-            return self._mock_debug_code(code, error_message)
+        if error_message:
+            instruction = f"Fix the bugs in this code. Error: {error_message}"
+        else:
+            instruction = "Fix any bugs in this code"
+        return self.run(GenerationRequest(
+            operation="debug_code",
+            instruction=instruction,
+            input_text=code,
+            seed=seed,
+            greedy=greedy,
+            fallback=lambda: self._mock_debug_code(code, error_message)
+        ))
     
-    def refactor_code(self, code: str, instructions: str = "", max_length: int = 256) -> str:
+    def refactor_code(
+        self,
+        code: str,
+        instructions: str = "",
+        max_length: int = 256,
+        seed: Optional[int] = None,
+        greedy: bool = False,
+    ) -> str:
         """Refactor code"""
-        if not self.loaded:
-            return self._mock_refactor_code(code, instructions)
-        
-        try:
-            if instructions:
-                instruction = f"Refactor this code: {instructions}"
-            else:
-                instruction = "Refactor this code to be cleaner and more efficient"
-            
-            formatted_prompt = self._format_prompt(instruction, code)
-            
-            inputs = self.tokenizer(
-                formatted_prompt,
-                return_tensors="pt",
-                truncation=True,
-                max_length=512
-            ).to(self.model.device)
-            
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    **inputs,
-                    max_new_tokens=max_length,
-                    temperature=0.6,
-                    top_p=0.9,
-                    do_sample=True,
-                    pad_token_id=self.tokenizer.pad_token_id,
-                    eos_token_id=self.tokenizer.eos_token_id,
-                    repetition_penalty=1.2,
-                )
-            
-            full_output = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-            response = self._extract_response(full_output)
-            
-            if self._is_garbage_output(response):
-                return self._mock_refactor_code(code, instructions)
-            return response
-            
-        except Exception as e:
-            logger.error(f"❌ Error: {e}")
-            return self._mock_refactor_code(code, instructions)
+        if instructions:
+            instruction = f"Refactor this code: {instructions}"
+        else:
+            instruction = "Refactor this code to be cleaner and more efficient"
+        return self.run(GenerationRequest(
+            operation="refactor_code",
+            instruction=instruction,
+            input_text=code,
+            max_new_tokens=max_length,
+            seed=seed,
+            greedy=greedy,
+            fallback=lambda: self._mock_refactor_code(code, instructions)
+        ))
     
     # ==================== MOCK METHODS ====================
     
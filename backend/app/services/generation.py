@@ -0,0 +1,226 @@
+# app/services/generation.py
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, TYPE_CHECKING
+
+from app.config import settings
+from app.services.sanitizer import clean_response, garbage_reason
+from app.services.solution_index import get_solution_index
+
+if TYPE_CHECKING:
+    from app.services.gemma_service import GemmaService
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class SamplingProfile:
+    """Default decoding settings of one operation"""
+    temperature: float
+    top_p: float
+    top_k: Optional[int] = None
+    max_new_tokens: int = 256
+    # Output mostly copies the input code, so drafting from the prompt pays off
+    speculative: bool = False
+    # Near-identical prompts may be answered from stored passing solutions
+    solution_index: bool = False
+
+
+SAMPLING_PROFILES: Dict[str, SamplingProfile] = {
+    "generate_code": SamplingProfile(temperature=0.7, top_p=0.9, top_k=50, solution_index=True),
+    # Several samples per prompt for generate-and-test; a little hotter for diversity
+    "generate_candidates": SamplingProfile(temperature=0.8, top_p=0.95, top_k=50),
+    "explain_code": SamplingProfile(temperature=0.5, top_p=0.9),
+    "debug_code": SamplingProfile(temperature=0.5, top_p=0.9, speculative=True),
+    "refactor_code": SamplingProfile(temperature=0.6, top_p=0.9, speculative=True),
+    # Map-reduce explanation of large inputs (see chunked_explain_stage)
+    "explain_chunk": SamplingProfile(temperature=0.5, top_p=0.9, max_new_tokens=160),
+    "explain_summary": SamplingProfile(temperature=0.5, top_p=0.9),
+}
+
+
+@dataclass
+class GenerationRequest:
+    """
+    One model request of any operation. Unset sampling fields fall back to the
+    operation's SamplingProfile; `fallback` produces the mock answer used when
+    the model is unavailable or its output is rejected.
+    """
+    operation: str
+    instruction: str
+    fallback: Callable[[], str]
+    input_text: str = ""
+    # Raw user prompt, matched against stored solutions
+    prompt: str = ""
+    max_new_tokens: Optional[int] = None
+    temperature: Optional[float] = None
+    top_p: Optional[float] = None
+    top_k: Optional[int] = None
+    seed: Optional[int] = None
+    greedy: bool = False
+    # Chat follow-ups: earlier turns (ChatTurn) and a summary of older ones, see ChatContextBuilder
+    history: List[Any] = field(default_factory=list)
+    history_summary: str = ""
+    # Keeps the KV cache of this generation for the conversation's next turn
+    conversation_id: Optional[int] = None
+    # Filled in while the request moves through the pipeline
+    cache_key: Optional[str] = field(default=None, init=False)
+
+    @property
+    def profile(self) -> SamplingProfile:
+        return SAMPLING_PROFILES[self.operation]
+
+    def params(self) -> Dict[str, Any]:
+        """Generation params: greedy drops the sampling settings, seed pins the RNG"""
+        profile = self.profile
+        max_new_tokens = self.max_new_tokens or profile.max_new_tokens
+        if self.greedy:
+            params = {"max_new_tokens": max_new_tokens, "do_sample": False}
+            if self.conversation_id is not None:
+                params["conversation_id"] = self.conversation_id
+            return params
+        params = {
+            "max_new_tokens": max_new_tokens,
+            "temperature": profile.temperature if self.temperature is None else self.temperature,
+            "top_p": profile.top_p if self.top_p is None else self.top_p,
+        }
+        top_k = profile.top_k if self.top_k is None else self.top_k
+        if top_k is not None:
+            params["top_k"] = top_k
+        if self.seed is not None:
+            params["seed"] = self.seed
+        if self.conversation_id is not None:
+            params["conversation_id"] = self.conversation_id
+        return params
+
+    @property
+    def has_history(self) -> bool:
+        return bool(self.history or self.history_summary)
+
+
+# A pre-stage may answer the request itself by returning a string
+PreStage = Callable[["GemmaService", GenerationRequest], Optional[str]]
+# A post-stage transforms the model output; returning None rejects it (fallback is served)
+PostStage = Callable[["GemmaService", GenerationRequest, str], Optional[str]]
+
+
+def solution_index_stage(service: "GemmaService", request: GenerationRequest) -> Optional[str]:
+    if not (settings.SOLUTION_INDEX_ENABLED and request.profile.solution_index and request.prompt):
+        return None
+    match = get_solution_index().query(request.prompt)
+    if match is None:
+        return None
+    logger.info(f"⚡ Serving stored solution {match['solution_id']} (similarity {match['similarity']:.2f})")
+    return match["code"]
+
+
+def model_unavailable_stage(service: "GemmaService", request: GenerationRequest) -> Optional[str]:
+    if not service.loaded:
+        return request.fallback()
+    return None
+
+
+def response_cache_stage(service: "GemmaService", request: GenerationRequest) -> Optional[str]:
+    # Chat follow-ups depend on the whole conversation, so they are keyed on the full prompt
+    input_text = service._format_request(request) if request.has_history else request.input_text
+    request.cache_key = service._response_cache_key(
+        request.operation, request.instruction, input_text, request.params()
+    )
+    return service._cached_response(request.cache_key)
+
+
+def chunked_explain_stage(service: "GemmaService", request: GenerationRequest) -> Optional[str]:
+    """Explain large inputs chunk by chunk instead of trimming them to the context window"""
+    if request.operation != "explain_code" or not settings.EXPLAIN_CHUNKING_ENABLED:
+        return None
+    return service._explain_in_chunks(request)
+
+
+def token_budget_stage(service: "GemmaService", request: GenerationRequest) -> Optional[str]:
+    """Fit instruction, input and new tokens into the context window (after the cache lookup)"""
+    service._fit_to_context(request)
+    return None
+
+
+def extract_response_stage(service: "GemmaService", request: GenerationRequest, output: str) -> Optional[str]:
+    return clean_response(output)
+
+
+def garbage_filter_stage(service: "GemmaService", request: GenerationRequest, output: str) -> Optional[str]:
+    reason = garbage_reason(output)
+    if reason is not None:
+        logger.warning(f"⚠️ Garbage output detected ({request.operation}: {reason})")
+        return None
+    return output
+
+
+def cache_store_stage(service: "GemmaService", request: GenerationRequest, output: str) -> Optional[str]:
+    service._cache_response(request.cache_key, output)
+    return output
+
+
+DEFAULT_PRE_STAGES: List[PreStage] = [
+    solution_index_stage,
+    model_unavailable_stage,
+    response_cache_stage,
+    chunked_explain_stage,
+    token_budget_stage,
+]
+DEFAULT_POST_STAGES: List[PostStage] = [extract_response_stage, garbage_filter_stage, cache_store_stage]
+
+
+class GenerationPipeline:
+    """
+    pre-stages -> model (batched through the service) -> post-stages, shared by every operation.
+    Keeps per-operation counters: requests, model generations, fallbacks,
+    answers served by each pre-stage and total seconds.
+    """
+
+    def __init__(self, pre_stages: Optional[List[PreStage]] = None, post_stages: Optional[List[PostStage]] = None):
+        self.pre_stages = list(DEFAULT_PRE_STAGES if pre_stages is None else pre_stages)
+        self.post_stages = list(DEFAULT_POST_STAGES if post_stages is None else post_stages)
+        self._metrics: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def run(self, service: "GemmaService", request: GenerationRequest) -> str:
+        started = time.perf_counter()
+        outcome = "fallback"
+        try:
+            for stage in self.pre_stages:
+                answer = stage(service, request)
+                if answer is not None:
+                    outcome = stage.__name__[:-len("_stage")]
+                    return answer
+
+            logger.info(f"🚀 {request.operation}: {request.instruction[:50]}...")
+            formatted_prompt = service._format_request(request)
+            output = service._generate(formatted_prompt, speculative=request.profile.speculative, **request.params())
+            for stage in self.post_stages:
+                output = stage(service, request, output)
+                if output is None:
+                    return request.fallback()
+            outcome = "generated"
+            logger.info(f"✅ {request.operation} complete")
+            return output
+
+        except Exception as e:
+            logger.error(f"❌ Error: {e}")
+            return request.fallback()
+        finally:
+            self._record(request.operation, outcome, time.perf_counter() - started)
+
+    def _record(self, operation: str, outcome: str, elapsed: float):
+        with self._lock:
+            metrics = self._metrics.setdefault(operation, {"requests": 0, "seconds": 0.0})
+            metrics["requests"] += 1
+            metrics["seconds"] += elapsed
+            metrics[outcome] = metrics.get(outcome, 0) + 1
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                operation: dict(values, seconds=round(values["seconds"], 2))
+                for operation, values in self._metrics.items()
+            }
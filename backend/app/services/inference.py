@@ -0,0 +1,190 @@
+# app/services/inference.py
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Iterable, Optional
+from fastapi import HTTPException, Request
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+
+class InferenceExecutor:
+    """
+    Bounded thread pool for blocking model calls.
+    Routes await it so the event loop stays free for /health and MongoDB endpoints.
+    At most max_workers calls run at once and queue_size more may wait;
+    anything beyond that is rejected with 503 instead of piling up.
+    """
+
+    def __init__(self, max_workers: int, queue_size: int, timeout: float):
+        self.max_workers = max(1, max_workers)
+        self.queue_size = max(0, queue_size)
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix="inference"
+        )
+        # One slot per running or waiting call, released when the worker thread finishes
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.queue_size)
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _reserve(self):
+        if not self._slots.acquire(blocking=False):
+            logger.warning(f"⚠️ Inference queue full ({self._pending} pending) - rejecting request")
+            raise HTTPException(
+                status_code=503,
+                detail="Model is busy. Please try again shortly.",
+                headers={"Retry-After": "5"}
+            )
+        with self._lock:
+            self._pending += 1
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    async def run(self, fn: Callable[..., Any], *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) on the pool, raising 503 when full and 504 on timeout"""
+        self._reserve()
+        try:
+            future = self._executor.submit(partial(fn, *args, **kwargs))
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            # Cancelling on timeout drops calls still waiting in the queue;
+            # a call that is already running keeps its slot until it returns
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"❌ Inference timed out after {timeout}s")
+            raise HTTPException(
+                status_code=504,
+                detail=f"Generation timed out after {timeout:.0f} seconds"
+            )
+
+    def stream(self, iterable: Iterable[Any], timeout: Optional[float] = None) -> "InferenceStream":
+        """
+        Reserve a slot now (503 if full) and return an async iterator over a blocking iterable.
+        The slot is held until the stream ends or is closed; asyncio.TimeoutError is raised mid-stream on timeout.
+        """
+        self._reserve()
+        return InferenceStream(self, iterable, self.timeout if timeout is None else timeout)
+
+    async def _pump(self, iterable: Iterable[Any], timeout: float, release: Callable[[], None]) -> AsyncIterator[Any]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        iterator = iter(iterable)
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                # Pulls use the default loop executor so they never queue behind blocking calls
+                item = await asyncio.wait_for(
+                    loop.run_in_executor(None, next, iterator, _END),
+                    remaining
+                )
+                if item is _END:
+                    break
+                yield item
+        finally:
+            release()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class InferenceStream:
+    """
+    Async iterator returned by InferenceExecutor.stream. aclose() frees the reserved slot
+    even when the stream is closed before its first item - an async generator's finally
+    would never run then (e.g. a route failing between reserving and returning the response).
+    """
+
+    def __init__(self, executor: InferenceExecutor, iterable: Iterable[Any], timeout: float):
+        self._executor = executor
+        self._iterable = iterable
+        self._released = False
+        self._lock = threading.Lock()
+        self._pump = executor._pump(iterable, timeout, self._release)
+
+    def _release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        close = getattr(self._iterable, "close", None)
+        if close is not None:
+            close()
+        self._executor._release(None)
+
+    def __aiter__(self) -> "InferenceStream":
+        return self
+
+    async def __anext__(self) -> Any:
+        return await self._pump.__anext__()
+
+    async def aclose(self):
+        try:
+            await self._pump.aclose()
+        finally:
+            self._release()
+
+
+# Global singleton
+_inference_executor = None
+
+def get_inference_executor() -> InferenceExecutor:
+    global _inference_executor
+    if _inference_executor is None:
+        _inference_executor = InferenceExecutor(
+            max_workers=settings.INFERENCE_MAX_WORKERS,
+            queue_size=settings.INFERENCE_QUEUE_SIZE,
+            timeout=settings.INFERENCE_TIMEOUT_SECONDS
+        )
+    return _inference_executor
+
+async def run_inference(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Await a blocking GemmaService call on the shared inference executor"""
+    return await get_inference_executor().run(fn, *args, **kwargs)
+
+def stream_inference(iterable: Iterable[Any]) -> InferenceStream:
+    """Reserve an inference slot and stream a blocking iterable (e.g. GemmaService.stream_code)"""
+    return get_inference_executor().stream(iterable)
+
+def ensure_not_warming_up(gemma_service):
+    """Raise 503 with a warming-up status while the model is still loading in the background"""
+    if gemma_service is not None and gemma_service.is_loading():
+        raise HTTPException(
+            status_code=503,
+            detail={"status": "warming_up", "message": "Model is still loading. Please retry shortly."},
+            headers={"Retry-After": "10"}
+        )
+
+def get_model_service(request: Request, unavailable_detail: str = "Model not loaded. Please try again later."):
+    """Loaded GemmaService from app state, or 503 while warming up / when no model is available"""
+    gemma_service = getattr(request.app.state, "gemma_service", None)
+    ensure_not_warming_up(gemma_service)
+    if gemma_service is None or not gemma_service.is_loaded():
+        raise HTTPException(status_code=503, detail=unavailable_detail)
+    return gemma_service
+
+def shutdown_inference_executor():
+    global _inference_executor
+    if _inference_executor is not None:
+        _inference_executor.shutdown()
+        _inference_executor = None
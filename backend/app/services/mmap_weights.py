@@ -0,0 +1,105 @@
+# app/services/mmap_weights.py
+import json
+import logging
+import mmap
+import os
+import struct
+from typing import Dict, List
+
+import torch
+import torch.nn as nn
+
+logger = logging.getLogger(__name__)
+
+_SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def safetensors_files(model_path: str) -> List[str]:
+    """The safetensors shards of a model directory (single file or indexed shards)"""
+    index_path = os.path.join(model_path, "model.safetensors.index.json")
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            shards = sorted(set(json.load(f)["weight_map"].values()))
+        return [os.path.join(model_path, shard) for shard in shards]
+    single = os.path.join(model_path, "model.safetensors")
+    if os.path.exists(single):
+        return [single]
+    raise FileNotFoundError(f"No safetensors weights in {model_path}")
+
+
+def mmap_safetensors(path: str) -> Dict[str, torch.Tensor]:
+    """
+    Tensors of one safetensors file as views into a private (copy-on-write) memory map.
+    Pages come straight from the OS page cache, so every process mapping the same
+    file shares them until something writes to a weight.
+    """
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    data_start = 8 + header_size
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = _SAFETENSORS_DTYPES.get(info["dtype"])
+        if dtype is None:
+            raise ValueError(f"Unsupported safetensors dtype {info['dtype']} for {name}")
+        begin, end = info["data_offsets"]
+        if begin == end:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        # The tensor keeps the mmap alive for as long as it is referenced
+        tensor = torch.frombuffer(buffer, dtype=dtype, count=(end - begin) // dtype.itemsize, offset=data_start + begin)
+        tensors[name] = tensor.view(info["shape"])
+    return tensors
+
+
+def load_model_mmap(model_path: str) -> nn.Module:
+    """
+    Build the model without initializing weights and point its parameters at
+    memory-mapped safetensors data (CPU only, checkpoint dtype kept as-is).
+    """
+    from transformers import AutoConfig, AutoModelForCausalLM
+    from transformers.modeling_utils import no_init_weights
+
+    state_dict = {}
+    for path in safetensors_files(model_path):
+        state_dict.update(mmap_safetensors(path))
+
+    dtypes = {t.dtype for t in state_dict.values() if t.is_floating_point()}
+    dtype = dtypes.pop() if len(dtypes) == 1 else torch.float32
+    if dtype == torch.float16:
+        # Half-precision matmuls are slow or missing on CPU; converting copies every weight
+        logger.warning("⚠️ Weights are stored as float16 - converting to float32, pages will not be shared")
+        dtype = torch.float32
+        state_dict = {name: t.float() if t.is_floating_point() else t for name, t in state_dict.items()}
+
+    config = AutoConfig.from_pretrained(model_path, trust_remote_code=True, local_files_only=True)
+    # Skipped initialization leaves the placeholder weights untouched, so they never become resident
+    with no_init_weights():
+        model = AutoModelForCausalLM.from_config(config, torch_dtype=dtype, trust_remote_code=True)
+
+    result = model.load_state_dict(state_dict, strict=False, assign=True)
+    model.tie_weights()
+    tied = {name for name, _ in model.named_parameters(remove_duplicate=False)} - {
+        name for name, _ in model.named_parameters()
+    }
+    missing = [name for name in result.missing_keys if name not in tied]
+    if missing or result.unexpected_keys:
+        raise ValueError(f"Checkpoint does not match the model (missing {missing[:5]}, unexpected {result.unexpected_keys[:5]})")
+
+    logger.info(f"✅ Memory-mapped {len(state_dict)} tensors ({dtype})")
+    return model
@@ -0,0 +1,181 @@
+# app/services/quantization.py
+import json
+import logging
+import os
+from typing import Optional
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATION_MODES = ("none", "int8", "int4")
+
+
+# Packed int4 x bf16 matmul on CPU (PyTorch >= 2.6); weights are never expanded to floats
+_INT4_KERNEL = (
+    hasattr(torch.ops.aten, "_weight_int4pack_mm_for_cpu")
+    and hasattr(torch.ops.aten, "_convert_weight_to_int4pack_for_cpu")
+)
+# Output rows dequantized at a time when the kernel cannot be used
+_DEQUANT_TILE_ROWS = 256
+
+
+class Int4WeightOnlyLinear(nn.Module):
+    """
+    Linear layer with weights stored as packed int4 (two values per byte)
+    and one scale per group of input columns, cutting weight memory ~8x vs fp32.
+    With the int4pack kernel the matmul reads the packed weights directly
+    (activations are cast to bf16 for it); otherwise weights are dequantized
+    a tile of output rows at a time, never as a whole fp32 matrix.
+    """
+
+    # Checkpoints saved before the kernel layout existed unpickle without the attribute
+    layout = "nibbles"
+
+    def __init__(self, in_features: int, out_features: int, group_size: int, bias: Optional[torch.Tensor]):
+        super().__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.group_size = group_size
+        self.padded_in = -(-in_features // group_size) * group_size
+        self.register_buffer("packed", torch.zeros(out_features, self.padded_in // 2, dtype=torch.uint8))
+        self.register_buffer("scales", torch.zeros(out_features, self.padded_in // group_size, dtype=torch.float32))
+        if bias is not None:
+            self.register_buffer("bias", bias.detach().clone().float())
+        else:
+            self.bias = None
+
+    def _kernel_tiles(self) -> Optional[int]:
+        """inner_k_tiles for the int4pack layout, or None when the shapes do not fit the kernel"""
+        if not _INT4_KERNEL or self.out_features % 16 or self.group_size not in (32, 64, 128, 256):
+            return None
+        return next((tiles for tiles in (8, 4, 2) if self.padded_in % (tiles * 16) == 0), None)
+
+    @classmethod
+    def from_linear(cls, linear: nn.Linear, group_size: int = 64) -> "Int4WeightOnlyLinear":
+        module = cls(linear.in_features, linear.out_features, group_size, linear.bias)
+        weight = linear.weight.detach().float()
+        if module.padded_in != weight.shape[1]:
+            weight = F.pad(weight, (0, module.padded_in - weight.shape[1]))
+        groups = weight.view(weight.shape[0], -1, group_size)
+        # Symmetric quantization to [-8, 7] per group, stored with an offset of 8
+        scales = groups.abs().amax(dim=-1).clamp(min=1e-8) / 7.0
+        q = torch.clamp(torch.round(groups / scales.unsqueeze(-1)), -8, 7).to(torch.int16) + 8
+        q = q.view(weight.shape[0], -1)
+
+        tiles = module._kernel_tiles()
+        if tiles is not None:
+            # The kernel computes (q - 8) * scale + zero per group; zero is 0 for symmetric groups
+            module.layout = "int4pack"
+            module.packed = torch.ops.aten._convert_weight_to_int4pack_for_cpu(q.to(torch.int32), tiles)
+            module.scales = torch.stack((scales.t(), torch.zeros_like(scales.t())), dim=-1).to(torch.bfloat16).contiguous()
+        else:
+            q = q.to(torch.uint8)
+            module.packed.copy_(q[:, 0::2] | (q[:, 1::2] << 4))
+            module.scales.copy_(scales)
+        return module
+
+    def _dequantize_rows(self, start: int, end: int) -> torch.Tensor:
+        packed = self.packed[start:end]
+        low = (packed & 0x0F).to(torch.int16)
+        high = (packed >> 4).to(torch.int16)
+        q = torch.stack((low, high), dim=-1).view(packed.shape[0], -1) - 8
+        groups = q.view(packed.shape[0], -1, self.group_size).float() * self.scales[start:end].unsqueeze(-1)
+        return groups.view(packed.shape[0], -1)[:, :self.in_features]
+
+    def dequantize(self) -> torch.Tensor:
+        """Full fp32 weight matrix (for inspection; forward never builds it)"""
+        if self.layout == "int4pack":
+            identity = torch.eye(self.padded_in, dtype=torch.bfloat16)
+            weight = torch.ops.aten._weight_int4pack_mm_for_cpu(identity, self.packed, self.group_size, self.scales)
+            return weight.t().float()[:, :self.in_features]
+        return self._dequantize_rows(0, self.out_features)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        if self.layout == "int4pack":
+            rows = x.reshape(-1, x.shape[-1])
+            if self.padded_in != self.in_features:
+                rows = F.pad(rows, (0, self.padded_in - self.in_features))
+            out = torch.ops.aten._weight_int4pack_mm_for_cpu(
+                rows.to(torch.bfloat16).contiguous(), self.packed, self.group_size, self.scales
+            )
+            out = out.to(x.dtype).view(*x.shape[:-1], self.out_features)
+        else:
+            out = torch.cat([
+                F.linear(x, self._dequantize_rows(start, start + _DEQUANT_TILE_ROWS).to(x.dtype))
+                for start in range(0, self.out_features, _DEQUANT_TILE_ROWS)
+            ], dim=-1)
+        if self.bias is not None:
+            out = out + self.bias.to(x.dtype)
+        return out
+
+    def extra_repr(self) -> str:
+        return (f"in_features={self.in_features}, out_features={self.out_features}, "
+                f"group_size={self.group_size}, layout={self.layout}")
+
+
+def _quantizable_linears(model: nn.Module):
+    """Every nn.Linear except the output head, which is tied to the embeddings and most precision-sensitive"""
+    for name, module in model.named_modules():
+        if isinstance(module, nn.Linear) and not name.endswith("lm_head"):
+            yield name, module
+
+
+def quantize_model(model: nn.Module, mode: str) -> nn.Module:
+    """Quantize a CPU float model in place: dynamic int8 (torch.ao) or weight-only int4"""
+    if mode == "int8":
+        from torch.ao.quantization import default_dynamic_qconfig, quantize_dynamic
+        qconfig_spec = {name: default_dynamic_qconfig for name, _ in _quantizable_linears(model)}
+        return quantize_dynamic(model, qconfig_spec, dtype=torch.qint8, inplace=True)
+
+    if mode == "int4":
+        for name, linear in list(_quantizable_linears(model)):
+            parent_name, _, child_name = name.rpartition(".")
+            parent = model.get_submodule(parent_name) if parent_name else model
+            setattr(parent, child_name, Int4WeightOnlyLinear.from_linear(linear))
+        return model
+
+    raise ValueError(f"Unknown quantization mode: {mode} (expected one of {QUANTIZATION_MODES})")
+
+
+def checkpoint_path(checkpoint_dir: str, model_path: str, mode: str) -> str:
+    name = os.path.basename(os.path.normpath(model_path))
+    return os.path.join(checkpoint_dir, f"{name}-{mode}.pt")
+
+
+def save_quantized_checkpoint(model: nn.Module, path: str, source_revision: str):
+    """Save the whole quantized module so later startups skip both the fp32 load and quantization"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    torch.save(model, tmp_path)
+    os.replace(tmp_path, path)
+    with open(path + ".json", "w") as f:
+        json.dump({"source_revision": source_revision}, f)
+    logger.info(f"💾 Saved quantized checkpoint: {path}")
+
+
+def load_quantized_checkpoint(path: str, source_revision: str, mmap: bool = False) -> Optional[nn.Module]:
+    """
+    Load a saved quantized model, or None when missing or built from different weights.
+    With mmap=True plain tensors (the int4 buffers) stay backed by the file's page cache.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path + ".json") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        meta = {}
+    if meta.get("source_revision") != source_revision:
+        logger.warning(f"⚠️ Quantized checkpoint {path} is stale - re-quantizing")
+        return None
+    logger.info(f"📥 Loading quantized checkpoint: {path}")
+    model = torch.load(path, map_location="cpu", weights_only=False, mmap=mmap)
+    if not _INT4_KERNEL and any(
+        isinstance(module, Int4WeightOnlyLinear) and module.layout == "int4pack" for module in model.modules()
+    ):
+        logger.warning(f"⚠️ Quantized checkpoint {path} needs the int4pack kernel (PyTorch >= 2.6) - re-quantizing")
+        return None
+    return model
@@ -0,0 +1,104 @@
+# app/services/sanitizer.py
+"""
+Post-processing of generated text: cutting the response at stop markers or
+garbage, and scoring whether what is left is usable at all.
+All patterns are compiled once; each function scans the text a fixed number
+of times at C speed instead of looping over patterns and lines in Python.
+"""
+import re
+from typing import Optional, Tuple
+
+# Text after any of these markers is never part of the answer
+STOP_MARKERS = ("### Instruction:", "Below is an instruction", "###", "/code", "\n\n\n")
+# Runaway number sequences like "2.3.4.5.6" and labels like "3D:2.3"
+GARBAGE_NUMBER_RE = re.compile(r'\d+\.\d+\.\d+\.\d+[\d\.]*')
+GARBAGE_LABEL_RE = re.compile(r'[A-Z0-9]{1,3}:\d+\.\d+')
+NUMERIC_LINE_RE = re.compile(r'^[\d\.\s,]+$')
+# A trailing run that could still grow into one of the garbage patterns (used while streaming)
+PARTIAL_GARBAGE_RE = re.compile(r'[A-Z0-9]{1,3}(?::[\d\.]*)?$|[\d\.]*\d[\d\.]*$')
+
+# Every stop marker and garbage pattern in one alternation: one search finds the earliest cut.
+# The lookahead on the possible first characters lets the engine skip most positions cheaply.
+_CUT_FIRST_CHARS = "".join(sorted({re.escape(marker[0]) for marker in STOP_MARKERS})) + "0-9A-Z"
+_RESPONSE_CUT_RE = re.compile(
+    f"(?=[{_CUT_FIRST_CHARS}])(?:"
+    + "|".join([re.escape(marker) for marker in STOP_MARKERS] + [GARBAGE_NUMBER_RE.pattern, GARBAGE_LABEL_RE.pattern])
+    + ")"
+)
+# A numbers-only line longer than 10 characters (ignoring surrounding whitespace)
+_NUMERIC_LINE_CUT_RE = re.compile(r'^[^\S\n]*[\d.,](?:[\d.,]|[^\S\n]){9,}[\d.,][^\S\n]*$', re.MULTILINE)
+# First fenced block of a markdown answer ("```python ... ```"); the closing fence may be cut off
+_CODE_FENCE_RE = re.compile(r'```[\w+-]*[^\S\n]*\n(.*?)(?:```|\Z)', re.DOTALL)
+# Letter candidates; str.isalpha() confirms them (the class also admits a few numeric symbols)
+_LETTER_RE = re.compile(r'[^\W\d_]')
+
+
+def find_response_cut(text: str, start: int = 0, first_line_complete: bool = True) -> Optional[int]:
+    """
+    Earliest position at or after start where clean_response would cut the
+    response (stop marker, garbage number sequence or a long numbers-only line)
+    """
+    cuts = []
+    match = _RESPONSE_CUT_RE.search(text, start)
+    if match:
+        cuts.append(match.start())
+    # Complete lines made only of numbers end the response at the line start
+    line_start = text.rfind("\n", 0, start) + 1
+    if line_start == 0 and not first_line_complete:
+        line_start = text.find("\n") + 1 or len(text)
+    while True:
+        line_end = text.find("\n", line_start)
+        if line_end == -1:
+            break
+        line = text[line_start:line_end].strip()
+        if len(line) > 10 and NUMERIC_LINE_RE.match(line):
+            cuts.append(line_start)
+            break
+        line_start = line_end + 1
+    return min(cuts) if cuts else None
+
+
+def clean_response(text: str) -> str:
+    """Cut generated text (prompt already removed) at the first stop marker or garbage"""
+    response = text.strip()
+    match = _RESPONSE_CUT_RE.search(response)
+    if match:
+        response = response[:match.start()].rstrip()
+    # Numbers-only lines are judged on the cut text, whose last line may now be shorter
+    match = _NUMERIC_LINE_CUT_RE.search(response)
+    if match:
+        response = response[:match.start()]
+    return response.strip()
+
+
+def garbage_reason(text: str) -> Optional[str]:
+    """Why a cleaned response is unusable ("too_short", "non_ascii", "no_letters", "repetitive"), or None"""
+    if not text or len(text) < 5:
+        return "too_short"
+    if not text.isascii():
+        non_ascii = len(text) - len(text.encode("ascii", "ignore"))
+        if non_ascii > len(text) * 0.3:
+            return "non_ascii"
+    if not any(match.group().isalpha() for match in _LETTER_RE.finditer(text)):
+        return "no_letters"
+    # Repetitive output: few distinct words
+    words = text.split()
+    if len(words) > 10 and len(set(words)) < len(words) * 0.3:
+        return "repetitive"
+    return None
+
+
+def is_garbage(text: str) -> bool:
+    return garbage_reason(text) is not None
+
+
+def sanitize(text: str) -> Tuple[str, Optional[str]]:
+    """Cleaned response plus the reason it is garbage (None when usable)"""
+    response = clean_response(text)
+    return response, garbage_reason(response)
+
+
+def extract_code(text: str) -> str:
+    """Code inside the first markdown fence, or the whole text when it is not fenced"""
+    match = _CODE_FENCE_RE.search(text)
+    return (match.group(1) if match else text).strip("\n")
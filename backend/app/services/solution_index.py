@@ -0,0 +1,167 @@
+# app/services/solution_index.py
+import glob
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+from typing import Dict, List, Optional, Set
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"[a-z0-9_]+")
+# Mersenne prime used for the MinHash permutations
+_PRIME = (1 << 61) - 1
+
+
+def _shingles(text: str) -> Set[str]:
+    """Lower-cased words plus word bigrams - prompts are short, so both are needed"""
+    words = _WORD_RE.findall(text.lower())
+    shingles = set(words)
+    shingles.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    return shingles
+
+
+def _jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class SolutionIndex:
+    """
+    MinHash/LSH index over the prompts of stored passing solutions.
+    LSH buckets find candidates in O(bands); candidates are then ranked by
+    exact Jaccard similarity of their shingles against the threshold.
+    """
+
+    def __init__(self, threshold: float, num_perm: int = 64, bands: int = 16):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = random.Random(1234)
+        self._perms = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)]
+        self._buckets: List[Dict[tuple, List[str]]] = [{} for _ in range(bands)]
+        self._entries: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _signature(self, shingles: Set[str]) -> List[int]:
+        hashes = [
+            int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+            for s in shingles
+        ]
+        return [min((a * h + b) % _PRIME for h in hashes) for a, b in self._perms]
+
+    def _band_keys(self, signature: List[int]):
+        for band in range(self.bands):
+            yield band, tuple(signature[band * self.rows:(band + 1) * self.rows])
+
+    def add(self, solution_id: str, prompt: str, code: str, problem_id: Optional[str] = None):
+        """Index one passing solution (re-adding the same id is a no-op)"""
+        shingles = _shingles(prompt)
+        if not shingles or not code:
+            return
+        signature = self._signature(shingles)
+        with self._lock:
+            if solution_id in self._entries:
+                return
+            self._entries[solution_id] = {
+                "solution_id": solution_id,
+                "problem_id": problem_id,
+                "prompt": prompt,
+                "code": code,
+                "shingles": shingles,
+            }
+            for band, key in self._band_keys(signature):
+                self._buckets[band].setdefault(key, []).append(solution_id)
+
+    def query(self, prompt: str) -> Optional[dict]:
+        """Best stored solution whose prompt is at least `threshold` similar, or None"""
+        shingles = _shingles(prompt)
+        if not shingles or not self._entries:
+            return None
+        signature = self._signature(shingles)
+
+        best = None
+        best_score = 0.0
+        with self._lock:
+            candidates = set()
+            for band, key in self._band_keys(signature):
+                candidates.update(self._buckets[band].get(key, ()))
+            for solution_id in candidates:
+                entry = self._entries[solution_id]
+                score = _jaccard(shingles, entry["shingles"])
+                if score > best_score:
+                    best, best_score = entry, score
+
+            if best is None or best_score < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        return {
+            "solution_id": best["solution_id"],
+            "problem_id": best["problem_id"],
+            "prompt": best["prompt"],
+            "code": best["code"],
+            "similarity": round(best_score, 3),
+        }
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "solutions": len(self._entries),
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    async def load_from_database(self, solutions_collection) -> int:
+        """Index every passing solution already stored in MongoDB"""
+        count = 0
+        cursor = solutions_collection.find(
+            {"status": "passed"},
+            {"prompt": 1, "code": 1, "problem_id": 1}
+        )
+        async for doc in cursor:
+            self.add(str(doc["_id"]), doc.get("prompt", ""), doc.get("code", ""), doc.get("problem_id"))
+            count += 1
+        return count
+
+    def load_from_directory(self, directory: str) -> int:
+        """Index passing solutions saved by the file fallback of /store_solution"""
+        count = 0
+        for path in glob.glob(os.path.join(directory, "*.json")):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"⚠️ Skipping unreadable solution file {path}: {e}")
+                continue
+            if data.get("status") != "passed":
+                continue
+            solution_id = os.path.splitext(os.path.basename(path))[0]
+            self.add(solution_id, data.get("prompt", ""), data.get("code", ""), data.get("problem_id"))
+            count += 1
+        return count
+
+
+# Global singleton
+_solution_index = None
+
+def get_solution_index() -> SolutionIndex:
+    global _solution_index
+    if _solution_index is None:
+        _solution_index = SolutionIndex(threshold=settings.SOLUTION_SIMILARITY_THRESHOLD)
+    return _solution_index
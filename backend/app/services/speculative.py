@@ -0,0 +1,113 @@
+# app/services/speculative.py
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+SPECULATIVE_MODES = ("off", "ngram", "draft")
+
+
+class SpeculativeRun:
+    """Draft/verify counts of one assisted generate call"""
+    __slots__ = ("steps", "proposed", "accepted", "drafting")
+
+    def __init__(self):
+        self.steps = 0
+        self.proposed = 0
+        self.accepted = 0
+        # True between proposing draft tokens and verifying them; stopping criteria
+        # called meanwhile see unverified tokens
+        self.drafting = False
+
+    @property
+    def acceptance_rate(self) -> float:
+        return self.accepted / self.proposed if self.proposed else 0.0
+
+
+class _CountingCandidateGenerator:
+    """Wraps a transformers CandidateGenerator and counts proposed vs accepted draft tokens"""
+
+    def __init__(self, generator, run: SpeculativeRun):
+        self._generator = generator
+        self._run = run
+
+    def get_candidates(self, input_ids: torch.LongTensor):
+        candidate_ids, candidate_logits = self._generator.get_candidates(input_ids)
+        self._run.steps += 1
+        self._run.proposed += candidate_ids.shape[1] - input_ids.shape[1]
+        self._run.drafting = True
+        return candidate_ids, candidate_logits
+
+    def update_candidate_strategy(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, num_matches: int):
+        self._run.accepted += int(num_matches)
+        self._run.drafting = False
+        return self._generator.update_candidate_strategy(input_ids, scores, num_matches)
+
+    def __getattr__(self, name: str):
+        return getattr(self._generator, name)
+
+
+class SpeculativeDecoder:
+    """
+    Assisted generation for the main model: the drafter proposes several tokens,
+    one forward pass of the main model verifies them all.
+    "ngram" drafts by looking up the last generated n-gram in the prompt (prompt lookup),
+    which suits debug/refactor outputs that mostly copy the input code;
+    "draft" runs a small model sharing the tokenizer.
+    transformers supports assisted generation for batch size 1 only.
+    """
+
+    def __init__(self, model, mode: str, num_tokens: int = 10, draft_model=None):
+        if mode not in ("ngram", "draft"):
+            raise ValueError(f"Unknown speculative mode: {mode} (expected one of {SPECULATIVE_MODES})")
+        if mode == "draft" and draft_model is None:
+            raise ValueError("Speculative mode 'draft' needs a draft model")
+        self.mode = mode
+        self.num_tokens = num_tokens
+        self.draft_model = draft_model
+        self._local = threading.local()
+        # Wrap the candidate generator so every assisted call reports its acceptance counts
+        make_generator = model._get_candidate_generator
+
+        def counting_candidate_generator(*args, **kwargs):
+            generator = make_generator(*args, **kwargs)
+            run = getattr(self._local, "run", None)
+            return _CountingCandidateGenerator(generator, run) if run is not None else generator
+
+        model._get_candidate_generator = counting_candidate_generator
+
+    def generate_kwargs(self) -> Dict[str, Any]:
+        if self.mode == "ngram":
+            return {"prompt_lookup_num_tokens": self.num_tokens}
+        return {"assistant_model": self.draft_model}
+
+    def start_run(self) -> SpeculativeRun:
+        """Count the next assisted generate call on this thread"""
+        self._local.run = SpeculativeRun()
+        return self._local.run
+
+    def finish_run(self):
+        self._local.run = None
+
+
+def load_draft_model(path: str, device: str, tokenizer) -> Optional[torch.nn.Module]:
+    """Load the draft model, or None when it cannot share the main model's tokenizer"""
+    from transformers import AutoModelForCausalLM
+
+    draft = AutoModelForCausalLM.from_pretrained(
+        path,
+        torch_dtype=torch.float16 if device == "cuda" else torch.float32,
+        low_cpu_mem_usage=True,
+        trust_remote_code=True,
+        local_files_only=True
+    ).to(device).eval()
+    if draft.config.vocab_size < len(tokenizer):
+        logger.warning(
+            f"⚠️ Draft model vocabulary ({draft.config.vocab_size}) does not cover "
+            f"the main tokenizer ({len(tokenizer)}) - ignoring it"
+        )
+        return None
+    return draft
@@ -0,0 +1,80 @@
+# app/services/test_runner_client.py
+import asyncio
+import logging
+from math import comb
+from typing import Any, Dict, List
+
+import httpx
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownProblemError(Exception):
+    """The test runner has no test suite for the problem_id (a caller error, not a runner failure)"""
+
+
+def pass_at_k(n: int, c: int, k: int) -> float:
+    """Unbiased pass@k estimate from n samples of which c passed: 1 - C(n-c, k) / C(n, k)"""
+    if n <= 0 or k <= 0:
+        return 0.0
+    k = min(k, n)
+    if n - c < k:
+        return 1.0
+    return 1.0 - comb(n - c, k) / comb(n, k)
+
+
+async def _run_candidate(client: httpx.AsyncClient, problem_id: str, index: int, code: str) -> Dict[str, Any]:
+    result = {
+        "index": index,
+        "code": code,
+        "tests_passed": False,
+        "error": None,
+        "fix_method": None,
+        "runner_error": False,
+    }
+    try:
+        response = await client.post("/run_tests", json={"problem_id": problem_id, "code": code})
+        if response.status_code == 404:
+            raise UnknownProblemError(f"No test suite for problem_id '{problem_id}'")
+        response.raise_for_status()
+        body = response.json()
+    except httpx.TimeoutException:
+        result["error"] = "Test runner timed out"
+        result["runner_error"] = True
+        return result
+    except httpx.HTTPError as e:
+        result["error"] = f"Test runner error: {e}"
+        result["runner_error"] = True
+        return result
+
+    result["tests_passed"] = bool(body.get("tests_passed"))
+    result["error"] = body.get("error")
+    result["fix_method"] = body.get("fix_method")
+    if body.get("fixed_code"):
+        # The runner's free auto-fix tiers may have repaired the candidate
+        result["code"] = body["fixed_code"]
+    return result
+
+
+async def test_candidates(problem_id: str, candidates: List[str]) -> List[Dict[str, Any]]:
+    """
+    POST every candidate to the test runner's /run_tests concurrently; results in candidate order.
+    Raises UnknownProblemError when the runner does not know the problem_id.
+    """
+    async with httpx.AsyncClient(
+        base_url=settings.TEST_RUNNER_URL,
+        timeout=settings.TEST_RUNNER_TIMEOUT_SECONDS
+    ) as client:
+        # Every request finishes before the client closes, even when one of them raises
+        results = await asyncio.gather(*[
+            _run_candidate(client, problem_id, index, code)
+            for index, code in enumerate(candidates)
+        ], return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    passed = sum(1 for result in results if result["tests_passed"])
+    logger.info(f"🧪 {problem_id}: {passed}/{len(results)} candidates passed")
+    return list(results)
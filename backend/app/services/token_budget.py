@@ -0,0 +1,154 @@
+# app/services/token_budget.py
+import ast
+import logging
+import re
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Top-level lines that start a new block when the code does not parse (common for debug_code)
+_BLOCK_START_RE = re.compile(r'^(?:async\s+def|def|class|@)\b')
+_IDENTIFIER_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+# Placeholder input so the prompt template with an "### Input:" section can be measured
+_PLACEHOLDER_INPUT = "x"
+# Tokens kept free for the "lines omitted" comments and tokenizer merges at the seams
+_SEAM_TOKENS = 16
+
+
+@dataclass
+class PromptBudget:
+    """Instruction, input and new-token reservation that together fit the context window"""
+    instruction: str
+    input_text: str
+    max_new_tokens: int
+    prompt_tokens: int
+    omitted_lines: int = 0
+
+    @property
+    def trimmed(self) -> bool:
+        return self.omitted_lines > 0
+
+
+def code_blocks(code: str) -> List[Tuple[int, int, Optional[str]]]:
+    """
+    (first_line, end_line, name) of every top-level block, 0-based and end-exclusive.
+    Decorators belong to their definition; comments and blank lines stay with the block above.
+    Falls back to splitting on top-level def/class lines when the code does not parse.
+    """
+    lines = code.split("\n")
+    starts: List[Tuple[int, Optional[str]]] = []
+    try:
+        for node in ast.parse(code).body:
+            first = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])]) - 1
+            starts.append((first, getattr(node, "name", None)))
+    except (SyntaxError, ValueError):
+        starts = []
+        for i, line in enumerate(lines):
+            if _BLOCK_START_RE.match(line):
+                match = re.match(r'(?:async\s+def|def|class)\s+(\w+)', line)
+                starts.append((i, match.group(1) if match else None))
+
+    if not starts or starts[0][0] > 0:
+        starts.insert(0, (0, None))
+    blocks = []
+    for index, (first, name) in enumerate(starts):
+        end = starts[index + 1][0] if index + 1 < len(starts) else len(lines)
+        if end > first:
+            blocks.append((first, end, name))
+    return blocks
+
+
+class TokenBudgetPlanner:
+    """
+    Fits instruction + input + reserved new tokens into the model's context window.
+    Inputs that are too long are trimmed on function/class boundaries (blocks named
+    in the instruction, e.g. by an error message, are kept first) instead of being
+    cut by the tokenizer, so the "### Response:" marker always stays in the prompt.
+    """
+
+    def __init__(self, tokenizer, context_window: int, format_prompt: Callable[[str, str], str]):
+        self.tokenizer = tokenizer
+        self.context_window = context_window
+        self.format_prompt = format_prompt
+
+    def count(self, text: str) -> int:
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def prompt_tokens(self, instruction: str, input_text: str) -> int:
+        return len(self.tokenizer(self.format_prompt(instruction, input_text))["input_ids"])
+
+    def plan(self, instruction: str, input_text: str, max_new_tokens: int) -> PromptBudget:
+        # Never let the answer take more than half of the window
+        max_new_tokens = max(1, min(max_new_tokens, self.context_window // 2))
+        limit = self.context_window - max_new_tokens
+        total = self.prompt_tokens(instruction, input_text)
+        if total <= limit:
+            return PromptBudget(instruction, input_text, max_new_tokens, total)
+
+        # A huge instruction (e.g. a long error message) keeps its head only
+        fixed = self.prompt_tokens(instruction, _PLACEHOLDER_INPUT if input_text else "")
+        if fixed > limit // 2:
+            instruction = self.truncate(instruction, max(16, limit // 4))
+            fixed = self.prompt_tokens(instruction, _PLACEHOLDER_INPUT if input_text else "")
+
+        omitted = 0
+        if input_text:
+            input_text, omitted = self._trim_code(input_text, max(0, limit - fixed - _SEAM_TOKENS), instruction)
+        # Tokens can merge differently at the seams; drop trailing lines until it really fits
+        total = self.prompt_tokens(instruction, input_text)
+        while total > limit and input_text:
+            lines = input_text.split("\n")
+            input_text = "\n".join(lines[:-1])
+            omitted += 1
+            total = self.prompt_tokens(instruction, input_text)
+
+        logger.info(
+            f"✂️ Prompt trimmed to fit {self.context_window} tokens: "
+            f"{total} prompt + {max_new_tokens} new ({omitted} input lines omitted)"
+        )
+        return PromptBudget(instruction, input_text, max_new_tokens, total, omitted)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        ids = self.tokenizer(text, add_special_tokens=False)["input_ids"][:max_tokens]
+        return self.tokenizer.decode(ids, skip_special_tokens=True)
+
+    def _trim_code(self, code: str, budget: int, instruction: str) -> Tuple[str, int]:
+        """Keep whole blocks within budget, in their original order; returns (code, omitted lines)"""
+        lines = code.split("\n")
+        blocks = code_blocks(code)
+        costs = [self.count("\n".join(lines[first:end])) for first, end, _ in blocks]
+
+        # Blocks the instruction refers to (function names in an error message) come first
+        mentioned = set(_IDENTIFIER_RE.findall(instruction))
+        order = sorted(range(len(blocks)), key=lambda i: (blocks[i][2] not in mentioned, i))
+        keep, used = set(), 0
+        for i in order:
+            if used + costs[i] <= budget:
+                keep.add(i)
+                used += costs[i]
+
+        if not keep:
+            # Not even one block fits: keep the head of the most relevant one line by line
+            first, end, _ = blocks[order[0]]
+            kept_lines, used = [], 0
+            for line in lines[first:end]:
+                used += self.count(line) + 1
+                if used > budget:
+                    break
+                kept_lines.append(line)
+            return "\n".join(kept_lines), len(lines) - len(kept_lines)
+
+        out, omitted, gap = [], 0, 0
+        for i, (first, end, _) in enumerate(blocks):
+            if i in keep:
+                if gap:
+                    out.append(f"# ... ({gap} lines omitted) ...")
+                    gap = 0
+                out.extend(lines[first:end])
+            else:
+                gap += end - first
+                omitted += end - first
+        if gap:
+            out.append(f"# ... ({gap} lines omitted) ...")
+        return "\n".join(out), omitted
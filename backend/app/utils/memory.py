@@ -0,0 +1,34 @@
+# app/utils/memory.py
+import os
+import resource
+from typing import Dict
+
+
+def process_memory() -> Dict[str, float]:
+    """
+    Resident memory of this process in MB.
+    rss counts shared pages in full; pss splits them between the processes mapping
+    them, so summing pss over uvicorn workers gives the real total.
+    """
+    usage = {"pid": os.getpid()}
+    try:
+        # Linux only: one pre-summed line per field
+        with open("/proc/self/smaps_rollup") as f:
+            fields = {}
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1])
+    except OSError:
+        fields = {}
+
+    if fields:
+        usage["rss_mb"] = round(fields.get("Rss", 0) / 1024, 1)
+        usage["pss_mb"] = round(fields.get("Pss", 0) / 1024, 1)
+        usage["shared_mb"] = round((fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0)) / 1024, 1)
+        usage["private_mb"] = round((fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)) / 1024, 1)
+    else:
+        # ru_maxrss is the peak, in KB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        usage["max_rss_mb"] = round(peak / (1024 * 1024 if os.uname().sysname == "Darwin" else 1024), 1)
+    return usage
@@ -0,0 +1,49 @@
+import asyncio
+import json
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_generation_events(
+    chunks: AsyncIterator[str],
+    stream,
+    done_payload: Optional[Dict[str, Any]] = None,
+    on_complete: Optional[Callable[[str], Awaitable[None]]] = None,
+) -> AsyncIterator[str]:
+    """
+    Turn a GenerationStream into SSE: one `token` event per released chunk,
+    then a `done` event carrying the final cleaned text (use it to replace the
+    streamed text, e.g. when the output was garbage and the fallback was used)
+    """
+    try:
+        async for chunk in chunks:
+            yield format_sse("token", {"text": chunk})
+    except asyncio.TimeoutError:
+        logger.error("❌ Stream timed out")
+        yield format_sse("error", {"detail": "Generation timed out"})
+        return
+    except Exception as e:
+        logger.error(f"❌ Stream error: {e}")
+        yield format_sse("error", {"detail": str(e)})
+        return
+
+    if on_complete is not None:
+        await on_complete(stream.text)
+
+    payload = dict(done_payload or {})
+    payload.update({
+        "text": stream.text,
+        "stopped_early": stream.stopped_early,
+        "fallback": stream.used_fallback,
+    })
+    yield format_sse("done", payload)
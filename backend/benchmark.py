@@ -0,0 +1,468 @@
+# backend/benchmark.py
+"""
+Performance checks for the Luffy backend.
+
+Usage (from backend/, with MODEL_PATH pointing at the model):
+    python benchmark.py ttft
+    python benchmark.py quantization --mode int8
+    python benchmark.py memory --workers 4 --load-mode mmap
+    python benchmark.py speculative --mode ngram
+    python benchmark.py sanitizer
+    python benchmark.py conversations
+    python benchmark.py lint
+"""
+import argparse
+import asyncio
+import copy
+import difflib
+import multiprocessing
+import re
+import statistics
+import time
+import timeit
+import logging
+
+import torch
+
+logging.basicConfig(level=logging.WARNING)
+
+BENCH_PROMPTS = [
+    "Write a function to add two numbers",
+    "Write a function that reverses a string",
+    "Calculate the factorial of a number",
+    "Check if a number is prime",
+]
+
+BENCH_CODE = """def multiply(a, b, c):
+    return a * b
+"""
+
+BENCH_LONG_CODE = """def find_duplicates(items):
+    seen = set()
+    duplicates = []
+    for item in items:
+        if item in seen:
+            duplicates.append(item)
+        seen.add(item)
+    return duplicates
+
+
+def merge_sorted(left, right):
+    result = []
+    i = j = 0
+    while i < len(left) and j < len(right):
+        if left[i] <= right[j]:
+            result.append(left[i])
+            i += 1
+        else:
+            result.append(right[j])
+            j += 1
+    result.extend(left[i:])
+    return result
+"""
+
+
+def _load_service():
+    from app.services.gemma_service import GemmaService
+    service = GemmaService()
+    if not service.is_loaded():
+        raise SystemExit("❌ Model not loaded - set MODEL_PATH to a model directory")
+    return service
+
+
+def bench_ttft(args):
+    """Time-to-first-token with and without the preamble KV cache"""
+    service = _load_service()
+    prompts = [service._format_prompt(f"Write Python code for: {p}") for p in BENCH_PROMPTS]
+    prompts += [service._format_prompt("Fix any bugs in this code", BENCH_CODE)]
+
+    def first_token(prompt: str, use_cache: bool) -> float:
+        inputs = service.tokenizer(prompt, return_tensors="pt").to(service.model.device)
+        if use_cache:
+            inputs["past_key_values"] = service._prefix_cache_for(inputs["input_ids"])
+        start = time.perf_counter()
+        with torch.no_grad():
+            service.model.generate(
+                **inputs,
+                max_new_tokens=1,
+                do_sample=False,
+                pad_token_id=service.tokenizer.pad_token_id
+            )
+        return time.perf_counter() - start
+
+    # Warm up both paths once
+    first_token(prompts[0], False)
+    first_token(prompts[0], True)
+
+    results = {}
+    for use_cache in (False, True):
+        timings = [first_token(p, use_cache) for _ in range(args.repeat) for p in prompts]
+        results[use_cache] = timings
+        label = "prefix cache" if use_cache else "no cache    "
+        print(f"{label}: median {statistics.median(timings) * 1000:7.1f} ms   "
+              f"mean {statistics.mean(timings) * 1000:7.1f} ms")
+
+    speedup = statistics.median(results[False]) / statistics.median(results[True])
+    print(f"TTFT speedup: {speedup:.2f}x")
+
+
+def bench_quantization(args):
+    """Compare a quantized model against fp32 on a fixed prompt set (greedy decoding)"""
+    from app.config import settings
+    from app.services.quantization import quantize_model
+
+    # The service provides the fp32 reference model, tokenizer and prompt helpers
+    settings.QUANTIZATION_MODE = "none"
+    service = _load_service()
+    tokenizer = service.tokenizer
+    reference = service.model
+    quantized = quantize_model(copy.deepcopy(reference), args.mode).eval()
+
+    prompts = [service._format_prompt(f"Write Python code for: {p}") for p in BENCH_PROMPTS]
+    prompts.append(service._format_prompt("Fix any bugs in this code", BENCH_CODE))
+
+    def run(model, prompt):
+        inputs = tokenizer(prompt, return_tensors="pt")
+        start = time.perf_counter()
+        with torch.no_grad():
+            output = model.generate(
+                **inputs,
+                max_new_tokens=args.max_new_tokens,
+                do_sample=False,
+                pad_token_id=tokenizer.pad_token_id
+            )
+        elapsed = time.perf_counter() - start
+        new_tokens = output[0, inputs["input_ids"].shape[1]:]
+        return new_tokens.tolist(), elapsed
+
+    token_agreement, text_similarity = [], []
+    speeds = {"fp32": [], args.mode: []}
+    for prompt in prompts:
+        ref_tokens, ref_time = run(reference, prompt)
+        q_tokens, q_time = run(quantized, prompt)
+        speeds["fp32"].append(len(ref_tokens) / ref_time)
+        speeds[args.mode].append(len(q_tokens) / q_time)
+
+        # Fraction of the reference continuation reproduced before the first divergence
+        same = next(
+            (i for i, (a, b) in enumerate(zip(ref_tokens, q_tokens)) if a != b),
+            min(len(ref_tokens), len(q_tokens))
+        )
+        token_agreement.append(same / max(1, len(ref_tokens)))
+        ref_text = service._extract_response(tokenizer.decode(ref_tokens, skip_special_tokens=True))
+        q_text = service._extract_response(tokenizer.decode(q_tokens, skip_special_tokens=True))
+        text_similarity.append(difflib.SequenceMatcher(None, ref_text, q_text).ratio())
+
+    print(f"Quantization quality check: fp32 vs {args.mode} on {len(prompts)} prompts")
+    for i, (agree, sim) in enumerate(zip(token_agreement, text_similarity)):
+        print(f"  prompt {i + 1}: token prefix agreement {agree:6.1%}   text similarity {sim:6.1%}")
+    print(f"Mean token prefix agreement: {statistics.mean(token_agreement):.1%}")
+    print(f"Mean text similarity:        {statistics.mean(text_similarity):.1%}")
+    for label, values in speeds.items():
+        print(f"{label:>5}: {statistics.mean(values):7.1f} tokens/s")
+
+
+def _memory_worker(load_mode, barrier, results):
+    from app.config import settings
+    from app.utils.memory import process_memory
+
+    settings.MODEL_LOAD_MODE = load_mode
+    service = _load_service()
+    # Measure once every worker holds the model, so shared pages are split between all of them
+    barrier.wait()
+    results.put(process_memory())
+    barrier.wait()
+    service.batcher.stop()
+
+
+def bench_memory(args):
+    """Resident memory per process when several workers load the model at once"""
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(args.workers)
+    results = ctx.Queue()
+    workers = [
+        ctx.Process(target=_memory_worker, args=(args.load_mode, barrier, results))
+        for _ in range(args.workers)
+    ]
+    for worker in workers:
+        worker.start()
+    reports = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    print(f"Memory with {args.workers} workers (MODEL_LOAD_MODE={args.load_mode})")
+    for report in sorted(reports, key=lambda r: r["pid"]):
+        if "pss_mb" in report:
+            print(f"  pid {report['pid']}: rss {report['rss_mb']:8.1f} MB   pss {report['pss_mb']:8.1f} MB   "
+                  f"shared {report['shared_mb']:8.1f} MB   private {report['private_mb']:8.1f} MB")
+        else:
+            print(f"  pid {report['pid']}: peak rss {report['max_rss_mb']:8.1f} MB")
+    if all("pss_mb" in r for r in reports):
+        print(f"Total PSS: {sum(r['pss_mb'] for r in reports):.1f} MB")
+
+
+def bench_speculative(args):
+    """Tokens/sec and draft acceptance of assisted generation on debug/refactor prompts (greedy)"""
+    from app.config import settings
+
+    settings.SPECULATIVE_MODE = args.mode
+    if args.draft_model:
+        settings.DRAFT_MODEL_PATH = args.draft_model
+    service = _load_service()
+    if service.speculative is None:
+        raise SystemExit(f"❌ Speculative mode {args.mode} is not available")
+
+    prompts = [
+        service._format_prompt("Fix any bugs in this code", BENCH_CODE),
+        service._format_prompt("Fix the bugs in this code. Error: merged list misses items", BENCH_LONG_CODE),
+        service._format_prompt("Refactor this code to be cleaner and more efficient", BENCH_LONG_CODE),
+    ]
+    params = {"max_new_tokens": args.max_new_tokens, "do_sample": False}
+
+    def run(prompt, speculative):
+        before = service.get_stats()
+        start = time.perf_counter()
+        output = service._generate_batch([prompt], speculative=speculative, **params)[0]
+        elapsed = time.perf_counter() - start
+        after = service.get_stats()
+        drafted = after["draft_tokens"] - before["draft_tokens"]
+        accepted = after["accepted_draft_tokens"] - before["accepted_draft_tokens"]
+        # _generate_batch returns the completion only (prompt already removed)
+        new_tokens = len(service.tokenizer(output, add_special_tokens=False)["input_ids"])
+        return output, new_tokens / elapsed, drafted, accepted
+
+    # Warm up both paths once
+    run(prompts[0], False)
+    run(prompts[0], True)
+
+    print(f"Speculative decoding ({service.speculative.mode}, {settings.SPECULATIVE_NUM_TOKENS} draft tokens)")
+    baseline_speeds, speculative_speeds, same = [], [], 0
+    total_drafted = total_accepted = 0
+    for i, prompt in enumerate(prompts):
+        plain, plain_speed, _, _ = run(prompt, False)
+        assisted, assisted_speed, drafted, accepted = run(prompt, True)
+        baseline_speeds.append(plain_speed)
+        speculative_speeds.append(assisted_speed)
+        total_drafted += drafted
+        total_accepted += accepted
+        same += plain == assisted
+        rate = accepted / drafted if drafted else 0.0
+        print(f"  prompt {i + 1}: {plain_speed:6.1f} -> {assisted_speed:6.1f} tokens/s   "
+              f"accepted {accepted}/{drafted} ({rate:.0%})")
+
+    print(f"Baseline:    {statistics.mean(baseline_speeds):7.1f} tokens/s")
+    print(f"Speculative: {statistics.mean(speculative_speeds):7.1f} tokens/s")
+    if total_drafted:
+        print(f"Acceptance rate: {total_accepted / total_drafted:.1%}")
+    print(f"Identical greedy outputs: {same}/{len(prompts)}")
+
+
+# Model outputs as they come back from generate (completion only), covering every cleanup rule
+SANITIZER_SAMPLES = [
+    "def add(a, b):\n    return a + b\n\n### Instruction:\nWrite a function to subtract two numbers",
+    "```python\ndef factorial(n):\n    if n <= 1:\n        return 1\n    return n * factorial(n - 1)\n```\n\n\n\nBelow is an instruction",
+    "def is_prime(n):\n    if n < 2:\n        return False\n    for i in range(2, int(n ** 0.5) + 1):\n"
+    "        if n % i == 0:\n            return False\n    return True\n2.3.4.5.6.7.8.9.10.11",
+    "This function reverses a string using slicing. The step -1 walks the string backwards.\n3D:2.3 4D:1.1",
+    "def multiply(a, b, c):\n    return a * b * c\n1, 2, 3, 4, 5, 6, 7, 8, 9\nprint(multiply(2, 3, 4))",
+    "def merge(a, b):\n    return sorted(a + b)\n/code\n```",
+    "x = 3.14\ny = 2.71\nprint(x + y)",
+    "The code defines a class Stack with push and pop methods. ### Response: it uses a list.",
+    "return return return return return return return return return return return return",
+    "1234567890",
+    "�� ��� ���� �� ���",
+    "ok",
+    "def f():\n    pass\n\n\n\n",
+    "def greet(name):\n    return f'Hello, {name}!'\n" * 20,
+]
+
+
+def _legacy_extract_response(full_output):
+    """Pattern-by-pattern cleanup that app/services/sanitizer.py replaced (outputs are completions only)"""
+    response = full_output.strip()
+    for pattern in ["### Instruction:", "Below is an instruction", "###", "/code", "\n\n\n"]:
+        if pattern in response:
+            response = response.split(pattern)[0].strip()
+    garbage_pattern = r'\d+\.\d+\.\d+\.\d+[\d\.]*'
+    if re.search(garbage_pattern, response):
+        match = re.search(garbage_pattern, response)
+        if match:
+            response = response[:match.start()].strip()
+    garbage_pattern2 = r'[A-Z0-9]{1,3}:\d+\.\d+'
+    if re.search(garbage_pattern2, response):
+        match = re.search(garbage_pattern2, response)
+        if match:
+            response = response[:match.start()].strip()
+    clean_lines = []
+    for line in response.split('\n'):
+        if re.match(r'^[\d\.\s,]+$', line.strip()) and len(line.strip()) > 10:
+            break
+        if re.match(r'.*\d+\.\d+\.\d+\.\d+.*', line):
+            break
+        clean_lines.append(line)
+    return '\n'.join(clean_lines).strip()
+
+
+def _legacy_is_garbage_output(text):
+    """Garbage check that app/services/sanitizer.py replaced"""
+    if not text or len(text) < 5:
+        return True
+    non_ascii = sum(1 for c in text if ord(c) > 127)
+    if non_ascii > len(text) * 0.3:
+        return True
+    if not any(c.isalpha() for c in text):
+        return True
+    words = text.split()
+    if len(words) > 10 and len(set(words)) < len(words) * 0.3:
+        return True
+    return False
+
+
+def bench_sanitizer(args):
+    """Check the sanitizer against the previous implementation, then time both"""
+    from app.services.sanitizer import sanitize
+
+    def legacy(text):
+        response = _legacy_extract_response(text)
+        return response, _legacy_is_garbage_output(response)
+
+    def current(text):
+        response, reason = sanitize(text)
+        return response, reason is not None
+
+    mismatches = 0
+    for i, sample in enumerate(SANITIZER_SAMPLES):
+        if current(sample) != legacy(sample):
+            mismatches += 1
+            print(f"❌ sample {i + 1}: {current(sample)!r} != {legacy(sample)!r}")
+    if mismatches:
+        raise SystemExit(f"❌ {mismatches} of {len(SANITIZER_SAMPLES)} samples differ from the previous behaviour")
+    print(f"✅ {len(SANITIZER_SAMPLES)} samples match the previous behaviour")
+
+    for label, fn in (("legacy", legacy), ("sanitizer", current)):
+        seconds = timeit.timeit(lambda: [fn(sample) for sample in SANITIZER_SAMPLES], number=args.number)
+        per_call = seconds / (args.number * len(SANITIZER_SAMPLES)) * 1e6
+        print(f"{label:>9}: {per_call:7.2f} µs per output")
+
+
+def bench_conversations(args):
+    """First-page and deep-page listing latency of the in-memory conversation store as history grows"""
+    from app.services.conversation_store import ConversationStore, decode_cursor, encode_cursor
+
+    async def run():
+        store = ConversationStore()
+        created = 0
+        for size in args.sizes:
+            while created < size:
+                conversation = await store.create(f"conversation {created}")
+                await store.append_message(conversation["_id"], "user", "hello")
+                created += 1
+            first_page = await store.list(limit=args.limit)
+            cursor = decode_cursor(encode_cursor(first_page[-1]))
+            started = time.perf_counter()
+            for _ in range(args.number):
+                await store.list(limit=args.limit)
+            first = (time.perf_counter() - started) / args.number * 1e6
+            started = time.perf_counter()
+            for _ in range(args.number):
+                await store.list(limit=args.limit, before=cursor)
+            second = (time.perf_counter() - started) / args.number * 1e6
+            print(f"{size:>7} conversations: first page {first:7.1f} µs, next page {second:7.1f} µs")
+
+    asyncio.run(run())
+
+
+LINT_SAMPLES = [
+    "import os\ndef add_numbers(a, b):\n    return a + b\n",
+    "def factorial(n):\n    result = 1\n    for i in range(1, n + 1):\n        result *= i\n    return result\n",
+    "def find_max(numbers):\n    unused = 0\n    return max(numbers)\n",
+]
+
+
+def _legacy_ruff_fix(code):
+    """test_runner.ruff_auto_fix before the lint backend: temp file + subprocess"""
+    import os
+    import subprocess
+    import tempfile
+    with tempfile.NamedTemporaryFile(mode="w", suffix=".py", delete=False) as f:
+        f.write(code)
+        temp_path = f.name
+    subprocess.run(["ruff", "check", "--fix", "--select", "ALL", temp_path], capture_output=True, text=True, timeout=10)
+    with open(temp_path) as f:
+        fixed_code = f.read()
+    os.unlink(temp_path)
+    return fixed_code
+
+
+def _legacy_pyflakes(code):
+    import subprocess
+    result = subprocess.run(["pyflakes"], input=code.encode(), capture_output=True, timeout=5)
+    return result.stdout.decode().strip().split("\n") if result.stdout else []
+
+
+def bench_lint(args):
+    """Ruff fix and pyflakes check latency: previous subprocess/temp-file calls vs the lint backend"""
+    from lint_backend import LintBackend
+
+    backend = LintBackend()
+    for sample in LINT_SAMPLES:
+        if backend.ruff_fix(sample)[0] != _legacy_ruff_fix(sample):
+            raise SystemExit(f"❌ ruff output differs for {sample!r}")
+    print(f"✅ {len(LINT_SAMPLES)} samples fixed identically")
+
+    runs = (
+        ("legacy ruff", _legacy_ruff_fix),
+        ("stdin ruff", backend.ruff_fix),
+        ("legacy pyflakes", _legacy_pyflakes),
+        ("in-process pyflakes", backend.pyflakes_check),
+    )
+    for label, fn in runs:
+        seconds = timeit.timeit(lambda: [fn(sample) for sample in LINT_SAMPLES], number=args.number)
+        per_call = seconds / (args.number * len(LINT_SAMPLES)) * 1e3
+        print(f"{label:>19}: {per_call:7.2f} ms per call")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CodeGen AI benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ttft = subparsers.add_parser("ttft", help="time-to-first-token with/without prefix KV cache")
+    ttft.add_argument("--repeat", type=int, default=3)
+    ttft.set_defaults(func=bench_ttft)
+
+    quant = subparsers.add_parser("quantization", help="quality/speed of a quantized model vs fp32")
+    quant.add_argument("--mode", choices=["int8", "int4"], default="int8")
+    quant.add_argument("--max-new-tokens", type=int, default=64)
+    quant.set_defaults(func=bench_quantization)
+
+    memory = subparsers.add_parser("memory", help="per-worker RSS/PSS with several processes loading the model")
+    memory.add_argument("--workers", type=int, default=2)
+    memory.add_argument("--load-mode", choices=["default", "mmap"], default="mmap")
+    memory.set_defaults(func=bench_memory)
+
+    speculative = subparsers.add_parser("speculative", help="assisted generation speed/acceptance vs plain decoding")
+    speculative.add_argument("--mode", choices=["ngram", "draft"], default="ngram")
+    speculative.add_argument("--draft-model", help="draft model directory for --mode draft")
+    speculative.add_argument("--max-new-tokens", type=int, default=128)
+    speculative.set_defaults(func=bench_speculative)
+
+    sanitizer = subparsers.add_parser("sanitizer", help="output cleanup: behaviour check and micro-benchmark (no model)")
+    sanitizer.add_argument("--number", type=int, default=2000)
+    sanitizer.set_defaults(func=bench_sanitizer)
+
+    conversations = subparsers.add_parser("conversations", help="conversation listing latency vs history size (no model)")
+    conversations.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    conversations.add_argument("--limit", type=int, default=50)
+    conversations.add_argument("--number", type=int, default=200)
+    conversations.set_defaults(func=bench_conversations)
+
+    lint = subparsers.add_parser("lint", help="test runner ruff/pyflakes latency, subprocess vs lint backend (no model)")
+    lint.add_argument("--number", type=int, default=20)
+    lint.set_defaults(func=bench_lint)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# backend/lint_backend.py
+"""
+Linters for the test runner, without temp files.
+
+Ruff has no Python API (and 0.1.x no server mode), so code goes to the binary over
+stdin with --stdin-filename and the fixed source comes back on stdout; the binary
+path is resolved once. Pyflakes runs in-process through pyflakes.api.check with a
+reporter that collects messages instead of printing them.
+"""
+import logging
+import re
+import shutil
+import subprocess
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Diagnostics refer to this name; matches what `pyflakes` printed when fed stdin
+_SNIPPET_NAME = "<stdin>"
+_RUFF_FIXED_RE = re.compile(r"\((\d+) fixed")
+
+
+def _find_ruff() -> Optional[str]:
+    try:
+        # The ruff wheel knows where it put its binary, even outside an activated venv
+        from ruff.__main__ import find_ruff_bin
+        return find_ruff_bin()
+    except Exception:
+        return shutil.which("ruff")
+
+
+class _CollectingReporter:
+    """pyflakes reporter that keeps messages in lists"""
+
+    def __init__(self):
+        self.messages: List[str] = []
+
+    def unexpectedError(self, filename, msg):
+        self.messages.append(f"{filename}: {msg}")
+
+    def syntaxError(self, filename, msg, lineno, offset, text):
+        lineno = max(lineno or 0, 1)
+        if offset is not None:
+            self.messages.append(f"{filename}:{lineno}:{max(offset, 1)}: {msg}")
+        else:
+            self.messages.append(f"{filename}:{lineno}: {msg}")
+
+    def flake(self, message):
+        self.messages.append(str(message))
+
+
+class LintBackend:
+    """Ruff fixes and pyflakes checks with per-tool call counts and latency"""
+
+    def __init__(self, ruff_timeout: float = 10):
+        self.ruff_timeout = ruff_timeout
+        self.ruff_path = _find_ruff()
+        try:
+            from pyflakes import api as pyflakes_api
+            self._pyflakes = pyflakes_api
+        except ImportError:
+            self._pyflakes = None
+        if self.ruff_path is None:
+            logger.warning("⚠️ Ruff not installed - install with: pip install ruff")
+        if self._pyflakes is None:
+            logger.warning("⚠️ Pyflakes not installed")
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def _record(self, tool: str, started: float):
+        elapsed = (time.perf_counter() - started) * 1000
+        with self._lock:
+            stats = self._stats.setdefault(tool, {"calls": 0, "total_ms": 0.0})
+            stats["calls"] += 1
+            stats["total_ms"] += elapsed
+
+    def ruff_fix(self, code: str) -> Tuple[str, int]:
+        """(fixed code, number of fixes); the input is returned unchanged if ruff is unavailable"""
+        if self.ruff_path is None:
+            return code, 0
+        started = time.perf_counter()
+        try:
+            result = subprocess.run(
+                [self.ruff_path, "check", "--fix", "--select", "ALL", "--no-cache",
+                 "--stdin-filename", "snippet.py", "-"],
+                input=code,
+                capture_output=True,
+                text=True,
+                timeout=self.ruff_timeout
+            )
+        finally:
+            self._record("ruff", started)
+        # Exit code 2 means ruff itself failed (bad options, crash); stdout is not the code then
+        if result.returncode == 2 or not result.stdout:
+            if result.stderr:
+                logger.error(f"❌ Ruff error: {result.stderr.strip().splitlines()[-1]}")
+            return code, 0
+        match = _RUFF_FIXED_RE.search(result.stderr)
+        return result.stdout, int(match.group(1)) if match else 0
+
+    def pyflakes_check(self, code: str) -> List[str]:
+        """pyflakes messages for the code ("<stdin>:line:col: message")"""
+        if self._pyflakes is None:
+            return []
+        started = time.perf_counter()
+        reporter = _CollectingReporter()
+        try:
+            self._pyflakes.check(code, _SNIPPET_NAME, reporter)
+        finally:
+            self._record("pyflakes", started)
+        return reporter.messages
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                tool: {
+                    "calls": int(values["calls"]),
+                    "avg_ms": round(values["total_ms"] / values["calls"], 2),
+                }
+                for tool, values in self._stats.items()
+            }
+
+
+# Global singleton
+_lint_backend = None
+
+def get_lint_backend() -> LintBackend:
+    global _lint_backend
+    if _lint_backend is None:
+        _lint_backend = LintBackend()
+    return _lint_backend
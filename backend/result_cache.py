@@ -0,0 +1,118 @@
+# backend/result_cache.py
+"""
+Content-addressed cache of test runner results.
+
+The key is (sha256 of the submitted code, canonical problem_id, test-suite
+version), so the same code re-posted by a retry or under an alias of the problem
+is answered without running ruff or the sandbox again. Results live in a bounded LRU
+in memory; with RESULT_CACHE_SQLITE_PATH set they are also written to SQLite and
+survive restarts (memory misses fall through to disk).
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "4096"))
+RESULT_CACHE_SQLITE_PATH = os.getenv("RESULT_CACHE_SQLITE_PATH", "")
+
+
+def result_key(code: str, problem_id: str, suite_version: str) -> str:
+    digest = hashlib.sha256(code.encode("utf-8")).hexdigest()
+    return f"{digest}:{problem_id}:{suite_version}"
+
+
+class TestResultCache:
+    """LRU of response dicts by result_key, optionally backed by a SQLite table"""
+
+    def __init__(self, max_entries: int = RESULT_CACHE_SIZE, sqlite_path: str = RESULT_CACHE_SQLITE_PATH):
+        self.max_entries = max(0, max_entries)
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+        if sqlite_path:
+            self._open(sqlite_path)
+
+    def _open(self, path: str):
+        try:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS test_results "
+                "(key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            logger.info(f"💾 Test result cache on disk: {path}")
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ SQLite result cache disabled: {e}")
+            self._db = None
+
+    def _remember(self, key: str, response: Dict[str, Any]):
+        # Caller holds the lock
+        self._entries[key] = response
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            response = self._entries.get(key)
+            if response is not None:
+                self._entries.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return response
+            if self._db is not None:
+                try:
+                    row = self._db.execute("SELECT response FROM test_results WHERE key = ?", (key,)).fetchone()
+                except sqlite3.Error as e:
+                    logger.error(f"❌ Result cache read failed: {e}")
+                    row = None
+                if row is not None:
+                    response = json.loads(row[0])
+                    if self.max_entries:
+                        self._remember(key, response)
+                    self.stats["disk_hits"] += 1
+                    return response
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key: str, response: Dict[str, Any]):
+        with self._lock:
+            if self.max_entries:
+                self._remember(key, response)
+            self.stats["stores"] += 1
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO test_results (key, response, created_at) VALUES (?, ?, ?)",
+                        (key, json.dumps(response), time.time())
+                    )
+                except sqlite3.Error as e:
+                    logger.error(f"❌ Result cache write failed: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM test_results")
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), disk=self._db is not None)
+
+
+# Global singleton
+_result_cache = None
+
+def get_result_cache() -> TestResultCache:
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = TestResultCache()
+    return _result_cache
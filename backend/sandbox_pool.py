@@ -0,0 +1,328 @@
+# backend/sandbox_pool.py
+"""
+Pre-started worker processes that run generated code against unit tests.
+
+Each worker lowers its own rlimits (CPU seconds, address space, open files) once,
+then serves jobs sent over a pipe; a job costs one round trip instead of a new
+interpreter. A worker that does not answer within the timeout (infinite loop,
+deadlock) or dies (CPU/memory limit) is killed and replaced. Workers also retire
+after SANDBOX_MAX_TASKS jobs, so state leaked by one piece of code (patched
+builtins, module globals) does not live long.
+
+This is resource isolation only - workers share the runner's user and network.
+"""
+import contextlib
+import logging
+import multiprocessing
+import os
+import queue
+import resource
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+SANDBOX_WORKERS = int(os.getenv("SANDBOX_WORKERS", "4"))
+SANDBOX_TIMEOUT_SECONDS = float(os.getenv("SANDBOX_TIMEOUT_SECONDS", "5"))
+SANDBOX_CPU_SECONDS = int(os.getenv("SANDBOX_CPU_SECONDS", "5"))
+SANDBOX_MEMORY_MB = int(os.getenv("SANDBOX_MEMORY_MB", "256"))
+SANDBOX_MAX_FILES = int(os.getenv("SANDBOX_MAX_FILES", "32"))
+SANDBOX_MAX_TASKS = int(os.getenv("SANDBOX_MAX_TASKS", "100"))
+# "forkserver" forks workers from a small clean process (no inherited server sockets)
+SANDBOX_START_METHOD = os.getenv("SANDBOX_START_METHOD", "forkserver")
+
+# Workers import the parent's __main__ before serving, which can take a few seconds
+_READY_TIMEOUT_SECONDS = 30
+
+# Start of the error of a run cut off by the wall-clock timeout (depends on load, not on the code)
+TIMEOUT_ERROR_PREFIX = "TimeoutError: tests did not finish"
+# Start of the error of a run the pool itself failed (worker not started, bad reply)
+SANDBOX_ERROR_PREFIX = "SandboxError"
+
+# (tests_passed, error)
+TestResult = Tuple[bool, Optional[str]]
+
+
+# ==================== WORKER SIDE ====================
+
+def _virtual_memory_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[0]) * resource.getpagesize()
+
+
+def _apply_limits(cpu_seconds: int, memory_mb: int, max_files: int, max_tasks: int):
+    # Hard CPU limit covers the worker's whole life; the soft limit is moved per job
+    lifetime = cpu_seconds * (max_tasks + 1)
+    resource.setrlimit(resource.RLIMIT_CPU, (lifetime, lifetime))
+    try:
+        # Headroom on top of what the interpreter already maps
+        limit = _virtual_memory_bytes() + memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (OSError, ValueError) as e:
+        logger.warning(f"⚠️ Sandbox memory limit not applied: {e}")
+    resource.setrlimit(resource.RLIMIT_NOFILE, (max_files, max_files))
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+
+
+def _cpu_used() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _run_test_functions(namespace: Dict[str, Any], source: str) -> TestResult:
+    """test_* functions of a .py suite, run in definition order in the code's namespace"""
+    exec(compile(source, "<test suite>", "exec"), namespace)
+    test_functions = sorted(
+        (value for name, value in namespace.items() if name.startswith("test_") and callable(value)),
+        key=lambda fn: getattr(getattr(fn, "__code__", None), "co_firstlineno", 0)
+    )
+    for fn in test_functions:
+        try:
+            fn()
+        except AssertionError as e:
+            return False, f"Test {fn.__name__} failed" + (f": {e}" if str(e) else "")
+        except Exception as e:
+            return False, f"Test {fn.__name__} error: {type(e).__name__}: {str(e)}"
+    return True, None
+
+
+def _run_tests(code: str, function_name: str, tests: Union[List[Dict[str, Any]], str]) -> TestResult:
+    """Input/expected cases (same messages as run_unit_tests always had), or a .py suite's source"""
+    namespace: Dict[str, Any] = {}
+    try:
+        exec(code, namespace)
+
+        func = namespace.get(function_name)
+        if not func:
+            return False, f"Function '{function_name}' not found"
+
+        if isinstance(tests, str):
+            return _run_test_functions(namespace, tests)
+
+        for i, test in enumerate(tests):
+            try:
+                result = func(*test["input"])
+                if result != test["expected"]:
+                    return False, f"Test {i+1} failed: Expected {test['expected']}, got {result}"
+            except Exception as e:
+                return False, f"Test {i+1} error: {type(e).__name__}: {str(e)}"
+        return True, None
+
+    except BaseException as e:
+        # SystemExit/KeyboardInterrupt raised by the code must not end the worker loop
+        return False, f"{type(e).__name__}: {str(e)}"
+
+
+def _worker_main(conn, cpu_seconds: int, memory_mb: int, max_files: int, max_tasks: int):
+    _apply_limits(cpu_seconds, memory_mb, max_files, max_tasks)
+    hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+    conn.send("ready")
+    with open(os.devnull, "w") as devnull, \
+            contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        for task in range(max_tasks):
+            try:
+                job = conn.recv()
+            except (EOFError, OSError):
+                return
+            if job is None:
+                return
+            # SIGXCPU ends the worker once this job uses more than cpu_seconds of CPU
+            soft = min(hard, int(_cpu_used()) + cpu_seconds + 1)
+            resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+            passed, error = _run_tests(*job)
+            retiring = task == max_tasks - 1
+            try:
+                conn.send((passed, error, retiring))
+            except Exception as e:
+                # e.g. an error message that cannot be pickled
+                conn.send((False, f"Result not transferable: {type(e).__name__}", retiring))
+
+
+# ==================== POOL SIDE ====================
+
+class _Worker:
+    __slots__ = ("process", "conn")
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+
+
+class SandboxPool:
+    """
+    Fixed number of sandbox workers. run() borrows an idle worker, sends it the job
+    and waits up to timeout; callers block (in their own thread) while all are busy.
+    """
+
+    def __init__(
+        self,
+        size: int = SANDBOX_WORKERS,
+        timeout: float = SANDBOX_TIMEOUT_SECONDS,
+        cpu_seconds: int = SANDBOX_CPU_SECONDS,
+        memory_mb: int = SANDBOX_MEMORY_MB,
+        max_files: int = SANDBOX_MAX_FILES,
+        max_tasks: int = SANDBOX_MAX_TASKS,
+        start_method: str = SANDBOX_START_METHOD,
+    ):
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.max_files = max_files
+        self.max_tasks = max(1, max_tasks)
+        if start_method not in multiprocessing.get_all_start_methods():
+            start_method = "spawn"
+        self._context = multiprocessing.get_context(start_method)
+        # None marks a slot whose worker could not be started
+        self._idle: "queue.Queue[Optional[_Worker]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        self.stats = {"runs": 0, "timeouts": 0, "crashes": 0, "replaced": 0}
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            started = time.perf_counter()
+            workers = [self._spawn() for _ in range(self.size)]
+            for worker in workers:
+                self._idle.put(self._checked(worker))
+            self._started = True
+        logger.info(
+            f"🧪 Sandbox pool ready: {self.size} workers in {time.perf_counter() - started:.2f}s "
+            f"(cpu={self.cpu_seconds}s, memory={self.memory_mb}MB, files={self.max_files})"
+        )
+
+    def _spawn(self) -> _Worker:
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(child_conn, self.cpu_seconds, self.memory_mb, self.max_files, self.max_tasks),
+            daemon=True,
+            name="sandbox-worker"
+        )
+        process.start()
+        child_conn.close()
+        return _Worker(process, parent_conn)
+
+    def _wait_ready(self, worker: _Worker) -> bool:
+        """Block until the worker has imported its modules and applied its limits"""
+        try:
+            if worker.conn.poll(_READY_TIMEOUT_SECONDS):
+                worker.conn.recv()
+                return True
+        except (EOFError, OSError):
+            pass
+        logger.warning(f"⚠️ Sandbox worker {worker.process.pid} not ready after startup")
+        return False
+
+    def _checked(self, worker: _Worker) -> Optional[_Worker]:
+        """The worker once ready; a slow one is kept (run() skips its late "ready"), a dead one dropped"""
+        if self._wait_ready(worker) or worker.process.is_alive():
+            return worker
+        self._discard(worker)
+        return None
+
+    def _start_worker(self) -> Optional[_Worker]:
+        try:
+            return self._checked(self._spawn())
+        except Exception as e:
+            logger.error(f"❌ Sandbox worker could not be started: {e}")
+            return None
+
+    def _discard(self, worker: _Worker):
+        if worker.process.is_alive():
+            worker.process.kill()
+        worker.process.join(timeout=1)
+        worker.conn.close()
+
+    def _replace(self, worker: _Worker):
+        """Put a fresh worker in place of this one; an empty slot (None) if it cannot be started"""
+        try:
+            self._discard(worker)
+        except Exception as e:
+            logger.error(f"❌ Sandbox worker {worker.process.pid} not cleaned up: {e}")
+        self.stats["replaced"] += 1
+        self._idle.put(self._start_worker())
+
+    def _receive(self, worker: _Worker, timeout: float) -> Optional[tuple]:
+        """The worker's (passed, error, retiring) reply, or None on timeout"""
+        deadline = time.monotonic() + timeout
+        while worker.conn.poll(max(0.0, deadline - time.monotonic())):
+            reply = worker.conn.recv()
+            # Sent by a worker that missed _READY_TIMEOUT_SECONDS at startup
+            if reply == "ready":
+                continue
+            if not isinstance(reply, tuple) or len(reply) != 3:
+                raise ValueError(f"unexpected reply {reply!r:.80}")
+            return reply
+        return None
+
+    def run(self, code: str, function_name: str, tests: Union[List[Dict[str, Any]], str], timeout: Optional[float] = None) -> TestResult:
+        """Run the tests in a worker; a hung or crashed worker is killed and replaced"""
+        self.start()
+        timeout = self.timeout if timeout is None else timeout
+        worker = self._idle.get()
+        # Every borrowed slot goes back to the pool: the worker itself, or a replacement
+        keep = False
+        if worker is None:
+            worker = self._start_worker()
+            if worker is None:
+                self._idle.put(None)
+                return False, f"{SANDBOX_ERROR_PREFIX}: worker could not be started"
+        try:
+            self.stats["runs"] += 1
+            worker.conn.send((code, function_name, tests))
+            reply = self._receive(worker, timeout)
+            if reply is None:
+                self.stats["timeouts"] += 1
+                logger.warning(f"⏱️ Sandbox worker {worker.process.pid} timed out after {timeout}s - replacing it")
+                return False, f"{TIMEOUT_ERROR_PREFIX} within {timeout:g} seconds"
+            passed, error, retiring = reply
+            keep = not retiring
+            return passed, error
+        except (EOFError, OSError):
+            # Killed by its CPU/memory limit (or otherwise died) mid-job
+            worker.process.join(timeout=1)
+            code_ = worker.process.exitcode
+            self.stats["crashes"] += 1
+            logger.warning(f"💥 Sandbox worker {worker.process.pid} died (exit code {code_}) - replacing it")
+            return False, f"ResourceLimitError: test process was killed (exit code {code_})"
+        except Exception as e:
+            self.stats["crashes"] += 1
+            logger.error(f"❌ Sandbox worker {worker.process.pid} failed: {type(e).__name__}: {e} - replacing it")
+            return False, f"{SANDBOX_ERROR_PREFIX}: {type(e).__name__}: {e}"
+        finally:
+            if keep:
+                self._idle.put(worker)
+            else:
+                self._replace(worker)
+
+    def shutdown(self):
+        with self._lock:
+            if not self._started:
+                return
+            self._started = False
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if worker is None:
+                continue
+            try:
+                worker.conn.send(None)
+            except Exception:
+                pass
+            self._discard(worker)
+
+
+# Global singleton
+_sandbox_pool = None
+
+def get_sandbox_pool() -> SandboxPool:
+    global _sandbox_pool
+    if _sandbox_pool is None:
+        _sandbox_pool = SandboxPool()
+    return _sandbox_pool
@@ -0,0 +1,256 @@
+# backend/suite_registry.py
+"""
+Test suites for the test runner, one file per problem in TEST_SUITES_DIR.
+
+    <problem_id>.json / .yaml / .yml   {"function_name": ..., "description": ...,
+                                        "tests": [{"input": [...], "expected": ...}]}
+    <problem_id>.py                    FUNCTION_NAME = "..." plus assert-based test_*
+                                       functions; they run in the submitted code's
+                                       namespace, so they call the function by name
+    _aliases.json / .yaml              {"alias": "problem_id", ...}
+
+Startup only lists the directory; a suite is parsed the first time its problem_id
+is requested. Files are re-checked every TEST_SUITES_RELOAD_SECONDS, so suites can
+be added, edited or removed without restarting the runner.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+logger = logging.getLogger(__name__)
+
+TEST_SUITES_DIR = os.getenv("TEST_SUITES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_suites"))
+TEST_SUITES_RELOAD_SECONDS = float(os.getenv("TEST_SUITES_RELOAD_SECONDS", "2"))
+
+_SUITE_EXTENSIONS = (".json", ".yaml", ".yml", ".py")
+_ALIAS_FILES = ("_aliases.json", "_aliases.yaml", "_aliases.yml")
+_FUNCTION_NAME_RE = re.compile(r"^FUNCTION_NAME\s*=\s*['\"](\w+)['\"]", re.MULTILINE)
+
+
+class SuiteError(ValueError):
+    """A suite file that cannot be parsed or lacks required fields"""
+
+
+@dataclass
+class TestSuite:
+    problem_id: str
+    function_name: str
+    # Input/expected cases, or the source of a .py suite
+    tests: Union[List[Dict[str, Any]], str]
+    description: str = ""
+    # Content hash of the file; changes whenever the suite does
+    version: str = ""
+    path: str = ""
+    mtime_ns: int = field(default=0, repr=False)
+    checked_at: float = field(default=0.0, repr=False)
+
+    @property
+    def size(self) -> int:
+        return len(self.tests) if isinstance(self.tests, list) else len(re.findall(r"^def test_", self.tests, re.MULTILINE))
+
+
+def _load_data(path: str, raw: bytes) -> Any:
+    if path.endswith(".json"):
+        return json.loads(raw)
+    if yaml is None:
+        raise SuiteError("PyYAML is not installed - install with: pip install pyyaml")
+    return yaml.safe_load(raw)
+
+
+def compile_suite(problem_id: str, path: str) -> TestSuite:
+    """Parse and validate one suite file"""
+    with open(path, "rb") as f:
+        raw = f.read()
+    version = hashlib.sha256(raw).hexdigest()[:16]
+
+    if path.endswith(".py"):
+        source = raw.decode("utf-8")
+        match = _FUNCTION_NAME_RE.search(source)
+        if not match:
+            raise SuiteError(f"{path}: FUNCTION_NAME is not set")
+        try:
+            compile(source, path, "exec")
+        except SyntaxError as e:
+            raise SuiteError(f"{path}: {e}") from e
+        return TestSuite(problem_id, match.group(1), source, version=version, path=path)
+
+    try:
+        data = _load_data(path, raw)
+    except SuiteError:
+        raise
+    except Exception as e:
+        raise SuiteError(f"{path}: {e}") from e
+    if not isinstance(data, dict) or not data.get("function_name") or not isinstance(data.get("tests"), list):
+        raise SuiteError(f"{path}: needs function_name and a list of tests")
+    tests = []
+    for i, test in enumerate(data["tests"]):
+        if not isinstance(test, dict) or "input" not in test or "expected" not in test:
+            raise SuiteError(f"{path}: test {i + 1} needs input and expected")
+        # Arguments are unpacked into the call; JSON/YAML only have lists
+        tests.append({"input": tuple(test["input"]), "expected": test["expected"]})
+    return TestSuite(
+        problem_id,
+        data["function_name"],
+        tests,
+        description=data.get("description", ""),
+        version=version,
+        path=path
+    )
+
+
+class SuiteRegistry:
+    """problem_id (or alias) -> TestSuite, compiled on first use and reloaded when files change"""
+
+    def __init__(self, directory: str = TEST_SUITES_DIR, reload_seconds: float = TEST_SUITES_RELOAD_SECONDS):
+        self.directory = directory
+        self.reload_seconds = reload_seconds
+        self._paths: Dict[str, str] = {}
+        self._aliases: Dict[str, str] = {}
+        self._suites: Dict[str, TestSuite] = {}
+        self._dir_mtime_ns: Optional[int] = None
+        self._aliases_mtime_ns: Optional[Tuple[str, int]] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"compiled": 0, "reloaded": 0, "errors": 0}
+        self._refresh(force=True)
+
+    # ==================== INDEX ====================
+
+    def _refresh(self, force: bool = False):
+        """Rescan the directory listing and alias file if they changed (caller holds the lock or is __init__)"""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.reload_seconds:
+            return
+        self._checked_at = now
+        try:
+            dir_mtime = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            if self._paths:
+                logger.warning(f"⚠️ Test suite directory {self.directory} is gone")
+            self._paths, self._aliases, self._suites = {}, {}, {}
+            self._dir_mtime_ns = None
+            return
+
+        if dir_mtime != self._dir_mtime_ns:
+            self._scan()
+            self._dir_mtime_ns = dir_mtime
+        self._load_aliases()
+
+    def _scan(self):
+        paths = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                stem, ext = os.path.splitext(entry.name)
+                if ext in _SUITE_EXTENSIONS and not stem.startswith("_") and entry.is_file():
+                    if stem in paths:
+                        logger.warning(f"⚠️ Duplicate test suite for {stem}: {entry.name} ignored")
+                        continue
+                    paths[stem] = entry.path
+        # Compiled suites whose file disappeared or moved are dropped
+        self._suites = {
+            problem_id: suite for problem_id, suite in self._suites.items()
+            if paths.get(problem_id) == suite.path
+        }
+        self._paths = paths
+        logger.info(f"📚 {len(paths)} test suites indexed in {self.directory}")
+
+    def _load_aliases(self):
+        for name in _ALIAS_FILES:
+            path = os.path.join(self.directory, name)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            if self._aliases_mtime_ns == (path, mtime):
+                return
+            try:
+                with open(path, "rb") as f:
+                    aliases = _load_data(path, f.read()) or {}
+                if not isinstance(aliases, dict):
+                    raise SuiteError(f"{path}: expected a mapping of alias -> problem_id")
+                self._aliases = {str(alias): str(target) for alias, target in aliases.items()}
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"❌ Test suite aliases not loaded: {e}")
+            self._aliases_mtime_ns = (path, mtime)
+            return
+        self._aliases = {}
+        self._aliases_mtime_ns = None
+
+    def resolve(self, problem_id: str) -> str:
+        """Canonical problem_id of an alias (or the id itself)"""
+        return self._aliases.get(problem_id, problem_id)
+
+    # ==================== LOOKUP ====================
+
+    def get(self, problem_id: str) -> Optional[TestSuite]:
+        """Suite of a problem_id or alias; None when unknown or the file is invalid"""
+        with self._lock:
+            self._refresh()
+            canonical = self.resolve(problem_id)
+            path = self._paths.get(canonical)
+            if path is None:
+                return None
+
+            suite = self._suites.get(canonical)
+            now = time.monotonic()
+            if suite is not None and now - suite.checked_at < self.reload_seconds:
+                return suite
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                self._paths.pop(canonical, None)
+                self._suites.pop(canonical, None)
+                return None
+            if suite is not None and suite.mtime_ns == mtime:
+                suite.checked_at = now
+                return suite
+
+            try:
+                compiled = compile_suite(canonical, path)
+            except (OSError, SuiteError) as e:
+                self.stats["errors"] += 1
+                logger.error(f"❌ Test suite {canonical} not loaded: {e}")
+                self._suites.pop(canonical, None)
+                return None
+            compiled.mtime_ns = mtime
+            compiled.checked_at = now
+            self.stats["reloaded" if suite is not None else "compiled"] += 1
+            self._suites[canonical] = compiled
+            return compiled
+
+    def problem_ids(self) -> List[str]:
+        with self._lock:
+            self._refresh()
+            return sorted(self._paths)
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(
+                self.stats,
+                directory=self.directory,
+                indexed=len(self._paths),
+                aliases=len(self._aliases),
+                loaded=len(self._suites)
+            )
+
+
+# Global singleton
+_suite_registry = None
+
+def get_suite_registry() -> SuiteRegistry:
+    global _suite_registry
+    if _suite_registry is None:
+        _suite_registry = SuiteRegistry()
+    return _suite_registry
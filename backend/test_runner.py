@@ -2,14 +2,20 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware  # ✅ ADD THIS
 from pydantic import BaseModel
-import subprocess
-import sys
 import re
-import tempfile
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from typing import Dict, List, Tuple, Optional
 import logging
 
+from lint_backend import get_lint_backend
+from result_cache import get_result_cache, result_key
+from sandbox_pool import SANDBOX_ERROR_PREFIX, SANDBOX_WORKERS, TIMEOUT_ERROR_PREFIX, get_sandbox_pool
+from suite_registry import get_suite_registry
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -24,9 +30,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Default for TestRequest.parallel: explore all fix candidates at once instead of tier by tier
+PARALLEL_TIERS = os.getenv("PARALLEL_TIERS", "false").lower() == "true"
+
 class TestRequest(BaseModel):
     problem_id: str
     code: str
+    parallel: Optional[bool] = None
 
 class TestResponse(BaseModel):
     tests_passed: bool
@@ -34,6 +44,10 @@ class TestResponse(BaseModel):
     fixed_code: Optional[str] = None
     auto_fixed: bool = False
     fix_method: Optional[str] = None
+    # Milliseconds spent per tier ("ruff", "template", "smart_analysis") and in test runs ("tests")
+    timings_ms: Dict[str, float] = {}
+    # Served from the result cache (timings_ms then only has "cache")
+    cached: bool = False
 
 # ==================== FREE TOOLS AUTO-FIX ====================
 
@@ -43,41 +57,16 @@ def ruff_auto_fix(code: str) -> Tuple[str, bool, List[str]]:
     Returns: (fixed_code, was_fixed, fixes_applied)
     """
     try:
-        # Create temp file
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-            f.write(code)
-            temp_path = f.name
-        
-        # Run Ruff with auto-fix
-        result = subprocess.run(
-            ['ruff', 'check', '--fix', '--select', 'ALL', temp_path],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
-        
-        # Read fixed code
-        with open(temp_path, 'r') as f:
-            fixed_code = f.read()
-        
-        # Clean up
-        os.unlink(temp_path)
-        
-        # Check what was fixed
-        fixes = []
-        if result.stdout:
-            fixes = re.findall(r'Fixed (\d+) error', result.stdout)
+        fixed_code, count = get_lint_backend().ruff_fix(code)
+        fixes = [str(count)] if count else []
         
         was_fixed = (fixed_code != code)
         
         if was_fixed:
-            logger.info(f"✅ Ruff auto-fixed code ({len(fixes)} fixes)")
+            logger.info(f"✅ Ruff auto-fixed code ({count} fixes)")
         
         return fixed_code, was_fixed, fixes
         
-    except FileNotFoundError:
-        logger.warning("⚠️ Ruff not installed - install with: pip install ruff")
-        return code, False, []
     except Exception as e:
         logger.error(f"❌ Ruff error: {e}")
         return code, False, []
@@ -88,22 +77,9 @@ def pyflakes_check(code: str) -> Tuple[bool, List[str]]:
     Returns: (has_errors, error_list)
     """
     try:
-        result = subprocess.run(
-            ['pyflakes'],
-            input=code.encode(),
-            capture_output=True,
-            text=True,
-            timeout=5
-        )
+        errors = get_lint_backend().pyflakes_check(code)
+        return bool(errors), errors
         
-        if result.stdout:
-            errors = result.stdout.strip().split('\n')
-            return True, errors
-        return False, []
-        
-    except FileNotFoundError:
-        logger.warning("⚠️ Pyflakes not installed")
-        return False, []
     except Exception as e:
         logger.error(f"❌ Pyflakes error: {e}")
         return False, []
@@ -265,96 +241,190 @@ def analyze_common_mistakes(code: str, error: str) -> Tuple[str, bool]:
 
 # ==================== TEST CASES ====================
 
-TEST_CASES = {
-    "add_two_numbers": {
-        "description": "Write a function to add two numbers",
-        "function_name": "add_numbers",
-        "tests": [
-            {"input": (2, 3), "expected": 5},
-            {"input": (-1, 1), "expected": 0},
-            {"input": (0, 0), "expected": 0},
-        ]
-    },
-    "multiply_three_numbers": {
-        "description": "Multiply three numbers",
-        "function_name": "multiply",
-        "tests": [
-            {"input": (2, 3, 4), "expected": 24},
-            {"input": (1, 1, 1), "expected": 1},
-            {"input": (0, 5, 10), "expected": 0},
-        ]
-    },
-    "multiply_3_numbers": {  # ✅ ADD ALIAS (for n8n webhook)
-        "description": "Multiply three numbers",
-        "function_name": "multiply",
-        "tests": [
-            {"input": (2, 3, 4), "expected": 24},
-            {"input": (1, 1, 1), "expected": 1},
-            {"input": (0, 5, 10), "expected": 0},
-        ]
-    },
-    "factorial": {
-        "description": "Calculate factorial",
-        "function_name": "factorial",
-        "tests": [
-            {"input": (5,), "expected": 120},
-            {"input": (0,), "expected": 1},
-            {"input": (1,), "expected": 1},
-        ]
-    },
-}
+# Suites live in test_suites/ (see suite_registry.py). Unknown problem_ids are
+# rejected with 404 unless this is set, which restores the old "no tests = pass"
+ALLOW_UNKNOWN_PROBLEMS = os.getenv("ALLOW_UNKNOWN_PROBLEMS", "false").lower() == "true"
+
+# Part of every result cache key: bump when the fixers change so older results are not served
+FIX_PIPELINE_VERSION = "1"
+
+def suite_version(problem_id: str) -> str:
+    """Content hash of the problem's suite file (plus the fix pipeline version)"""
+    suite = get_suite_registry().get(problem_id)
+    return f"{FIX_PIPELINE_VERSION}-{suite.version if suite else 'no-tests'}"
 
 def run_unit_tests(code: str, problem_id: str) -> Tuple[bool, Optional[str]]:
     """Run unit tests on code"""
-    if problem_id not in TEST_CASES:
-        return True, None  # ✅ CHANGED: Return True if no tests (instead of error)
+    suite = get_suite_registry().get(problem_id)
+    if suite is None:
+        if ALLOW_UNKNOWN_PROBLEMS:
+            return True, None
+        return False, f"No test suite for problem_id '{problem_id}'"
+    
+    # Generated code runs in a rlimited worker process, never in the server itself
+    tests_passed, error = get_sandbox_pool().run(code, suite.function_name, suite.tests)
+    if tests_passed:
+        logger.info(f"✅ All {suite.size} tests passed")
+    return tests_passed, error
+
+# ==================== PARALLEL TIER EXPLORATION ====================
+
+def build_fix_candidates(code: str) -> List[Tuple[str, Optional[str], str]]:
+    """
+    Every fix the tiers could reach from the ruff output, in tier priority order:
+    (code, fix_method, description). Template fixes are taken whenever their pattern
+    occurs in the code - the error is not known yet - and the tests decide.
+    """
+    candidates = []
+    
+    ruffed, ruff_fixed, _ = ruff_auto_fix(code)
+    candidates.append((ruffed, "ruff" if ruff_fixed else None, "ruff" if ruff_fixed else "original"))
+    
+    templated = []
+    for config in FREE_LOGIC_FIX_PATTERNS.values():
+        for fix in config["fixes"]:
+            if re.search(fix["detect"], ruffed):
+                fixed = re.sub(fix["detect"], fix["replace"], ruffed, count=1)
+                templated.append((fixed, fix["description"]))
+    candidates.extend((fixed, "template", description) for fixed, description in templated)
+    
+    smart, smart_fixed = analyze_common_mistakes(ruffed, "")
+    if smart_fixed:
+        candidates.append((smart, "smart_analysis", "smart analysis"))
+    
+    # Tier 3 on top of tier 2, as the sequential path does when a template fix is not enough
+    for fixed, description in templated:
+        combined, combined_fixed = analyze_common_mistakes(fixed, "")
+        if combined_fixed:
+            candidates.append((combined, "template+smart_analysis", f"{description} + smart analysis"))
+    
+    unique, seen = [], set()
+    for candidate in candidates:
+        if candidate[0] not in seen:
+            seen.add(candidate[0])
+            unique.append(candidate)
+    return unique
+
+# Threads that wait on sandbox workers; one per worker keeps every worker busy
+_candidate_executor = ThreadPoolExecutor(max_workers=max(1, SANDBOX_WORKERS), thread_name_prefix="fix-candidate")
+
+def _run_parallel(request: TestRequest, timings: Dict[str, float]) -> TestResponse:
+    """Test all fix candidates concurrently; the first passing one by tier priority wins"""
+    with timed(timings, "candidates"):
+        candidates = build_fix_candidates(request.code)
+    logger.info(f"🔀 Testing {len(candidates)} fix candidates in parallel")
     
-    problem = TEST_CASES[problem_id]
+    with timed(timings, "tests"):
+        futures = [
+            _candidate_executor.submit(run_unit_tests, code, request.problem_id)
+            for code, _, _ in candidates
+        ]
+        try:
+            base_error = None
+            for (code, fix_method, description), future in zip(candidates, futures):
+                tests_passed, error = future.result()
+                if base_error is None:
+                    base_error = error
+                if tests_passed:
+                    logger.info(f"✅ Passed with: {description}")
+                    return TestResponse(
+                        tests_passed=True,
+                        fixed_code=code if fix_method else None,
+                        auto_fixed=fix_method is not None,
+                        fix_method=fix_method
+                    )
+        finally:
+            # Candidates behind the winner that have not started yet
+            for future in futures:
+                future.cancel()
     
+    logger.info("⚠️ No candidate passed - AI fix needed")
+    base_code, base_fix, _ = candidates[0]
+    return TestResponse(
+        tests_passed=False,
+        error=base_error,
+        fixed_code=base_code if base_fix else None,
+        auto_fixed=False,
+        fix_method="ai_needed"
+    )
+
+# ==================== TIER LATENCY ====================
+
+_tier_latency: Dict[str, Dict[str, float]] = {}
+_tier_lock = threading.Lock()
+
+@contextmanager
+def timed(timings: Dict[str, float], tier: str):
+    """Add the block's duration to timings[tier] (ms) and to the service-wide totals"""
+    started = time.perf_counter()
     try:
-        namespace = {}
-        exec(code, namespace)
-        
-        func = namespace.get(problem["function_name"])
-        if not func:
-            return False, f"Function '{problem['function_name']}' not found"
-        
-        for i, test in enumerate(problem["tests"]):
-            try:
-                result = func(*test["input"])
-                if result != test["expected"]:
-                    return False, f"Test {i+1} failed: Expected {test['expected']}, got {result}"
-            except Exception as e:
-                return False, f"Test {i+1} error: {type(e).__name__}: {str(e)}"
-        
-        logger.info(f"✅ All {len(problem['tests'])} tests passed")
-        return True, None
-        
-    except Exception as e:
-        return False, f"{type(e).__name__}: {str(e)}"
+        yield
+    finally:
+        elapsed = (time.perf_counter() - started) * 1000
+        timings[tier] = round(timings.get(tier, 0.0) + elapsed, 2)
+        with _tier_lock:
+            totals = _tier_latency.setdefault(tier, {"calls": 0, "total_ms": 0.0})
+            totals["calls"] += 1
+            totals["total_ms"] += elapsed
+
+def tier_latency_stats() -> Dict[str, Dict[str, float]]:
+    with _tier_lock:
+        return {
+            tier: {"calls": int(values["calls"]), "avg_ms": round(values["total_ms"] / values["calls"], 2)}
+            for tier, values in _tier_latency.items()
+        }
 
 # ==================== MAIN ENDPOINT ====================
 
+# Plain def: FastAPI runs it on its thread pool, so candidates posted concurrently
+# (e.g. by /api/code/generate_and_test) are not serialised behind each other
 @app.post("/run_tests", response_model=TestResponse)
-async def run_tests(request: TestRequest):
+def run_tests(request: TestRequest):
     """
     FREE 3-Tier Auto-Fix System:
     Tier 1: Ruff auto-fix (syntax, imports, style)
     Tier 2: Template logic fixes (patterns)
     Tier 3: Smart analysis (common mistakes)
     Tier 4: AI needed (only ~5% of cases)
+    
+    parallel=True (or PARALLEL_TIERS=true) tests every fix candidate at once,
+    so a failing submission costs the slowest test run instead of the sum.
     """
-    logger.info(f"📝 Testing: {request.problem_id}")
+    started = time.perf_counter()
+    if not ALLOW_UNKNOWN_PROBLEMS and get_suite_registry().get(request.problem_id) is None:
+        raise HTTPException(status_code=404, detail=f"No test suite for problem_id '{request.problem_id}'")
+    parallel = PARALLEL_TIERS if request.parallel is None else request.parallel
+    # The two modes may settle on different fixes, so they are cached apart
+    version = suite_version(request.problem_id) + ("-parallel" if parallel else "")
+    # Aliases of a problem share its cached results
+    key = result_key(request.code, get_suite_registry().resolve(request.problem_id), version)
+    cached = get_result_cache().get(key)
+    if cached is not None:
+        logger.info(f"⚡ Cached result: {request.problem_id}")
+        elapsed = round((time.perf_counter() - started) * 1000, 3)
+        return TestResponse(**dict(cached, cached=True, timings_ms={"cache": elapsed}))
     
+    logger.info(f"📝 Testing: {request.problem_id}")
+    timings: Dict[str, float] = {}
+    response = _run_parallel(request, timings) if parallel else _run_tiers(request, timings)
+    response.timings_ms = timings
+    # A timeout or pool failure says more about the runner at the time than about the code
+    if not (response.error or "").startswith((TIMEOUT_ERROR_PREFIX, SANDBOX_ERROR_PREFIX)):
+        get_result_cache().put(key, response.model_dump())
+    return response
+
+def _run_tiers(request: TestRequest, timings: Dict[str, float]) -> TestResponse:
     code = request.code
     original = code
     
     # TIER 1: Ruff auto-fix
     logger.info("🔧 Tier 1: Ruff auto-fix...")
-    code, ruff_fixed, fixes = ruff_auto_fix(code)
+    with timed(timings, "ruff"):
+        code, ruff_fixed, fixes = ruff_auto_fix(code)
     
     if ruff_fixed:
-        tests_passed, error = run_unit_tests(code, request.problem_id)
+        with timed(timings, "tests"):
+            tests_passed, error = run_unit_tests(code, request.problem_id)
         if tests_passed:
             logger.info("✅ Fixed with Ruff!")
             return TestResponse(
@@ -365,17 +435,20 @@ async def run_tests(request: TestRequest):
             )
     
     # Run initial tests
-    tests_passed, error = run_unit_tests(code, request.problem_id)
+    with timed(timings, "tests"):
+        tests_passed, error = run_unit_tests(code, request.problem_id)
     
     if tests_passed:
         return TestResponse(tests_passed=True, auto_fixed=False)
     
     # TIER 2: Template fixes
     logger.info("🔧 Tier 2: Template logic fixes...")
-    code, template_fixed, fix_desc = template_fix_logic(code, error)
+    with timed(timings, "template"):
+        code, template_fixed, fix_desc = template_fix_logic(code, error)
     
     if template_fixed:
-        tests_passed, error = run_unit_tests(code, request.problem_id)
+        with timed(timings, "tests"):
+            tests_passed, error = run_unit_tests(code, request.problem_id)
         if tests_passed:
             logger.info(f"✅ Fixed with template: {fix_desc}")
             return TestResponse(
@@ -387,10 +460,12 @@ async def run_tests(request: TestRequest):
     
     # TIER 3: Smart analysis
     logger.info("🔧 Tier 3: Smart analysis...")
-    code, smart_fixed = analyze_common_mistakes(code, error)
+    with timed(timings, "smart_analysis"):
+        code, smart_fixed = analyze_common_mistakes(code, error)
     
     if smart_fixed:
-        tests_passed, error = run_unit_tests(code, request.problem_id)
+        with timed(timings, "tests"):
+            tests_passed, error = run_unit_tests(code, request.problem_id)
         if tests_passed:
             logger.info("✅ Fixed with smart analysis!")
             return TestResponse(
@@ -410,9 +485,26 @@ async def run_tests(request: TestRequest):
         fix_method="ai_needed"
     )
 
+@app.on_event("startup")
+def start_sandbox_pool():
+    # Start the workers before the first request instead of during it
+    get_sandbox_pool().start()
+
+@app.on_event("shutdown")
+def stop_sandbox_pool():
+    get_sandbox_pool().shutdown()
+
 @app.get("/health")
 async def health():
-    return {"status": "healthy", "free_tools": True}
+    return {
+        "status": "healthy",
+        "free_tools": True,
+        "sandbox": get_sandbox_pool().stats,
+        "linters": get_lint_backend().stats(),
+        "tier_latency": tier_latency_stats(),
+        "result_cache": get_result_cache().info(),
+        "test_suites": get_suite_registry().info(),
+    }
 
 if __name__ == "__main__":
     import uvicorn
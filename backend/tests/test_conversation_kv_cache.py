@@ -0,0 +1,54 @@
+import pytest
+import torch
+
+from app.services.chat_context import ConversationKVCache
+
+
+def _generate(model, input_ids, **kwargs):
+    with torch.no_grad():
+        return model.generate(
+            input_ids=input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            max_new_tokens=12,
+            do_sample=False,
+            return_dict_in_generate=True,
+            output_scores=True,
+            **kwargs
+        )
+
+
+def test_next_turn_from_cache_matches_uncached_generation(tiny_model):
+    model, tokenizer = tiny_model
+    kv = ConversationKVCache(min_reuse_tokens=4)
+    first = tokenizer(["### Instruction:\nFix the bug in this code.\n\n### Response:\n"], return_tensors="pt")["input_ids"]
+    turn = _generate(model, first)
+    kv.put(1, turn.sequences[0], turn.past_key_values)
+
+    follow_up = tokenizer("\n\n### Instruction:\nprint(add(1, 2))\n\n### Response:\n", add_special_tokens=False, return_tensors="pt")["input_ids"]
+    second = torch.cat([turn.sequences, follow_up], dim=1)
+    cache = kv.take(1, second[0])
+    assert cache is not None and cache.get_seq_length() == turn.sequences.shape[1] - 1
+    assert kv.stats()["conversations"] == 0
+
+    cached = _generate(model, second, past_key_values=cache)
+    uncached = _generate(model, second)
+
+    assert torch.equal(cached.sequences, uncached.sequences)
+    for cached_scores, uncached_scores in zip(cached.scores, uncached.scores):
+        assert torch.allclose(cached_scores, uncached_scores, atol=1e-4)
+
+
+def test_failed_crop_keeps_the_entry():
+    class BrokenCache:
+        def get_seq_length(self):
+            return 9
+
+        def crop(self, length):
+            raise AttributeError("crop")
+
+    kv = ConversationKVCache(min_reuse_tokens=1)
+    kv.put(1, torch.arange(10), BrokenCache())
+
+    with pytest.raises(AttributeError):
+        kv.take(1, torch.arange(12))
+    assert kv.stats()["conversations"] == 1
@@ -0,0 +1,35 @@
+import torch
+
+from app.services.gemma_service import GemmaService
+
+
+def _generate(model, inputs, **kwargs):
+    with torch.no_grad():
+        return model.generate(
+            **inputs,
+            max_new_tokens=20,
+            do_sample=False,
+            return_dict_in_generate=True,
+            output_scores=True,
+            **kwargs
+        )
+
+
+def test_preamble_cache_matches_uncached_generation(tiny_model):
+    model, tokenizer = tiny_model
+    service = GemmaService()
+    service.model, service.tokenizer = model, tokenizer
+    service._build_prefix_caches()
+
+    for prompt in (service._format_prompt("Fix the bug in this code."),
+                   service._format_prompt("Fix the bug in this code.", "def add(a, b):\n    return a - b")):
+        inputs = tokenizer([prompt], return_tensors="pt")
+        cache = service._prefix_cache_for(inputs["input_ids"])
+        assert cache is not None and 0 < cache.get_seq_length() < inputs["input_ids"].shape[1]
+
+        cached = _generate(model, inputs, past_key_values=cache)
+        uncached = _generate(model, inputs)
+
+        assert torch.equal(cached.sequences, uncached.sequences)
+        for cached_scores, uncached_scores in zip(cached.scores, uncached.scores):
+            assert torch.allclose(cached_scores, uncached_scores, atol=1e-4)
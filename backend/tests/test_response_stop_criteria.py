@@ -0,0 +1,64 @@
+import torch
+from transformers import LogitsProcessor, LogitsProcessorList, StoppingCriteriaList
+
+from app.services.gemma_service import GemmaService, ResponseStopCriteria
+from app.services.speculative import SpeculativeRun
+
+
+class _ForceTokens(LogitsProcessor):
+    """Makes generate emit the given token ids in order"""
+
+    def __init__(self, prompt_length, token_ids):
+        self.prompt_length = prompt_length
+        self.token_ids = token_ids
+
+    def __call__(self, input_ids, scores):
+        step = min(input_ids.shape[1] - self.prompt_length, len(self.token_ids) - 1)
+        forced = torch.full_like(scores, float("-inf"))
+        forced[:, self.token_ids[step]] = 0
+        return forced
+
+
+def test_early_stop_is_counted_without_output_scores(tiny_model):
+    model, tokenizer = tiny_model
+    inputs = tokenizer(["### Instruction:\nFix it\n### Response:\n"], return_tensors="pt")
+    prompt_length = inputs["input_ids"].shape[1]
+    response = tokenizer("def add(a, b):\n    return a + b\n### Instruction:", add_special_tokens=False)["input_ids"]
+    criteria = ResponseStopCriteria(tokenizer, prompt_length)
+
+    # No output_scores, so generate hands the criteria scores=None
+    outputs = model.generate(
+        **inputs,
+        max_new_tokens=40,
+        do_sample=False,
+        logits_processor=LogitsProcessorList([_ForceTokens(prompt_length, response)]),
+        stopping_criteria=StoppingCriteriaList([criteria])
+    )
+
+    generated = outputs.shape[1] - prompt_length
+    assert generated < 40
+    assert criteria.stopped_at == {0: generated}
+
+    service = GemmaService()
+    service._record_tokens_saved([criteria.tokens_saved(0, 40)])
+    assert service.stats["early_stops"] == 1
+    assert service.stats["tokens_saved"] == 40 - generated
+
+
+def test_unverified_draft_tokens_do_not_stop_the_row(tiny_model):
+    _, tokenizer = tiny_model
+    prompt = tokenizer("Fix it\n", return_tensors="pt")["input_ids"]
+    run = SpeculativeRun()
+    criteria = ResponseStopCriteria(tokenizer, prompt.shape[1], speculative_run=run)
+
+    def ids(text):
+        return torch.cat([prompt, tokenizer(text, add_special_tokens=False, return_tensors="pt")["input_ids"]], dim=1)
+
+    run.drafting = True
+    assert criteria(ids("print(1)\n###"), None)[0]
+    assert criteria.stopped_at == {}
+
+    # The draft was rejected and the verified text goes on
+    run.drafting = False
+    assert not criteria(ids("print(2)\n"), None)[0]
+    assert criteria.tokens_saved(0, 100) == 0
@@ -0,0 +1,55 @@
+import pytest
+
+import sandbox_pool
+from sandbox_pool import SANDBOX_ERROR_PREFIX, SandboxPool
+
+CODE = "def add(a, b):\n    return a + b\n"
+TESTS = [{"input": (1, 2), "expected": 3}]
+
+
+@pytest.fixture
+def pool():
+    pool = SandboxPool(size=1, timeout=10)
+    yield pool
+    pool.shutdown()
+
+
+def test_late_ready_message_is_skipped(pool, monkeypatch):
+    # Workers miss the startup wait, so their "ready" is still in the pipe
+    monkeypatch.setattr(sandbox_pool, "_READY_TIMEOUT_SECONDS", 0)
+    pool.start()
+
+    assert pool.run(CODE, "add", TESTS) == (True, None)
+    assert pool.run(CODE, "add", TESTS) == (True, None)
+    assert pool.stats["replaced"] == 0
+
+
+def test_unexpected_reply_replaces_the_worker(pool):
+    pool.start()
+    worker = pool._idle.get()
+    worker.conn.send = lambda job: None
+    worker.conn.poll = lambda timeout: True
+    worker.conn.recv = lambda: "garbage"
+    pool._idle.put(worker)
+
+    passed, error = pool.run(CODE, "add", TESTS)
+    assert not passed and error.startswith(SANDBOX_ERROR_PREFIX)
+    assert pool.run(CODE, "add", TESTS) == (True, None)
+
+
+def test_failed_spawn_keeps_the_slot(pool, monkeypatch):
+    pool.start()
+    spawn = pool._spawn
+
+    def failing_spawn():
+        raise OSError("no processes left")
+
+    monkeypatch.setattr(pool, "_spawn", failing_spawn)
+    # The hung worker is killed and cannot be replaced
+    passed, error = pool.run("while True:\n    pass\n", "add", TESTS, timeout=0.2)
+    assert not passed
+    passed, error = pool.run(CODE, "add", TESTS)
+    assert not passed and error.startswith(SANDBOX_ERROR_PREFIX)
+
+    monkeypatch.setattr(pool, "_spawn", spawn)
+    assert pool.run(CODE, "add", TESTS) == (True, None)
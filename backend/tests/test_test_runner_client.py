@@ -0,0 +1,29 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.services import test_runner_client
+from app.services.test_runner_client import UnknownProblemError, test_candidates as run_candidates
+
+
+def test_unknown_problem_is_raised_after_every_request_finished(monkeypatch):
+    finished = []
+
+    async def handler(request):
+        code = request.read().decode()
+        if "first" in code:
+            return httpx.Response(404, json={"detail": "No test suite"})
+        await asyncio.sleep(0.05)
+        finished.append(code)
+        return httpx.Response(200, json={"tests_passed": True})
+
+    client = httpx.AsyncClient
+    monkeypatch.setattr(
+        test_runner_client.httpx, "AsyncClient",
+        lambda **kwargs: client(transport=httpx.MockTransport(handler), **kwargs)
+    )
+
+    with pytest.raises(UnknownProblemError):
+        asyncio.run(run_candidates("nope", ["first", "second", "third"]))
+    assert len(finished) == 2